@@ -0,0 +1,253 @@
+import os
+import time
+import argparse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from Retrieval import Retrieval
+from PostingList import decode_posting_list
+from QueryParser import Phrase, leaves
+from Scoring import SCORING_FUNCTIONS
+
+"""
+Batch query processing for offline evaluation: a file of queries is scored in chunks, term-at-a-time across all
+queries of a chunk, and the rankings are written as a TREC run file (qid Q0 docno rank score tag), with the page URL
+as docno.
+
+Every posting list a chunk needs is read and decoded once per worker process (and kept for the following chunks),
+instead of reloading the whole index for every query like a loop over Retrieval.retrieve does.
+
+    python BatchRetrieval.py --db main.db --queries queries.txt --run run.trec --workers 4
+"""
+
+# ids bound per "IN (...)" query
+IN_CHUNK_SIZE = 500
+
+
+def read_queries(path: str) -> list[tuple[str, str]]:
+    """
+    Returns [(qid, query)]. A line is either "qid<TAB>query" or just the query, numbered by its line.
+    """
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for (line_number, line) in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if "\t" in line:
+                qid, query = line.split("\t", 1)
+                queries.append((qid.strip(), query.strip()))
+            else:
+                queries.append((str(line_number), line))
+    return queries
+
+
+def chunked(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class BatchRetrieval:
+    """
+    Scores many queries against the index of one Retrieval, sharing the decoded posting lists between them.
+    The scores are the same as Retrieval.retrieve's.
+    """
+
+    def __init__(self, db_path: str, max_results: int = 1000, scoring: str = "tfidf"):
+        self.retrieval = Retrieval(db_path, scoring=scoring)
+        self.max_results = max_results
+
+        self.body_inverted_index = {}
+        self.title_inverted_index = {}
+        self.load_all = not self.retrieval.shard_paths and self.retrieval.statistics is None
+        if self.load_all:
+            # live segments are merged on load and an index without statistics tables derives them from all
+            # the postings, so these are loaded as a whole (once)
+            self.body_inverted_index = self.retrieval.load_inverted_index()
+            self.title_inverted_index = self.retrieval.load_title_index()
+        elif not self.retrieval.shard_paths:
+            self.retrieval.posting_store = self.retrieval.load_posting_store()
+        self.collection = None
+        # word IDs already looked up in the tables (decoded or known to be missing)
+        self.loaded_word_ids = set()
+
+    def select_in(self, query: str, ids) -> list[tuple]:
+        # `query` ends with "IN", the ids are bound in chunks of IN_CHUNK_SIZE (the connection is read-only,
+        # so they cannot go through a temporary table)
+        ids = list(ids)
+        rows = []
+        for start in range(0, len(ids), IN_CHUNK_SIZE):
+            chunk = ids[start:start + IN_CHUNK_SIZE]
+            rows += self.retrieval.cursor.execute(f"{query} ({','.join('?' * len(chunk))});", chunk).fetchall()
+        return rows
+
+    def load_postings(self, word_ids: set[str]) -> None:
+        # decode the posting lists of word IDs this process has not seen yet
+        if self.load_all:
+            return
+        missing = word_ids - self.loaded_word_ids
+        if not missing:
+            return
+        for (table, inverted_index) in (("body_inverted_index", self.body_inverted_index),
+                                        ("title_inverted_index", self.title_inverted_index)):
+            for (word_id, value) in self.select_in(f"SELECT wordId, value FROM {table} WHERE wordId IN", missing):
+                inverted_index[word_id] = decode_posting_list(value, self.retrieval.posting_store)
+        self.loaded_word_ids |= missing
+
+    def run(self, queries: list[tuple[str, str]]) -> list[tuple[str, list[tuple[str, float]]]]:
+        """
+        Returns [(qid, [(url, score)])] for the given queries, ranked like Retrieval.retrieve.
+        """
+        retrieval = self.retrieval
+        if retrieval.shard_paths:
+            # the shards already score every query in parallel
+            return [(qid, [(result["url"], result["score"]) for result in retrieval.retrieve(query, self.max_results)])
+                    for (qid, query) in queries]
+
+        parsed = [retrieval.analyze_query(query) for (_, query) in queries]
+        word_ids = set()
+        for (query_word_ids, phrase_word_ids_list, query_tree) in parsed:
+            word_ids.update(query_word_ids)
+            for phrase_word_ids in phrase_word_ids_list:
+                word_ids.update(phrase_word_ids)
+            # negated words of a boolean query are needed to evaluate it
+            word_ids.update(word_id for (leaf, _) in leaves(query_tree)
+                            for word_id in (leaf.text if isinstance(leaf, Phrase) else (leaf.text,)) if word_id is not None)
+        self.load_postings(word_ids)
+
+        doc_scores = self.score_batch(parsed)
+        runs = []
+        ranked_doc_ids = set()
+        for ((qid, _), scores) in zip(queries, doc_scores):
+            ranked_docs = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:self.max_results]
+            ranked_doc_ids.update(doc_id for (doc_id, _) in ranked_docs)
+            runs.append((qid, ranked_docs))
+
+        # like Retrieval.fetch_results, documents without a URL are left out
+        urls = self.resolve_urls(ranked_doc_ids)
+        return [(qid, [(urls[doc_id], score) for (doc_id, score) in ranked_docs if urls.get(doc_id)])
+                for (qid, ranked_docs) in runs]
+
+    def score_batch(self, parsed: list[tuple]) -> list[dict]:
+        """
+        Term-at-a-time over the whole batch: the weights of a term's postings are computed once and added
+        to the accumulator of every query that contains the term.
+        """
+        retrieval = self.retrieval
+        body_inverted_index = self.body_inverted_index
+        title_inverted_index = self.title_inverted_index
+        if self.collection is None:
+            self.collection = retrieval.collection_statistics(body_inverted_index)
+        document_lengths = retrieval.document_lengths(body_inverted_index) if retrieval.scoring.needs_document_lengths else {}
+
+        # boolean queries restrict their documents first, they are scored one by one below
+        query_vectors = [retrieval.build_query_vector(query_word_ids, body_inverted_index) if query_tree is None else {}
+                         for (query_word_ids, _, query_tree) in parsed]
+        queries_of_term = defaultdict(list)
+        for (query_index, query_vector) in enumerate(query_vectors):
+            for (word_id, query_weight) in query_vector.items():
+                queries_of_term[word_id].append((query_index, query_weight))
+
+        term_statistics = retrieval.term_statistics(queries_of_term, body_inverted_index)
+        accumulators = [defaultdict(float) for _ in parsed]
+        for (word_id, query_weights) in queries_of_term.items():
+            doc_count, max_tf = term_statistics[word_id]
+            term_weight = retrieval.scoring.term_weight(doc_count, max_tf, self.collection)
+            weights = [(doc_id, term_weight(frequency, document_lengths.get(doc_id, self.collection.average_length)))
+                       for (doc_id, frequency) in zip(body_inverted_index[word_id], body_inverted_index[word_id].frequencies)]
+            title_docs = list(title_inverted_index.get(word_id, ()))
+            for (query_index, query_weight) in query_weights:
+                doc_scores = accumulators[query_index]
+                for (doc_id, tfidf) in weights:
+                    doc_scores[doc_id] += query_weight * tfidf
+                # boost score if word is in title
+                for doc_id in title_docs:
+                    doc_scores[doc_id] += 7
+
+        # phrases are matched once per distinct phrase of the batch
+        phrase_docs = {}
+        for ((_, phrase_word_ids_list, query_tree), doc_scores) in zip(parsed, accumulators):
+            if not phrase_word_ids_list or query_tree is not None:
+                continue
+            for phrase_word_ids in phrase_word_ids_list:
+                key = tuple(phrase_word_ids)
+                if key not in phrase_docs:
+                    phrase_docs[key] = (retrieval.phrase_in_postings(phrase_word_ids, body_inverted_index),
+                                        retrieval.phrase_in_postings(phrase_word_ids, title_inverted_index))
+            phrase_body_docs = [phrase_docs[tuple(phrase_word_ids)][0] for phrase_word_ids in phrase_word_ids_list]
+            phrase_title_docs = [phrase_docs[tuple(phrase_word_ids)][1] for phrase_word_ids in phrase_word_ids_list]
+            docs_with_phrases = set.intersection(*(body_docs | title_docs for body_docs, title_docs in zip(phrase_body_docs, phrase_title_docs)))
+            retrieval.boost_phrases(doc_scores, (phrase_body_docs, phrase_title_docs, docs_with_phrases))
+
+        for doc_scores in accumulators:
+            retrieval.add_link_scores(doc_scores)
+
+        for (query_index, (query_word_ids, phrase_word_ids_list, query_tree)) in enumerate(parsed):
+            if query_tree is not None:
+                statistics = retrieval.term_statistics(set(query_word_ids), body_inverted_index)
+                accumulators[query_index] = retrieval.score_documents(
+                    retrieval.build_query_vector(query_word_ids, statistics), phrase_word_ids_list,
+                    body_inverted_index, title_inverted_index, statistics, self.collection, query_tree)
+        return accumulators
+
+    def resolve_urls(self, doc_ids: set[str]) -> dict[str, str]:
+        return dict(self.select_in("SELECT urlId, url FROM id_to_url WHERE urlId IN", doc_ids))
+
+
+# one BatchRetrieval per worker process, so decoded posting lists are reused by all chunks of that worker
+_worker = None
+
+
+def _init_worker(db_path: str, max_results: int, scoring: str) -> None:
+    global _worker
+    _worker = BatchRetrieval(db_path, max_results, scoring)
+
+
+def _run_chunk(queries: list[tuple[str, str]]):
+    return _worker.run(queries)
+
+
+def run_batch(db_path: str, queries: list[tuple[str, str]], max_results: int = 1000, workers: int = 1, chunk_size: int = 200,
+              scoring: str = "tfidf"):
+    """
+    Yields (qid, [(url, score)]) in the order of `queries` as soon as each chunk is scored.
+    """
+    chunks = chunked(queries, chunk_size)
+    if workers <= 1:
+        batch = BatchRetrieval(db_path, max_results, scoring)
+        for chunk in chunks:
+            yield from batch.run(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db_path, max_results, scoring)) as pool:
+        for chunk_runs in pool.map(_run_chunk, chunks):
+            yield from chunk_runs
+
+
+def write_trec_run(runs, file, tag: str = "search-engine") -> int:
+    # TREC run format: qid Q0 docno rank score tag
+    count = 0
+    for (qid, ranked) in runs:
+        for (rank, (url, score)) in enumerate(ranked, 1):
+            file.write(f"{qid} Q0 {url} {rank} {score:.6f} {tag}\n")
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a file of queries against the index and write a TREC run file.")
+    parser.add_argument("--db", default="main.db")
+    parser.add_argument("--queries", required=True, help='one query per line, optionally as "qid<TAB>query"')
+    parser.add_argument("--run", default="run.trec", help="output TREC run file")
+    parser.add_argument("--tag", default="search-engine", help="run tag of the TREC run file")
+    parser.add_argument("--max-results", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=200, help="queries scored together, term-at-a-time")
+    parser.add_argument("--scoring", choices=sorted(SCORING_FUNCTIONS), default="tfidf")
+    args = parser.parse_args()
+
+    queries = read_queries(args.queries)
+    start_time = time.perf_counter()
+    with open(args.run, "w", encoding="utf-8") as f:
+        count = write_trec_run(run_batch(args.db, queries, args.max_results, args.workers, args.chunk_size, args.scoring), f, args.tag)
+    elapsed = time.perf_counter() - start_time
+    print(f"{count} queries in {elapsed:.2f} seconds ({count / elapsed:.1f} queries/second), run written to {args.run}")
@@ -0,0 +1,206 @@
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from QueryParser import Term, Phrase, Or, Not
+from QueryPlanner import PlanStep
+
+"""
+Evaluation of a boolean query tree (see QueryParser.py) over the sorted dense document IDs of the posting lists
+(PostingList.doc_ids).
+
+Conjunctions are evaluated rarest-first: the operand with the fewest documents is evaluated first and every further
+operand only has to confirm its candidates, by galloping (exponential) search through the longer array. An AND stops
+as soon as the candidates run out, so the remaining operands are never evaluated, and a phrase operand is only
+matched in the candidates left. Disjunctions merge their operands and NOT is a difference, against all documents of
+the index if nothing else restricts it.
+"""
+
+
+def gallop(doc_ids, target: int, start: int) -> int:
+    """
+    Index of the first entry of the sorted `doc_ids` at or after `start` that is >= `target` (len(doc_ids) if none):
+    steps of doubling size, then a binary search inside the last step.
+    """
+    end = len(doc_ids)
+    step = 1
+    while start + step < end and doc_ids[start + step] < target:
+        start += step
+        step *= 2
+    return bisect_left(doc_ids, target, start, min(start + step + 1, end))
+
+
+def intersect(shorter, longer) -> array:
+    result = array("I")
+    position = 0
+    end = len(longer)
+    for doc_id in shorter:
+        position = gallop(longer, doc_id, position)
+        if position == end:
+            break
+        if longer[position] == doc_id:
+            result.append(doc_id)
+            position += 1
+    return result
+
+
+def difference(doc_ids, excluded) -> array:
+    result = array("I")
+    position = 0
+    end = len(excluded)
+    for doc_id in doc_ids:
+        if position < end:
+            position = gallop(excluded, doc_id, position)
+            if position < end and excluded[position] == doc_id:
+                continue
+        result.append(doc_id)
+    return result
+
+
+def union(doc_id_lists: list) -> array:
+    if len(doc_id_lists) == 1:
+        return doc_id_lists[0]
+    return array("I", sorted(set().union(*doc_id_lists)))
+
+
+def matching_rows(doc_ids, candidates) -> list[int]:
+    """
+    Rows of the sorted `doc_ids` whose document is in the sorted `candidates`, galloping through the longer of both.
+    """
+    rows = []
+    if len(candidates) < len(doc_ids):
+        row = 0
+        end = len(doc_ids)
+        for doc_id in candidates:
+            row = gallop(doc_ids, doc_id, row)
+            if row == end:
+                break
+            if doc_ids[row] == doc_id:
+                rows.append(row)
+                row += 1
+    else:
+        position = 0
+        end = len(candidates)
+        for (row, doc_id) in enumerate(doc_ids):
+            position = gallop(candidates, doc_id, position)
+            if position == end:
+                break
+            if candidates[position] == doc_id:
+                rows.append(row)
+    return rows
+
+
+def restricted_postings(postings, candidates):
+    # (url_id, frequency) of the postings of the candidate documents, like zip(postings, postings.frequencies)
+    url_ids = postings.store.url_ids
+    doc_ids = postings.doc_ids
+    frequencies = postings.frequencies
+    for row in matching_rows(doc_ids, candidates):
+        yield (url_ids[doc_ids[row]], frequencies[row])
+
+
+class BooleanEvaluator:
+    """
+    Evaluates a query tree whose leaves were mapped to word IDs by Retrieval.resolve_query_tree:
+    Term(word_id, field) and Phrase(word_ids, field), with None for words that are not in the index.
+    """
+
+    def __init__(self, body_inverted_index: dict, title_inverted_index: dict, store, phrase_in_postings, plan=None):
+        self.body_inverted_index = body_inverted_index
+        self.title_inverted_index = title_inverted_index
+        self.store = store
+        # Retrieval.phrase_in_postings, returns the URL IDs of the documents containing the phrase
+        self.phrase_in_postings = phrase_in_postings
+        # QueryPlan recording the operands of the conjunctions (see QueryPlanner.py)
+        self.plan = plan
+        self._all_documents = None
+
+    def all_documents(self) -> array:
+        if self._all_documents is None:
+            self._all_documents = array("I", range(len(self.store.url_ids)))
+        return self._all_documents
+
+    def indexes(self, field):
+        # a word without a field matches the body or the title
+        if field == "title":
+            return (self.title_inverted_index,)
+        return (self.body_inverted_index, self.title_inverted_index)
+
+    def estimate(self, tree) -> int:
+        # upper bound of the number of matching documents, without evaluating anything
+        if isinstance(tree, Term):
+            return sum(len(index.get(tree.text, ())) for index in self.indexes(tree.field))
+        if isinstance(tree, Phrase):
+            return min(self.estimate(Term(word_id, tree.field)) for word_id in tree.text)
+        if isinstance(tree, Not):
+            return len(self.store.url_ids)
+        estimates = [self.estimate(item) for item in tree.items]
+        return sum(estimates) if isinstance(tree, Or) else min(estimates)
+
+    def evaluate(self, tree) -> array:
+        """
+        Returns the sorted dense IDs of the documents matching the tree.
+        """
+        if isinstance(tree, Term):
+            return union([index[tree.text].doc_ids for index in self.indexes(tree.field) if tree.text in index] or [array("I")])
+        if isinstance(tree, Phrase):
+            return self.evaluate_phrase(tree)
+        if isinstance(tree, Not):
+            return difference(self.all_documents(), self.evaluate(tree.item))
+        if isinstance(tree, Or):
+            return union([self.evaluate(item) for item in tree.items])
+        return self.evaluate_and(tree.items)
+
+    def evaluate_and(self, items) -> array:
+        positives = sorted((item for item in items if not isinstance(item, Not)), key=self.estimate)
+        negatives = [item.item for item in items if isinstance(item, Not)]
+
+        candidates = None
+        for item in positives:
+            if candidates is not None and not candidates:
+                self.skip(item, "no candidates left")
+                continue
+            with self.step(item) as step:
+                if candidates is None:
+                    candidates = self.evaluate(item)
+                elif isinstance(item, Phrase):
+                    # the phrase filter is pushed down: it only has to confirm the candidates
+                    candidates = self.evaluate_phrase(item, candidates)
+                else:
+                    doc_ids = self.evaluate(item)
+                    candidates = intersect(candidates, doc_ids) if len(candidates) <= len(doc_ids) else intersect(doc_ids, candidates)
+                step.documents = len(candidates)
+        if candidates is None:
+            candidates = self.all_documents()
+
+        for item in negatives:
+            if not candidates:
+                self.skip(item, "no candidates left", "and not")
+                continue
+            with self.step(item, "and not") as step:
+                candidates = difference(candidates, self.evaluate(item))
+                step.documents = len(candidates)
+        return candidates
+
+    def evaluate_phrase(self, phrase, candidates=None) -> array:
+        if None in phrase.text:
+            return array("I")
+        dense_ids = self.store.dense_ids
+        url_ids = set()
+        if candidates is not None:
+            all_url_ids = self.store.url_ids
+            candidates = {all_url_ids[dense_id] for dense_id in candidates}
+        for index in self.indexes(phrase.field):
+            url_ids |= self.phrase_in_postings(list(phrase.text), index, candidates)
+        return array("I", sorted(dense_ids[url_id] for url_id in url_ids))
+
+    @contextmanager
+    def step(self, item, operation: str = "and"):
+        if self.plan is None:
+            yield PlanStep(operation, item, 0)
+            return
+        with self.plan.step(operation, item, self.estimate(item)) as step:
+            yield step
+
+    def skip(self, item, note: str, operation: str = "and") -> None:
+        if self.plan is not None:
+            self.plan.skip(operation, item, self.estimate(item), note)
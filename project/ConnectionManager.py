@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import threading
+from Generations import current_database
+
+"""
+SQLite connections for serving and crawling the same database concurrently.
+
+Readers (Retrieval, the web workers) get one read-only connection per thread, opened once and reused by every
+Retrieval of that thread: `mode=ro` + `query_only`, a large page cache, memory-mapped I/O and a larger prepared
+statement cache. The crawler gets a single writer connection in WAL mode, so readers never block on it (and it never
+blocks on them), with `synchronous=NORMAL` and a bounded WAL that is checkpointed at the end of a crawl.
+"""
+
+# negative cache_size is in KiB
+READER_CACHE_KB = 64 * 1024
+READER_MMAP_BYTES = 256 * 1024 * 1024
+WRITER_CACHE_KB = 32 * 1024
+# pages of WAL after which a commit checkpoints it back into the database (SQLite's default is 1000)
+WAL_AUTOCHECKPOINT_PAGES = 4000
+# prepared statements kept per connection, the search path runs the same few parameterized queries over and over
+CACHED_STATEMENTS = 256
+BUSY_TIMEOUT_SECONDS = 30
+
+
+class ConnectionManager:
+    def __init__(self, db_path: str):
+        self.db_path = os.path.abspath(db_path)
+        self.local = threading.local()
+        # {thread: reader connection}, so the connections of finished threads can be closed
+        self.readers: dict[threading.Thread, sqlite3.Connection] = {}
+        self.writer_connection = None
+        self.lock = threading.Lock()
+
+    def reader(self) -> sqlite3.Connection:
+        """
+        Returns the read-only connection of the calling thread.
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=BUSY_TIMEOUT_SECONDS,
+                                         check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+            connection.execute("PRAGMA query_only=ON;")
+            connection.execute(f"PRAGMA cache_size=-{READER_CACHE_KB};")
+            connection.execute(f"PRAGMA mmap_size={READER_MMAP_BYTES};")
+            self.local.connection = connection
+            with self.lock:
+                self.close_finished_readers()
+                self.readers[threading.current_thread()] = connection
+        return connection
+
+    def writer(self) -> sqlite3.Connection:
+        """
+        Returns the single writer connection (shared by the crawler's threads).
+        """
+        with self.lock:
+            if self.writer_connection is None:
+                connection = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False,
+                                             cached_statements=CACHED_STATEMENTS)
+                connection.execute("PRAGMA journal_mode=WAL;")
+                # with WAL, NORMAL only syncs at checkpoints: a power loss can lose the last commits, never corrupt
+                connection.execute("PRAGMA synchronous=NORMAL;")
+                connection.execute(f"PRAGMA cache_size=-{WRITER_CACHE_KB};")
+                connection.execute(f"PRAGMA wal_autocheckpoint={WAL_AUTOCHECKPOINT_PAGES};")
+                self.writer_connection = connection
+            return self.writer_connection
+
+    def checkpoint(self, mode: str = "TRUNCATE") -> None:
+        # moves the WAL into the database file, TRUNCATE also resets the WAL file to zero bytes
+        if self.writer_connection is not None:
+            self.writer_connection.commit()
+            self.writer_connection.execute(f"PRAGMA wal_checkpoint({mode});")
+
+    def close_reader(self) -> None:
+        # closes the reader of the calling thread
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            self.local.connection = None
+            with self.lock:
+                self.readers.pop(threading.current_thread(), None)
+            connection.close()
+
+    def close_finished_readers(self) -> None:
+        for thread in [thread for thread in self.readers if not thread.is_alive()]:
+            self.readers.pop(thread).close()
+
+    def close(self) -> None:
+        with self.lock:
+            for connection in self.readers.values():
+                connection.close()
+            self.readers.clear()
+            if self.writer_connection is not None:
+                self.writer_connection.close()
+                self.writer_connection = None
+        self.local = threading.local()
+
+
+# one manager per database file and process
+_managers: dict[str, ConnectionManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_connection_manager(db_path: str) -> ConnectionManager:
+    path = os.path.abspath(db_path)
+    with _managers_lock:
+        manager = _managers.get(path)
+        if manager is None:
+            manager = _managers[path] = ConnectionManager(path)
+        return manager
+
+
+# {database path: manager of the generation this thread read last}
+_thread_generations = threading.local()
+
+
+def get_reader(db_path: str) -> sqlite3.Connection:
+    """
+    Returns the read-only connection of the calling thread to the published generation of `db_path`
+    (see Generations.py). Once a new generation is published, the thread's connection to the previous one is closed.
+    """
+    manager = get_connection_manager(current_database(db_path))
+    if not hasattr(_thread_generations, "managers"):
+        _thread_generations.managers = {}
+    previous = _thread_generations.managers.get(os.path.abspath(db_path))
+    if previous is not None and previous is not manager:
+        previous.close_reader()
+        with _managers_lock:
+            if not previous.readers and previous.writer_connection is None:
+                _managers.pop(previous.db_path, None)
+    _thread_generations.managers[os.path.abspath(db_path)] = manager
+    return manager.reader()
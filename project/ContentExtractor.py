@@ -5,14 +5,22 @@ import re
 
 class ContentExtractor:
     def __init__(self):
-        pass
+        # the title, body text and links of a page are read from one parse
+        self.last_page = None
+        self.last_soup = None
+
+    def parse(self, page: str) -> BeautifulSoup:
+        if page is not self.last_page:
+            self.last_soup = BeautifulSoup(page, 'html.parser')
+            self.last_page = page
+        return self.last_soup
 
     def getTitle(self, page: str) -> str:
-        soup = BeautifulSoup(page, 'html.parser')
+        soup = self.parse(page)
         return soup.title.string if soup.title else ""
 
     def getBodyText(self, page: str) -> str:
-        soup = BeautifulSoup(page, 'html.parser')
+        soup = self.parse(page)
         body = soup.find('body')
         return body.get_text(separator=' ') if body else ""
 
@@ -26,7 +34,7 @@ class ContentExtractor:
         return headers.get('Date', '')
 
     def getLinks(self, baseUrl: str, page: str) -> list[str]:
-        soup = BeautifulSoup(page, 'html.parser')
+        soup = self.parse(page)
         links = []
         for link in soup.find_all('a'):
             href = link.get('href')
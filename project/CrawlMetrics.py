@@ -0,0 +1,88 @@
+import json
+import time
+from Metrics import MetricsRegistry, StageTimer
+
+
+class CrawlMetrics:
+    """
+    Instrumentation of one crawl: fetch latency and bytes, time spent in every pipeline stage
+    (parse, stem, index, store, url_db, flush_batch), worker idle time, frontier size, pages waiting for the persister
+    and errors by type. report() appends a JSON line with the current numbers, summary() prints the totals at the end
+    of the crawl.
+
+    parse and stem run on the event loop, the other stages on the persister thread (see Persister.py); the time the
+    workers waited for room in its queue is counted as persist_wait.
+    """
+
+    def __init__(self, output_path: str | None = None):
+        self.registry = MetricsRegistry()
+        self.timer = StageTimer("crawl_stage_seconds", self.registry)
+        self.start_time = time.time()
+        # JSON lines go to stdout unless a file is given
+        self.output_path = output_path
+        self.errors = {}
+
+    def span(self, stage: str):
+        return self.timer.span(stage)
+
+    def fetched(self, seconds: float, num_bytes: int) -> None:
+        self.registry.observe("crawl_fetch_seconds", seconds)
+        self.registry.increment("crawl_bytes_total", num_bytes)
+
+    def error(self, kind: str) -> None:
+        self.registry.increment("crawl_errors_total", labels={"type": kind})
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def idle(self, seconds: float) -> None:
+        self.registry.increment("crawl_worker_idle_seconds", seconds)
+
+    def persist_wait(self, seconds: float) -> None:
+        self.registry.increment("crawl_persist_wait_seconds", seconds)
+
+    def snapshot(self, pages: int, frontier_size: int, pending_pages: int = 0) -> dict:
+        elapsed = time.time() - self.start_time
+        self.registry.set_gauge("crawl_frontier_size", frontier_size)
+        self.registry.set_gauge("crawl_pending_pages", pending_pages)
+        metrics = self.registry.snapshot()
+        fetch = metrics["histograms"].get("crawl_fetch_seconds", {})
+        return {
+            "elapsed": round(elapsed, 3),
+            "pages": pages,
+            "pages_per_second": round(pages / elapsed, 2) if elapsed else 0.0,
+            "frontier_size": frontier_size,
+            "pending_pages": pending_pages,
+            "bytes": metrics["counters"].get("crawl_bytes_total", 0),
+            "fetch_p50_ms": round(fetch.get("p50", 0.0) * 1000, 2),
+            "fetch_p95_ms": round(fetch.get("p95", 0.0) * 1000, 2),
+            # copied first, the persister thread may add a stage meanwhile
+            "stage_seconds": {stage: round(seconds, 3) for (stage, seconds) in dict(self.timer.stages).items()},
+            "worker_idle_seconds": round(metrics["counters"].get("crawl_worker_idle_seconds", 0.0), 3),
+            "persist_wait_seconds": round(metrics["counters"].get("crawl_persist_wait_seconds", 0.0), 3),
+            "errors": dict(self.errors),
+        }
+
+    def report(self, pages: int, frontier_size: int, pending_pages: int = 0) -> None:
+        line = json.dumps(self.snapshot(pages, frontier_size, pending_pages))
+        if self.output_path is None:
+            print(line, flush=True)
+        else:
+            with open(self.output_path, "a") as f:
+                f.write(line + "\n")
+
+    def summary(self, pages: int, frontier_size: int) -> None:
+        snapshot = self.snapshot(pages, frontier_size)
+        print("Crawl Metrics:")
+        print(f"  pages: {snapshot['pages']} ({snapshot['pages_per_second']} pages/s), "
+              f"{snapshot['bytes'] / 1024 / 1024:.2f} MB downloaded")
+        print(f"  fetch latency: p50 {snapshot['fetch_p50_ms']} ms, p95 {snapshot['fetch_p95_ms']} ms")
+        print(f"  frontier size at the end: {snapshot['frontier_size']}")
+        print(f"  worker idle time (summed over workers): {snapshot['worker_idle_seconds']} s")
+        print(f"  time waiting for the persister (summed over workers): {snapshot['persist_wait_seconds']} s")
+        print("  time per stage:")
+        for (stage, seconds) in sorted(snapshot["stage_seconds"].items(), key=lambda item: item[1], reverse=True):
+            print(f"    {stage}: {seconds} s")
+        if snapshot["errors"]:
+            print("  errors:")
+            for (kind, count) in snapshot["errors"].items():
+                print(f"    {kind}: {count}")
+        print()
@@ -0,0 +1,197 @@
+import json
+import zlib
+import sqlite3
+from array import array
+
+"""
+Compressed store of the fetched pages, written by the Spider next to the index so that the index can be rebuilt
+without crawling again (see reindex.py):
+
+    document_blocks(blockId, data)                   zlib-compressed blocks of consecutive page records
+    document_offsets(urlId, blockId, offset, length) where the record of a page lives inside its (uncompressed) block
+
+A record is the JSON of {"url", "headers", "text"}, with only the headers the ContentExtractor reads. Pages are
+compressed together in blocks of about BLOCK_SIZE bytes, which compresses much better than page by page; a single
+page is read by decompressing its block.
+"""
+
+# uncompressed size of a block
+BLOCK_SIZE = 256 * 1024
+# the headers used by ContentExtractor.getLastModDate / getPagesize
+STORED_HEADERS = ("Last-Modified", "Date", "Content-Length")
+
+
+class DocumentStore:
+    def __init__(self, connection: sqlite3.Connection, block_size: int = BLOCK_SIZE):
+        # writes go through the connection of the caller and are committed with its transaction
+        self.connection = connection
+        self.block_size = block_size
+        self.pending = []
+        self.pending_size = 0
+        # the last block read, pages are mostly read in block order
+        self.cached_block = (None, b"")
+
+    def create_tables(self) -> None:
+        self.connection.execute("CREATE TABLE IF NOT EXISTS document_blocks(blockId INTEGER PRIMARY KEY, data BLOB);")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS document_offsets(urlId TEXT PRIMARY KEY, blockId INTEGER, "
+                                "offset INTEGER, length INTEGER);")
+
+    def clear(self) -> None:
+        self.create_tables()
+        self.connection.execute("DELETE FROM document_blocks;")
+        self.connection.execute("DELETE FROM document_offsets;")
+        self.pending = []
+        self.pending_size = 0
+        self.cached_block = (None, b"")
+
+    def add(self, url_id: str, url: str, headers, text: str) -> None:
+        """
+        Buffers the page and writes the block once it is full. A page stored again replaces the old record.
+        """
+        record = json.dumps({"url": url, "headers": {name: headers[name] for name in STORED_HEADERS if name in headers},
+                             "text": text}, ensure_ascii=False).encode("utf-8")
+        self.pending.append((url_id, record))
+        self.pending_size += len(record)
+        if self.pending_size >= self.block_size:
+            self.flush()
+
+    def flush(self) -> None:
+        # writes the buffered pages as one block (the last block of a crawl is smaller than the others)
+        if not self.pending:
+            return
+        offsets = []
+        offset = 0
+        for (url_id, record) in self.pending:
+            offsets.append((url_id, offset, len(record)))
+            offset += len(record)
+        data = zlib.compress(b"".join(record for (_, record) in self.pending), 6)
+
+        block_id = self.connection.execute("INSERT INTO document_blocks(data) VALUES(?);", (data,)).lastrowid
+        self.connection.executemany("INSERT OR REPLACE INTO document_offsets VALUES(?, ?, ?, ?);",
+                                    [(url_id, block_id, offset, length) for (url_id, offset, length) in offsets])
+        self.pending = []
+        self.pending_size = 0
+
+    def read_block(self, block_id: int) -> bytes:
+        if self.cached_block[0] != block_id:
+            row = self.connection.execute("SELECT data FROM document_blocks WHERE blockId = ?;", (block_id,)).fetchone()
+            self.cached_block = (block_id, zlib.decompress(row[0]) if row else b"")
+        return self.cached_block[1]
+
+    def get(self, url_id: str) -> dict | None:
+        """
+        Returns {"url", "headers", "text"} of the page, or None if it was not stored.
+        """
+        try:
+            row = self.connection.execute("SELECT blockId, offset, length FROM document_offsets WHERE urlId = ?;",
+                                          (url_id,)).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        if row is None:
+            return None
+        block_id, offset, length = row
+        return json.loads(self.read_block(block_id)[offset:offset + length])
+
+    def block_ids(self) -> list[int]:
+        # blocks that still hold at least one current record, in crawl order
+        try:
+            return [block_id for (block_id,) in self.connection.execute(
+                "SELECT DISTINCT blockId FROM document_offsets ORDER BY blockId;").fetchall()]
+        except sqlite3.OperationalError:
+            return []
+
+    def block_documents(self, block_id: int) -> list[tuple[str, dict]]:
+        # [(url_id, record)] of the current records of one block
+        rows = self.connection.execute("SELECT urlId, offset, length FROM document_offsets WHERE blockId = ? ORDER BY offset;",
+                                       (block_id,)).fetchall()
+        data = self.read_block(block_id)
+        return [(url_id, json.loads(data[offset:offset + length])) for (url_id, offset, length) in rows]
+
+    def copy_from(self, schema: str) -> None:
+        """
+        Appends the store of an attached database (e.g. a partial database of ParallelSpider), with its block IDs
+        moved after ours.
+        """
+        self.create_tables()
+        first_block_id = self.connection.execute("SELECT COALESCE(MAX(blockId), 0) FROM document_blocks;").fetchone()[0]
+        self.connection.execute(f"INSERT INTO document_blocks SELECT blockId + ?, data FROM {schema}.document_blocks;",
+                                (first_block_id,))
+        self.connection.execute(f"INSERT OR REPLACE INTO document_offsets SELECT urlId, blockId + ?, offset, length "
+                                f"FROM {schema}.document_offsets;", (first_block_id,))
+
+
+class TokenStore:
+    """
+    Compact word sequence of every page body, for snippets (see Snippets.py):
+
+        document_tokens(urlId, words, keptIndexes)
+
+    `words` is the zlib-compressed, newline-separated body words as split by the ContentExtractor, `keptIndexes` the index
+    in `words` of every word that is not a stopword, as an array('I'), so that index position p of the postings is
+    word keptIndexes[p] and a snippet is cut out without parsing the page again.
+
+        word_surface_forms(word, surface)
+
+    keeps, for every stem of the body words, the (lower-case) word it was first seen as, so that a stem can be shown
+    as a word (e.g. "did you mean" suggestions).
+    """
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+        # stems whose surface form this store already wrote
+        self.recorded_stems = set()
+
+    def create_tables(self) -> None:
+        self.connection.execute("CREATE TABLE IF NOT EXISTS document_tokens(urlId TEXT PRIMARY KEY, words BLOB, keptIndexes BLOB);")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS word_surface_forms(word TEXT PRIMARY KEY, surface TEXT);")
+
+    def clear(self) -> None:
+        self.create_tables()
+        self.connection.execute("DELETE FROM document_tokens;")
+        self.connection.execute("DELETE FROM word_surface_forms;")
+        self.recorded_stems.clear()
+
+    def add(self, url_id: str, words: list[str], kept_indexes: list[int], stems: list[str] | None = None) -> None:
+        """
+        Stores the body words of a page; `stems` are the stemmed kept words (stems[p] is words[kept_indexes[p]]),
+        their surface forms are recorded as well.
+        """
+        self.connection.execute("INSERT OR REPLACE INTO document_tokens VALUES(?, ?, ?);",
+                                (url_id, zlib.compress("\n".join(words).encode("utf-8")), array("I", kept_indexes).tobytes()))
+        if stems is None:
+            return
+        surface_forms = {}
+        for (stem, index) in zip(stems, kept_indexes):
+            if stem not in self.recorded_stems and stem not in surface_forms:
+                surface_forms[stem] = words[index].lower()
+        if surface_forms:
+            self.connection.executemany("INSERT OR IGNORE INTO word_surface_forms VALUES(?, ?);", surface_forms.items())
+            self.recorded_stems.update(surface_forms)
+
+    def surface_forms(self, stems: list[str]) -> dict[str, str]:
+        # {stem: surface form} of the stems that have one
+        if not stems:
+            return {}
+        try:
+            return dict(self.connection.execute(f"SELECT word, surface FROM word_surface_forms WHERE word IN ({','.join('?' * len(stems))});",
+                                                stems).fetchall())
+        except sqlite3.OperationalError:
+            # indexed before the surface forms were kept
+            return {}
+
+    def get(self, url_id: str) -> tuple[list[str], array] | None:
+        # (words, kept indexes) of the page, or None if they were not stored
+        try:
+            row = self.connection.execute("SELECT words, keptIndexes FROM document_tokens WHERE urlId = ?;", (url_id,)).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        if row is None:
+            return None
+        kept_indexes = array("I")
+        kept_indexes.frombytes(row[1])
+        return zlib.decompress(row[0]).decode("utf-8").split("\n"), kept_indexes
+
+    def copy_from(self, schema: str) -> None:
+        self.create_tables()
+        self.connection.execute(f"INSERT OR REPLACE INTO document_tokens SELECT * FROM {schema}.document_tokens;")
+        self.connection.execute(f"INSERT OR IGNORE INTO word_surface_forms SELECT * FROM {schema}.word_surface_forms;")
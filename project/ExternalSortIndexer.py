@@ -0,0 +1,189 @@
+import os
+import heapq
+import shutil
+import sqlite3
+import tempfile
+from itertools import groupby
+from Indexer import Indexer, encode_postings
+from PostingList import PostingStore
+from Statistics import StatisticsBuilder
+from SimilarPages import SimilarityIndex
+
+# rough in-memory cost of the index dicts, used to decide when to spill a run
+POSTING_BYTES = 12  # dense document ID, frequency and offset columns of a PostingList
+POSITION_BYTES = 4  # one entry of the shared positions array
+FORWARD_BYTES = 36  # one word ID reference in a forward index list
+
+
+class ExternalSortIndexer(Indexer):
+    """
+    Indexer with a bounded memory footprint for large crawls.
+    The in-memory index dicts only hold the current run: once they exceed `memory_budget_mb`, they are written
+    to a temporary file as a sorted run of (term, doc, positions) records and cleared.
+    finalize() k-way merges all runs straight into the index tables.
+    """
+
+    def __init__(self, db_connection: sqlite3.Connection, memory_budget_mb: float = 256, temp_dir: str | None = None):
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.estimated_memory = 0
+        self.temp_dir = temp_dir
+        self.run_dir = None
+        self.run_count = 0
+
+        # crawl order of the documents, so the merged postings keep the same order as the in-memory Indexer
+        self.doc_sequence = {}
+        # words created since the vocabulary tables were last written
+        self.new_words = []
+
+        super().__init__(db_connection)
+
+    def prepareIndexTables(self) -> None:
+        super().prepareIndexTables()
+        # the index tables are rebuilt from the runs by finalize(), the old postings are never loaded
+        self.body_inverted_index = {}
+        self.title_inverted_index = {}
+        self.forward_index = {}
+        self.posting_store = PostingStore()
+
+
+    # building, with a spill check after every document
+
+    def addNewWord(self, words: list[str]) -> None:
+        for word in words:
+            if word not in self.word_to_id:
+                self.new_words += [word]
+        super().addNewWord(words)
+
+    def buildBodyInvertedIndex(self, words: list[str], url_id: str) -> None:
+        self.doc_sequence.setdefault(url_id, len(self.doc_sequence))
+        super().buildBodyInvertedIndex(words, url_id)
+        self.estimated_memory += len(set(words)) * POSTING_BYTES + len(words) * POSITION_BYTES
+        self.spillIfNeeded()
+
+    def buildTitleInvertedIndex(self, words: list[str], url_id: str) -> None:
+        self.doc_sequence.setdefault(url_id, len(self.doc_sequence))
+        super().buildTitleInvertedIndex(words, url_id)
+        self.estimated_memory += len(set(words)) * POSTING_BYTES + len(words) * POSITION_BYTES
+        self.spillIfNeeded()
+
+    def buildForwardIndex(self, words: list[str], url_id: str, remove_old_content: bool = False) -> None:
+        self.doc_sequence.setdefault(url_id, len(self.doc_sequence))
+        super().buildForwardIndex(words, url_id, remove_old_content)
+        self.estimated_memory += len(set(words)) * FORWARD_BYTES
+
+    def spillIfNeeded(self) -> None:
+        if self.estimated_memory >= self.memory_budget:
+            self.spillRun()
+
+
+    # sorted runs
+
+    def runPath(self, run_id: int, kind: str) -> str:
+        return os.path.join(self.run_dir, f"run{run_id}.{kind}")
+
+    def spillRun(self) -> None:
+        if self.run_dir is None:
+            self.run_dir = tempfile.mkdtemp(prefix="index-runs-", dir=self.temp_dir)
+        run_id = self.run_count
+        self.run_count += 1
+
+        # inverted index run line format: wordId \t docSequence \t urlId \t frequency \t positions
+        for (kind, inverted_index) in (("body", self.body_inverted_index), ("title", self.title_inverted_index)):
+            records = sorted((word_id, self.doc_sequence[url_id], url_id, posting["frequency"], posting["positions"])
+                             for (word_id, postings) in inverted_index.items()
+                             for (url_id, posting) in postings.items())
+            with open(self.runPath(run_id, kind), "w") as f:
+                for (word_id, sequence, url_id, frequency, positions) in records:
+                    f.write(f"{word_id}\t{sequence}\t{url_id}\t{frequency}\t{','.join(map(str, positions))}\n")
+
+        # forward index run line format: docSequence \t urlId \t wordIds
+        records = sorted((self.doc_sequence[url_id], url_id, word_ids) for (url_id, word_ids) in self.forward_index.items())
+        with open(self.runPath(run_id, "forward"), "w") as f:
+            for (sequence, url_id, word_ids) in records:
+                f.write(f"{sequence}\t{url_id}\t{' '.join(word_ids)}\n")
+
+        self.body_inverted_index = {}
+        self.title_inverted_index = {}
+        self.forward_index = {}
+        self.posting_store = PostingStore()
+        self.estimated_memory = 0
+
+    def readPostingRun(self, path: str):
+        with open(path) as f:
+            for line in f:
+                word_id, sequence, url_id, frequency, positions = line.rstrip("\n").split("\t")
+                yield (word_id, int(sequence), url_id, frequency, positions)
+
+    def readForwardRun(self, path: str):
+        with open(path) as f:
+            for line in f:
+                sequence, url_id, word_ids = line.rstrip("\n").split("\t")
+                yield (int(sequence), url_id, word_ids)
+
+    def mergedPostingRows(self, kind: str, statistics: StatisticsBuilder | None = None):
+        # k-way merge of the runs, one posting list is in memory at a time
+        runs = [self.readPostingRun(self.runPath(run_id, kind)) for run_id in range(self.run_count)]
+        for (word_id, records) in groupby(heapq.merge(*runs), key=lambda record: record[0]):
+            postings = {url_id: {"frequency": frequency, "positions": positions.split(",")}
+                        for (_, _, url_id, frequency, positions) in records}
+            if statistics is not None:
+                statistics.add_term(word_id, ((url_id, int(posting["frequency"])) for (url_id, posting) in postings.items()))
+            yield (word_id, encode_postings(postings))
+
+    def mergedForwardRows(self):
+        # a page may be split across two runs (body before the spill, title after), so its word IDs are combined;
+        # the merge is keyed by page only, so the parts of a page come in run order like in the in-memory Indexer
+        runs = [self.readForwardRun(self.runPath(run_id, "forward")) for run_id in range(self.run_count)]
+        page_key = lambda record: record[:2]
+        for ((_, url_id), records) in groupby(heapq.merge(*runs, key=page_key), key=page_key):
+            word_ids = []
+            for (_, _, joined_word_ids) in records:
+                for word_id in joined_word_ids.split(" "):
+                    if word_id not in word_ids:
+                        word_ids += [word_id]
+            yield (url_id, " ".join(word_ids))
+
+
+    # SQLite database functions
+
+    def updateSQLiteDB(self) -> None:
+        # called after every crawl batch: only the new words are appended, the postings stay in the runs
+        self.cursor.executemany("INSERT OR REPLACE INTO word_to_id VALUES(?, ?);",
+                                [(word, self.word_to_id[word]) for word in self.new_words])
+        self.cursor.executemany("INSERT OR REPLACE INTO id_to_word VALUES(?, ?);",
+                                [(self.word_to_id[word], word) for word in self.new_words])
+        self.connection.commit()
+        self.new_words = []
+
+    def finalize(self) -> None:
+        """
+        Spills the last run and merges every run into the body/title inverted index and forward index tables.
+        """
+        self.spillRun()
+
+        # the statistics are collected while the body postings stream by
+        statistics = StatisticsBuilder()
+        for (table, rows) in (("body_inverted_index", self.mergedPostingRows("body", statistics)),
+                              ("title_inverted_index", self.mergedPostingRows("title"))):
+            self.cursor.execute(f"DROP TABLE {table};")
+            self.cursor.execute(f"CREATE TABLE {table}(wordId TEXT PRIMARY KEY, value TEXT);")
+            self.cursor.executemany(f"INSERT INTO {table} VALUES(?, ?);", rows)
+            self.connection.commit()
+
+        self.cursor.execute(f"DROP TABLE forward_index;")
+        self.cursor.execute(f"CREATE TABLE forward_index(urlId TEXT PRIMARY KEY, value TEXT);")
+        self.cursor.executemany(f"INSERT INTO forward_index VALUES(?, ?);", self.mergedForwardRows())
+        self.connection.commit()
+
+        # the signatures of similar pages are computed from the merged forward index
+        SimilarityIndex(self.connection).rebuild(self.connection.execute(f"SELECT urlId, value FROM forward_index;"))
+        self.connection.commit()
+        self.changed_documents = set()
+
+        statistics.write(self.connection, self.cursor.execute(f"SELECT COUNT(*) FROM forward_index;").fetchone()[0])
+
+        self.updateSQLiteDB()
+
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+        self.run_dir = None
+        self.run_count = 0
@@ -0,0 +1,257 @@
+import os
+import re
+import glob
+import sqlite3
+
+"""
+Database generations, so a crawl never changes the database the search is reading.
+
+The crawler builds a new generation (main.gen<N>.db, next to main.db) starting from a copy of the current one, and
+publishes it by atomically replacing the pointer file main.db.current with the name of the new generation.
+A Retrieval resolves the pointer once when it is created and keeps reading its generation until it is done, so
+a search never sees half-cleared tables or a half-written index; the next one reads the new generation.
+Without a pointer file, main.db itself is the current database.
+
+The published generations are listed in main.db.published, newest last. After a publish, the last KEEP_GENERATIONS
+published generations are kept; older ones are deleted, and so are the unpublished generations left by failed crawls.
+A crawl holds a lock on main.gen<N>.db.lock while it builds its generation (released by publish_database, or by the
+OS when the process dies), so the generations of concurrent crawls are never deleted, and a generation older than the
+current one is never published. Files that cannot be deleted yet (e.g. still open in a search on Windows) are retried
+at the next publish.
+"""
+
+# published generations kept on disk after a publish: the new one and the previous one, still read by in-flight searches
+KEEP_GENERATIONS = 2
+
+
+def pointer_path(db_path: str) -> str:
+    return db_path + ".current"
+
+
+def published_path(db_path: str) -> str:
+    return db_path + ".published"
+
+
+def generation_path(db_path: str, generation: int) -> str:
+    # e.g. main.db -> main.gen1.db, main.gen2.db, ...
+    root, ext = os.path.splitext(db_path)
+    return f"{root}.gen{generation}{ext}"
+
+
+def lock_path(generation_db_path: str) -> str:
+    return generation_db_path + ".lock"
+
+
+def generation_number(db_path: str, name: str) -> int | None:
+    # e.g. main.gen3.db -> 3, None for a file that is not a generation of db_path
+    root, ext = os.path.splitext(os.path.basename(db_path))
+    match = re.match(re.escape(root) + r"\.gen(\d+)" + re.escape(ext) + "$", os.path.basename(name))
+    return int(match.group(1)) if match else None
+
+
+def list_generations(db_path: str) -> list[tuple[int, str]]:
+    # [(generation, path)] of the generation databases on disk, oldest first
+    root, ext = os.path.splitext(db_path)
+    generations = []
+    for path in glob.glob(f"{glob.escape(root)}.gen*{ext}"):
+        generation = generation_number(db_path, path)
+        if generation is not None:
+            generations.append((generation, path))
+    return sorted(generations)
+
+
+def lock_file(fd: int, blocking: bool = False) -> bool:
+    # exclusive lock of an open file, released when it is closed (or the process exits)
+    try:
+        import fcntl
+    except ImportError:
+        import msvcrt
+        try:
+            msvcrt.locking(fd, msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def open_locked(path: str, blocking: bool = False) -> int | None:
+    """
+    Opens and locks `path`, creating it if needed. Returns the file descriptor, or None if another process (or
+    another descriptor of this one) holds the lock.
+    """
+    while True:
+        fd = os.open(path, os.O_CREAT | os.O_RDWR)
+        if not lock_file(fd, blocking):
+            os.close(fd)
+            return None
+        # the file may have been deleted by its previous holder between our open and our lock
+        try:
+            if os.path.samestat(os.fstat(fd), os.stat(path)):
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+
+# {staging database: locked file descriptor} of the generations this process is building
+_staging_locks = {}
+
+
+def current_database(db_path: str) -> str:
+    """
+    Returns the path of the published generation of `db_path`, or `db_path` itself if none was published.
+    """
+    try:
+        with open(pointer_path(db_path)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return db_path
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), name)
+
+
+def create_staging_database(db_path: str) -> str:
+    """
+    Creates the next generation of `db_path` as a copy of the current database and returns its path.
+    """
+    generations = list_generations(db_path)
+    generation = generations[-1][0] + 1 if generations else 1
+    # locked first, then claimed with O_EXCL, so two crawls started at the same time never build into the same file
+    # and the generation is never taken for the leftover of a failed crawl
+    while True:
+        staging_path = generation_path(db_path, generation)
+        fd = open_locked(lock_path(staging_path))
+        if fd is not None:
+            try:
+                os.close(os.open(staging_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                _staging_locks[staging_path] = fd
+                break
+            except FileExistsError:
+                os.close(fd)
+        generation += 1
+
+    source_path = current_database(db_path)
+    if os.path.exists(source_path):
+        # the backup API copies a consistent snapshot even while the source is being read or written
+        source = sqlite3.connect(f"file:{os.path.abspath(source_path)}?mode=ro", uri=True)
+        staging = sqlite3.connect(staging_path)
+        source.backup(staging)
+        copy_shards(source, source_path, staging, staging_path)
+        staging.close()
+        source.close()
+    return staging_path
+
+
+def copy_shards(source: sqlite3.Connection, source_path: str, staging: sqlite3.Connection, staging_path: str) -> None:
+    # a sharded index keeps its postings in separate files, which belong to the generation as well
+    from ShardedIndex import load_shard_paths, shard_path_for
+
+    shard_paths = load_shard_paths(source.cursor(), source_path)
+    for (shard_id, shard_path) in enumerate(shard_paths):
+        shard_source = sqlite3.connect(f"file:{os.path.abspath(shard_path)}?mode=ro", uri=True)
+        shard_staging = sqlite3.connect(shard_path_for(staging_path, shard_id))
+        shard_source.backup(shard_staging)
+        shard_staging.close()
+        shard_source.close()
+    if shard_paths:
+        with staging:
+            staging.executemany("UPDATE index_shards SET path = ? WHERE shardId = ?;",
+                                [(os.path.basename(shard_path_for(staging_path, shard_id)), shard_id)
+                                 for shard_id in range(len(shard_paths))])
+
+
+def published_generations(db_path: str) -> list[str]:
+    # file names of the published generations, oldest first
+    try:
+        with open(published_path(db_path)) as f:
+            return [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        pass
+    # databases published before the list existed: every generation up to the current one
+    current = os.path.basename(current_database(db_path))
+    names = [os.path.basename(path) for (_, path) in list_generations(db_path)]
+    return names[:names.index(current) + 1] if current in names else []
+
+
+def write_atomically(path: str, text: str) -> None:
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    # rename is atomic: a reader sees either the old or the new file, never a partial one
+    os.replace(temp_path, path)
+
+
+def release_generation(staging_path: str) -> None:
+    """
+    Releases the lock of a generation built by this process. Unpublished, it is deleted by the next publish.
+    """
+    fd = _staging_locks.pop(staging_path, None)
+    if fd is not None:
+        os.close(fd)
+
+
+def publish_database(db_path: str, staging_path: str, keep: int = KEEP_GENERATIONS) -> None:
+    """
+    Makes `staging_path` the current generation of `db_path`. The staging database must be fully committed and
+    checkpointed, its connections closed. Raises RuntimeError if a newer generation was published meanwhile.
+    """
+    # one publish at a time, so two crawls finishing together do not lose each other's line of main.db.published
+    publish_fd = open_locked(db_path + ".lock", blocking=True)
+    try:
+        current = generation_number(db_path, current_database(db_path))
+        if current is not None and generation_number(db_path, staging_path) < current:
+            release_generation(staging_path)
+            raise RuntimeError(f"{staging_path} is older than the current generation {current}, it is not published")
+        published = published_generations(db_path) + [os.path.basename(staging_path)]
+        write_atomically(published_path(db_path), "\n".join(published[-keep:]) + "\n")
+        write_atomically(pointer_path(db_path), os.path.basename(staging_path))
+        # a published generation is kept by the list, not by its lock
+        remove_file(lock_path(staging_path))
+        release_generation(staging_path)
+        remove_old_generations(db_path)
+    finally:
+        os.close(publish_fd)
+
+
+def remove_old_generations(db_path: str) -> None:
+    """
+    Deletes the generations that are neither current nor among the kept published ones, unless a crawl still
+    holds their lock.
+    """
+    kept = set(published_generations(db_path))
+    kept.add(os.path.basename(current_database(db_path)))
+    for (_, path) in list_generations(db_path):
+        if os.path.basename(path) not in kept:
+            fd = open_locked(lock_path(path))
+            if fd is not None:
+                remove_generation(path, fd)
+
+
+def remove_generation(path: str, lock_fd: int) -> None:
+    root, ext = os.path.splitext(path)
+    # the WAL files, snapshots, link graph and shards first, the database itself last, so a generation with files
+    # still open stays listed and is removed at a later publish
+    files = [file_path for file_path in glob.glob(glob.escape(path) + "*") + glob.glob(f"{glob.escape(root)}.shard*{ext}*")
+             if file_path not in (path, lock_path(path))]
+    removed = all([remove_file(file_path) for file_path in files])
+    if removed and remove_file(path):
+        # removed while still locked (where the OS allows it), so no crawl can lock the old file and then build
+        # into a generation that a later publish would take for a leftover
+        remove_file(lock_path(path))
+    os.close(lock_fd)
+
+
+def remove_file(path: str) -> bool:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        # e.g. PermissionError on Windows while a reader still has the file open
+        return False
+    return True
@@ -1,19 +1,94 @@
 import uuid
 import sqlite3
+from functools import cached_property
+from Snapshot import load_vocabulary
+from PostingList import PostingStore, PostingList, decode_posting_list
+from Statistics import StatisticsBuilder
+from SimilarPages import SimilarityIndex
+
+
+def encode_postings(postings: dict) -> str:
+    # value format: urlId1;frequency1;position1 urlId2;frequency2;position2,position3,position4 ...
+    formatted_entries = []
+
+    for (url_id, inner_value) in postings.items():
+        positions = ",".join(map(str, inner_value["positions"]))
+        formatted_entries += [f"{url_id};{inner_value['frequency']};{positions}"]
+
+    # join all formatted entries into a single string separated by spaces
+    return " ".join(formatted_entries)
+
+
+def decode_postings(value: str) -> dict:
+    # inverse of encode_postings
+    postings = {}
+
+    for entry in value.split(" "):
+        parts = entry.split(";")
+
+        url_id = parts[0]
+        word_frequency = int(parts[1])
+        positions = list(map(int, parts[2].split(",")))
+
+        postings[url_id] = {
+            "frequency": word_frequency,
+            "positions": positions
+        }
+
+    return postings
+
 
 class Indexer:
     def __init__(self, db_connection: sqlite3.Connection):
-        self.body_inverted_index = {}
-        self.title_inverted_index = {}
-        self.forward_index = {}
-        self.word_to_id = {}
-        self.id_to_word = {}
-
+        # the index dicts (body_inverted_index, title_inverted_index, forward_index, word_to_id, id_to_word)
+        # and posting_store are loaded from the database on first use, see the cached properties below
         self.connection = db_connection  # Use shared database connection
         self.cursor = self.connection.cursor()
+        # pages whose forward index changed since the similarity tables were last written
+        self.changed_documents = set()
         self.prepareSQLiteDB()
 
 
+    # index structures, loaded lazily
+
+    @cached_property
+    def posting_store(self) -> PostingStore:
+        # URL IDs and positions shared by all posting lists of this indexer,
+        # with dense document IDs handed out in crawl order before any postings are loaded
+        store = PostingStore()
+        for (url_id,) in self.cursor.execute(f"SELECT urlId FROM forward_index ORDER BY rowid;").fetchall():
+            store.denseId(url_id)
+        return store
+
+    @cached_property
+    def body_inverted_index(self) -> dict:
+        result = self.cursor.execute(f"SELECT * FROM body_inverted_index;").fetchall()
+        return {wordId: decode_posting_list(value, self.posting_store) for (wordId, value) in result}
+
+    @cached_property
+    def title_inverted_index(self) -> dict:
+        result = self.cursor.execute(f"SELECT * FROM title_inverted_index;").fetchall()
+        return {wordId: decode_posting_list(value, self.posting_store) for (wordId, value) in result}
+
+    @cached_property
+    def forward_index(self) -> dict:
+        result = self.cursor.execute(f"SELECT * FROM forward_index;").fetchall()
+        return {url_id: value.split(" ") for (url_id, value) in result}
+
+    @cached_property
+    def word_to_id(self) -> dict:
+        # read from the binary vocabulary snapshot when it is up to date
+        return load_vocabulary(self.connection)
+
+    @cached_property
+    def id_to_word(self) -> dict:
+        return {word_id: word for (word, word_id) in self.word_to_id.items()}
+
+    def isLoaded(self, name: str) -> bool:
+        # a structure that was never loaded was never modified either
+        return name in self.__dict__
+
+
     # Indexer core functions
     
     def buildBodyInvertedIndex(self, words: list[str], url_id: str) -> None:
@@ -33,22 +108,13 @@ class Indexer:
         for (word, positions) in word_position_dict.items():
             word_id: str = self.word_to_id[word]
 
-            # if body_inverted_index already contain the url ID
-            # simply add the corresponding frequency and positions
-            if self.body_inverted_index.get(word_id, None) is not None:
-                self.body_inverted_index[word_id][url_id] = {
-                                                                "frequency": len(positions), 
-                                                                "positions": positions
-                                                            }
-            # otherwise, create a new url ID in body_inverted_index first
-            # then add the corresponding frequency and positions
-            else:
-                self.body_inverted_index[word_id] = {url_id:
-                                                        {
-                                                            "frequency": len(positions),
-                                                            "positions": positions
-                                                        }
-                                                    }
+            # if body_inverted_index does not contain the word ID yet
+            # create an empty posting list for it first
+            if self.body_inverted_index.get(word_id, None) is None:
+                self.body_inverted_index[word_id] = PostingList(self.posting_store)
+
+            # then add the positions (the frequency is the number of positions) of the url ID
+            self.body_inverted_index[word_id].append(url_id, positions)
                 
     def buildTitleInvertedIndex(self, words: list[str], url_id: str) -> None:
         # format is as follows:
@@ -67,22 +133,13 @@ class Indexer:
         for (word, positions) in word_position_dict.items():
             word_id: str = self.word_to_id[word]
 
-            # if title_inverted_index already contain the url ID
-            # simply add the corresponding frequency and positions
-            if self.title_inverted_index.get(word_id, None) is not None:
-                self.title_inverted_index[word_id][url_id] = {
-                                                                "frequency": len(positions), 
-                                                                "positions": positions
-                                                             }
-            # otherwise, create a new url ID in title_inverted_index first
-            # then add the corresponding frequency and positions
-            else:
-                self.title_inverted_index[word_id] = {url_id:
-                                                        {
-                                                            "frequency": len(positions),
-                                                            "positions": positions
-                                                        }
-                                                     }
+            # if title_inverted_index does not contain the word ID yet
+            # create an empty posting list for it first
+            if self.title_inverted_index.get(word_id, None) is None:
+                self.title_inverted_index[word_id] = PostingList(self.posting_store)
+
+            # then add the positions (the frequency is the number of positions) of the url ID
+            self.title_inverted_index[word_id].append(url_id, positions)
     
     def buildForwardIndex(self, words: list[str], url_id: str, remove_old_content: bool = False) -> None:
         # unique_words_list stores a list of unique words
@@ -108,6 +165,7 @@ class Indexer:
         
         # build the forward index for the given URL ID
         self.forward_index[url_id] = word_ids_list
+        self.changed_documents.add(url_id)
 
     def addNewWord(self, words: list[str]) -> None:
         # if a word is not appeared in word_to_id
@@ -127,190 +185,141 @@ class Indexer:
 
     def prepareSQLiteDB(self) -> None:
         self.cursor = self.connection.cursor()
+        self.prepareIndexTables()
+        self.prepareVocabularyTables()
+
+        # commit the transaction done above
+        self.connection.commit()
 
+    def prepareIndexTables(self) -> None:
+        # create the tables that do not exist yet, their content is loaded on first use
+        for table in ("forward_index", "body_inverted_index", "title_inverted_index"):
+            key = "urlId" if table == "forward_index" else "wordId"
+            self.cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}({key} TEXT PRIMARY KEY, value TEXT);")
 
-        # if the table `body_inverted_index` not exist, create it first
-        if self.cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='body_inverted_index';").fetchone() is None:
-            self.cursor.execute(f"CREATE TABLE body_inverted_index(wordId TEXT PRIMARY KEY, value TEXT);")
-        # otherwise, retrieve all data from the DB table and put it in `self.body_inverted_index`
-        else:
-            result = self.cursor.execute(f"SELECT * FROM body_inverted_index;").fetchall()
-            for (wordId, value) in result:
-                current_row_value = {}
-
-                entries = value.split(" ")
-                for entry in entries:
-                    parts = entry.split(";")
-
-                    url_id = parts[0]
-                    word_frequency = parts[1]
-                    positions = list(map(int, parts[2].split(",")))
-
-                    current_row_value[url_id] = {
-                        "frequency": word_frequency,
-                        "positions": positions
-                    }
-                
-                self.body_inverted_index[wordId] = current_row_value
+    def prepareVocabularyTables(self) -> None:
+        # create the tables that do not exist yet, their content is loaded on first use
+        self.cursor.execute(f"CREATE TABLE IF NOT EXISTS word_to_id(word TEXT PRIMARY KEY, wordId TEXT);")
+        self.cursor.execute(f"CREATE TABLE IF NOT EXISTS id_to_word(wordId TEXT PRIMARY KEY, word TEXT);")
+    
+    def updateSQLiteDB(self) -> None:
+        self.updateIndexTables()
+        self.updateVocabularyTables()
+
+    def updateIndexTables(self) -> None:
         
-        # if the table `title_inverted_index` not exist, create it first
-        if self.cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='title_inverted_index';").fetchone() is None:
+        # body & title inverted index
+
+        # only the structures that were loaded (and so possibly modified) are written back
+        if self.isLoaded("body_inverted_index"):
+            # remove all data in the database table `body_inverted_index` first
+            # re-create the empty database table `body_inverted_index`
+            # update all the data in the table
+            # commit the transaction
+            self.cursor.execute(f"DROP TABLE body_inverted_index;")
+            self.cursor.execute(f"CREATE TABLE body_inverted_index(wordId TEXT PRIMARY KEY, value TEXT);")
+
+            body_inverted_index_key_value_list = []
+            for (key, value) in self.body_inverted_index.items():
+                combined_value = encode_postings(value)
+
+                # append the tuple (key, combined_value) to the list
+                body_inverted_index_key_value_list += [(key, combined_value)]
+
+            self.cursor.executemany(f"INSERT INTO body_inverted_index VALUES(?, ?);", body_inverted_index_key_value_list)
+            self.connection.commit()
+
+        if self.isLoaded("title_inverted_index"):
+            # remove all data in the database table `title_inverted_index` first
+            # re-create the empty database table `title_inverted_index`
+            # update all the data in the table
+            # commit the transaction
+            self.cursor.execute(f"DROP TABLE title_inverted_index;")
             self.cursor.execute(f"CREATE TABLE title_inverted_index(wordId TEXT PRIMARY KEY, value TEXT);")
-        # otherwise, retrieve all data from the DB table and put it in `self.title_inverted_index`
-        else:
-            result = self.cursor.execute(f"SELECT * FROM title_inverted_index;").fetchall()
-            for (wordId, value) in result:
-                current_row_value = {}
-
-                entries = value.split(" ")
-                for entry in entries:
-                    parts = entry.split(";")
-
-                    url_id = parts[0]
-                    word_frequency = parts[1]
-                    positions = list(map(int, parts[2].split(",")))
-
-                    current_row_value[url_id] = {
-                        "frequency": word_frequency,
-                        "positions": positions
-                    }
-                
-                self.title_inverted_index[wordId] = current_row_value
 
+            title_inverted_index_key_value_list = []
+            for (key, value) in self.title_inverted_index.items():
+                combined_value = encode_postings(value)
+
+                # append the tuple (key, combined_value) to the list
+                title_inverted_index_key_value_list += [(key, combined_value)]
+
+            self.cursor.executemany(f"INSERT INTO title_inverted_index VALUES(?, ?);", title_inverted_index_key_value_list)
+            self.connection.commit()
+
+
+        # forward index
 
-        # if the table `forward_index` not exist, create it first
-        if self.cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='forward_index';").fetchone() is None:
+        if self.isLoaded("forward_index"):
+            # remove all data in the database table `forward_index` first
+            # re-create the empty database table `forward_index`
+            # update all the data in the table
+            # commit the transaction
+            self.cursor.execute(f"DROP TABLE forward_index;")
             self.cursor.execute(f"CREATE TABLE forward_index(urlId TEXT PRIMARY KEY, value TEXT);")
-        # otherwise, retrieve all data from the DB table and put it in `self.forward_index`
-        else:
-            result = self.cursor.execute(f"SELECT * FROM forward_index;").fetchall()
-            for row in result:
-                url_id = row[0]
-                value = row[1].split(" ")
-                self.forward_index[url_id] = value
 
+            forward_index_key_value_list = []
+            for (key, value) in self.forward_index.items():
+                # Join the list of values with space into a single string
+                # joined_value format: wordId1 wordId2 wordId3 ...
+                joined_value = " ".join(value)
+                forward_index_key_value_list += [(key, joined_value)]
 
-        # if the table `word_to_id` not exist, create it first
-        if self.cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='word_to_id';").fetchone() is None:
-            self.cursor.execute(f"CREATE TABLE word_to_id(word TEXT PRIMARY KEY, wordId TEXT);")
-        # otherwise, retrieve all data from the DB table and put it in `self.word_to_id`
-        else:
-            result = self.cursor.execute(f"SELECT * FROM word_to_id;").fetchall()
-            for row in result:
-                word = row[0]
-                word_id = row[1]
-                self.word_to_id[word] = word_id
-        
-        # if the table `id_to_word` not exist, create it first
-        if self.cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='id_to_word';").fetchone() is None:
-            self.cursor.execute(f"CREATE TABLE id_to_word(wordId TEXT PRIMARY KEY, word TEXT);")
-        # otherwise, retrieve all data from the DB table and put it in `self.id_to_word`
-        else:
-            result = self.cursor.execute(f"SELECT * FROM id_to_word;").fetchall()
-            for row in result:
-                word_id = row[0]
-                word = row[1]
-                self.id_to_word[word_id] = word
-        
-        # commit the transaction done above
-        self.connection.commit()
-    
-    def updateSQLiteDB(self) -> None:
-        
-        # body & title inverted index
+            self.cursor.executemany(f"INSERT INTO forward_index VALUES(?, ?);", forward_index_key_value_list)
+            self.connection.commit()
 
-        # remove all data in the database table `body_inverted_index` first
-        # re-create the empty database table `body_inverted_index`
-        # update all the data in the table
-        # commit the transaction
-        self.cursor.execute(f"DROP TABLE body_inverted_index;")
-        self.cursor.execute(f"CREATE TABLE body_inverted_index(wordId TEXT PRIMARY KEY, value TEXT);")
-
-        body_inverted_index_key_value_list = []
-        for (key, value) in self.body_inverted_index.items():
-            formatted_entries = []
-
-            for (url_id, inner_value) in value.items():
-                # value format: urlId1;frequency1;position1 urlId2;frequency2;position2,position3,position4 ...
-                positions = ",".join(map(str, inner_value["positions"]))
-                formatted_entry = f"{url_id};{inner_value['frequency']};{positions}"
-                formatted_entries += [formatted_entry]
-            
-            # join all formatted entries into a single string separated by spaces
-            combined_value = " ".join(formatted_entries)
-
-            # append the tuple (key, combined_value) to the list
-            body_inverted_index_key_value_list += [(key, combined_value)]
-
-        self.cursor.executemany(f"INSERT INTO body_inverted_index VALUES(?, ?);", body_inverted_index_key_value_list)
-        self.connection.commit()
 
-        # remove all data in the database table `title_inverted_index` first
-        # re-create the empty database table `title_inverted_index`
-        # update all the data in the table
-        # commit the transaction
-        self.cursor.execute(f"DROP TABLE title_inverted_index;")
-        self.cursor.execute(f"CREATE TABLE title_inverted_index(wordId TEXT PRIMARY KEY, value TEXT);")
-
-        title_inverted_index_key_value_list = []
-        for (key, value) in self.title_inverted_index.items():
-            formatted_entries = []
-
-            for (url_id, inner_value) in value.items():
-                # value format: urlId1;frequency1;position1 urlId2;frequency2;position2,position3,position4 ...
-                positions = ",".join(map(str, inner_value["positions"]))
-                formatted_entry = f"{url_id};{inner_value['frequency']};{positions}"
-                formatted_entries += [formatted_entry]
-            
-            # join all formatted entries into a single string separated by spaces
-            combined_value = " ".join(formatted_entries)
-
-            # append the tuple (key, combined_value) to the list
-            title_inverted_index_key_value_list += [(key, combined_value)]
-
-        self.cursor.executemany(f"INSERT INTO title_inverted_index VALUES(?, ?);", title_inverted_index_key_value_list)
-        self.connection.commit()
+        # collection & term statistics of the body index (see Statistics.py)
 
+        if self.isLoaded("body_inverted_index"):
+            self.updateStatisticsTables()
 
-        # forward index
 
-        # remove all data in the database table `forward_index` first
-        # re-create the empty database table `forward_index`
-        # update all the data in the table
-        # commit the transaction
-        self.cursor.execute(f"DROP TABLE forward_index;")
-        self.cursor.execute(f"CREATE TABLE forward_index(urlId TEXT PRIMARY KEY, value TEXT);")
-
-        forward_index_key_value_list = []
-        for (key, value) in self.forward_index.items():
-            # Join the list of values with space into a single string
-            # joined_value format: wordId1 wordId2 wordId3 ...
-            joined_value = " ".join(value)
-            forward_index_key_value_list += [(key, joined_value)]
-
-        self.cursor.executemany(f"INSERT INTO forward_index VALUES(?, ?);", forward_index_key_value_list)
-        self.connection.commit()
+        # MinHash signatures of the changed pages, for similar pages (see SimilarPages.py)
 
+        if self.changed_documents:
+            self.updateSimilarityTables()
 
-        # word <-> word_id conversion
+    def updateStatisticsTables(self) -> None:
+        statistics = StatisticsBuilder()
+        for (word_id, postings) in self.body_inverted_index.items():
+            statistics.add_term(word_id, zip(postings, postings.frequencies))
 
-        # remove all data in the database table `word_to_id` first
-        # re-create the empty database table `word_to_id`
-        # update all the data in the table
-        # commit the transaction
-        self.cursor.execute(f"DROP TABLE word_to_id;")
-        self.cursor.execute(f"CREATE TABLE word_to_id(word TEXT PRIMARY KEY, wordId TEXT);")
-        self.cursor.executemany(f"INSERT INTO word_to_id VALUES(?, ?);", list(self.word_to_id.items()))
-        self.connection.commit()
+        document_count = self.cursor.execute(f"SELECT COUNT(*) FROM forward_index;").fetchone()[0]
+        statistics.write(self.connection, document_count)
+
+    def updateSimilarityTables(self) -> None:
+        # an index written before the similarity tables existed gets the signatures of all its pages
+        exists = self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='minhash_signatures';").fetchone()
+        url_ids = self.changed_documents if exists else self.forward_index.keys()
 
-        # remove all data in the database table `id_to_word` first
-        # re-create the empty database table `id_to_word`
-        # update all the data in the table
-        # commit the transaction
-        self.cursor.execute(f"DROP TABLE id_to_word;")
-        self.cursor.execute(f"CREATE TABLE id_to_word(wordId TEXT PRIMARY KEY, word TEXT);")
-        self.cursor.executemany(f"INSERT INTO id_to_word VALUES(?, ?);", list(self.id_to_word.items()))
+        SimilarityIndex(self.connection).update((url_id, self.forward_index[url_id]) for url_id in url_ids)
         self.connection.commit()
+        self.changed_documents = set()
+
+    def updateVocabularyTables(self) -> None:
+
+        # word <-> word_id conversion
+
+        if self.isLoaded("word_to_id"):
+            # remove all data in the database table `word_to_id` first
+            # re-create the empty database table `word_to_id`
+            # update all the data in the table
+            # commit the transaction
+            self.cursor.execute(f"DROP TABLE word_to_id;")
+            self.cursor.execute(f"CREATE TABLE word_to_id(word TEXT PRIMARY KEY, wordId TEXT);")
+            self.cursor.executemany(f"INSERT INTO word_to_id VALUES(?, ?);", list(self.word_to_id.items()))
+            self.connection.commit()
+
+        if self.isLoaded("id_to_word"):
+            # remove all data in the database table `id_to_word` first
+            # re-create the empty database table `id_to_word`
+            # update all the data in the table
+            # commit the transaction
+            self.cursor.execute(f"DROP TABLE id_to_word;")
+            self.cursor.execute(f"CREATE TABLE id_to_word(wordId TEXT PRIMARY KEY, word TEXT);")
+            self.cursor.executemany(f"INSERT INTO id_to_word VALUES(?, ?);", list(self.id_to_word.items()))
+            self.connection.commit()
 
 
 
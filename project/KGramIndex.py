@@ -0,0 +1,177 @@
+import sqlite3
+import threading
+from array import array
+from collections import Counter
+from Snapshot import DatabaseCache, load_snapshot, save_snapshot, database_path, vocabulary_stamp, load_vocabulary
+
+"""
+Character k-gram index over the stems of the vocabulary (word_to_id), for "did you mean" suggestions and fuzzy
+expansion of misspelt query terms.
+
+The postings of a k-gram are split by word length, as array('I') of positions in `words`. A word within edit distance
+d of the query term has a length within d of it, and since one edit changes at most K of the k-grams, it shares at
+least |grams(term)| - K * d distinct k-grams with the term. Only the postings of the term's k-grams in that length
+window are counted, and the few candidates that pass the overlap filter are verified with a Levenshtein distance that
+stops as soon as it exceeds d. The vocabulary only grows, so the index is extended with the new words instead of
+being rebuilt, and it is cached per process (for the last generations) and as a snapshot next to the database (`main.db.kgrams.snapshot`).
+"""
+
+K = 3
+PAD = "$" * (K - 1)
+# postings entries counted per candidate lookup, beyond the ones the filter needs
+READ_BUDGET = 6000
+
+
+def kgrams(word: str) -> set[str]:
+    # the padding makes the first and last letters count like the others: "cat" -> $$c $ca cat at$ t$$
+    padded = f"{PAD}{word}{PAD}"
+    return {padded[i:i + K] for i in range(len(padded) - K + 1)}
+
+
+def default_max_distance(word: str) -> int:
+    # short words have too many neighbours at distance 2
+    if len(word) <= 3:
+        return 0
+    return 1 if len(word) <= 7 else 2
+
+
+def bounded_levenshtein(a: str, b: str, limit: int) -> int:
+    """
+    Edit distance of `a` and `b`, or limit + 1 as soon as it is known to be larger than `limit`.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # only the cells within `limit` of the diagonal can stay within the limit, the others are capped
+    cap = limit + 1
+    previous = [min(j, cap) for j in range(len(b) + 1)]
+    for (i, char_a) in enumerate(a, 1):
+        first = max(1, i - limit)
+        last = min(len(b), i + limit)
+        current = [cap] * (len(b) + 1)
+        current[0] = min(i, cap)
+        for j in range(first, last + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != b[j - 1]), cap)
+        if min(current[first - 1:last + 1]) >= cap:
+            return cap
+        previous = current
+    return previous[-1]
+
+
+class KGramIndex:
+    def __init__(self):
+        self.words: list[str] = []
+        # {kgram: {word length: array of positions in words}}
+        self.postings: dict[str, dict[int, array]] = {}
+
+    def extend(self, words) -> None:
+        postings = self.postings
+        for word in words:
+            position = len(self.words)
+            self.words.append(word)
+            for gram in kgrams(word):
+                by_length = postings.get(gram)
+                if by_length is None:
+                    by_length = postings[gram] = {}
+                word_positions = by_length.get(len(word))
+                if word_positions is None:
+                    word_positions = by_length[len(word)] = array("I")
+                word_positions.append(position)
+
+    def candidates(self, term: str, max_distance: int) -> list[str]:
+        # words passing the length and k-gram overlap filters
+        grams = kgrams(term)
+        needed = len(grams) - K * max_distance
+        if needed < 1:
+            # the filter would let every word of the length window through
+            return []
+        lengths = range(max(1, len(term) - max_distance), len(term) + max_distance + 1)
+        sized_grams = []
+        for gram in grams:
+            by_length = self.postings.get(gram, {})
+            lists = [by_length[length] for length in lengths if length in by_length]
+            sized_grams.append((sum(map(len, lists)), gram, lists))
+        sized_grams.sort()
+
+        # a word sharing `needed` of the k-grams contains at least one of any len(grams) - needed + 1 of them, and
+        # at least r + 1 of any len(grams) - needed + 1 + r: the postings of the rarest ones are counted, as many as
+        # READ_BUDGET allows, and the other k-grams are only checked on the words that pass
+        probed = len(grams) - needed + 1
+        read = sum(size for (size, _, _) in sized_grams[:probed])
+        while probed < len(sized_grams) and read + sized_grams[probed][0] <= READ_BUDGET:
+            read += sized_grams[probed][0]
+            probed += 1
+        required = probed - (len(grams) - needed)
+
+        shared = Counter()
+        for (_, _, lists) in sized_grams[:probed]:
+            for word_positions in lists:
+                shared.update(word_positions)
+        words = self.words
+        candidates = [words[position] for (position, count) in shared.items() if count >= required]
+        if probed == len(grams):
+            return candidates
+        return [word for word in candidates if len(kgrams(word) & grams) >= needed]
+
+    def closest(self, term: str, max_distance: int | None = None) -> tuple[int, list[str]]:
+        """
+        Returns (distance, words) of the vocabulary words closest to `term`, within `max_distance` edits (by default
+        depending on its length), or (0, []) if there are none. Distance 1 is tried first, its lookup is much cheaper.
+        """
+        if max_distance is None:
+            max_distance = default_max_distance(term)
+        for distance in range(1, max_distance + 1):
+            words = [word for word in self.candidates(term, distance) if bounded_levenshtein(term, word, distance) == distance]
+            if words:
+                return distance, sorted(words)
+        return 0, []
+
+    def snapshot(self) -> tuple:
+        return (self.words, {gram: {length: word_positions.tobytes() for (length, word_positions) in by_length.items()}
+                             for (gram, by_length) in self.postings.items()})
+
+    @classmethod
+    def from_snapshot(cls, data: tuple) -> "KGramIndex":
+        index = cls()
+        index.words, postings = data
+        for (gram, by_length) in postings.items():
+            index.postings[gram] = {}
+            for (length, blob) in by_length.items():
+                word_positions = index.postings[gram][length] = array("I")
+                word_positions.frombytes(blob)
+        return index
+
+
+# {database file: (vocabulary stamp, KGramIndex)} of the generations searched last
+_indexes = DatabaseCache()
+_indexes_lock = threading.Lock()
+
+
+def load_kgram_index(connection: sqlite3.Connection) -> KGramIndex:
+    """
+    Returns the k-gram index of the vocabulary of the database, up to date with its word_to_id table.
+    """
+    stamp = vocabulary_stamp(connection.cursor())
+    path = database_path(connection)
+    with _indexes_lock:
+        cached = _indexes.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        snapshot_path = path + ".kgrams.snapshot" if path is not None else None
+        index = cached[1] if cached is not None else None
+        if index is None and snapshot_path is not None and stamp is not None:
+            data = load_snapshot(snapshot_path, stamp)
+            if data is not None:
+                index = KGramIndex.from_snapshot(data)
+                _indexes.put(path, (stamp, index))
+                return index
+
+        # the vocabulary tables keep their insertion order, the new words are the last ones
+        words = list(load_vocabulary(connection)) if stamp is not None else []
+        if index is None or len(index.words) > len(words) or index.words[-1:] != words[len(index.words) - 1:len(index.words)]:
+            index = KGramIndex()
+        index.extend(words[len(index.words):])
+        if snapshot_path is not None and stamp is not None:
+            save_snapshot(snapshot_path, stamp, index.snapshot())
+        _indexes.put(path, (stamp, index))
+        return index
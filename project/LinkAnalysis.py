@@ -0,0 +1,161 @@
+import time
+import sqlite3
+import argparse
+from array import array
+from operator import mul
+from itertools import accumulate
+from ShardedIndex import load_shard_paths
+from LinkGraph import transpose, build_link_graph, open_link_graph
+from Generations import create_staging_database, publish_database
+
+"""
+Offline link analysis of the crawled link graph: PageRank and (optionally) HITS scores, one per crawled page,
+stored in `id_to_link_scores` so that Retrieval can blend them into the ranking without any query-time work.
+Run it after a crawl: python LinkAnalysis.py --db main.db
+"""
+
+
+def load_link_graph(connection: sqlite3.Connection) -> tuple[list[str], array, array]:
+    """
+    Returns the link graph between crawled pages as (url_ids, offsets, targets) in CSR form:
+    the links of page i are targets[offsets[i]:offsets[i + 1]], as indices into url_ids.
+    Links to pages that were never crawled are left out. It is read from the stored link graph (see LinkGraph.py),
+    which is built first if needed.
+    """
+    graph = open_link_graph(connection)
+    if graph is None:
+        build_link_graph(connection)
+        graph = open_link_graph(connection)
+    url_ids = [url_id for (url_id,) in connection.execute("SELECT urlId FROM link_graph_nodes WHERE docId < ? ORDER BY docId;",
+                                                          (graph.num_crawled,))]
+    offsets, targets = graph.crawled_graph()
+    return url_ids, offsets, targets
+
+
+def gather_sums(values: list[float], offsets: array, indices: array) -> list[float]:
+    """
+    Returns, for every node, the sum of values[i] over its links i in indices[offsets[node]:offsets[node + 1]].
+    The values are gathered and prefix-summed in one pass, so the only per-node work is a subtraction.
+    """
+    prefix_sums = list(accumulate(map(values.__getitem__, indices), initial=0.0))
+    return [prefix_sums[end] - prefix_sums[start] for (start, end) in zip(offsets, offsets[1:])]
+
+
+def pagerank(offsets: array, targets: array, damping: float = 0.85, tolerance: float = 1e-8,
+             max_iterations: int = 100) -> list[float]:
+    """
+    Power iteration over the incoming links until the L1 change of the scores drops below `tolerance`.
+    Pages without links spread their score evenly over all pages. The scores sum to 1.
+    """
+    num_nodes = len(offsets) - 1
+    if num_nodes == 0:
+        return []
+
+    in_offsets, in_sources = transpose(num_nodes, offsets, targets)
+    out_degrees = [end - start for (start, end) in zip(offsets, offsets[1:])]
+    dangling_nodes = [node for node in range(num_nodes) if out_degrees[node] == 0]
+    inverse_out_degrees = [1 / degree if degree else 0.0 for degree in out_degrees]
+
+    ranks = [1 / num_nodes] * num_nodes
+    for _ in range(max_iterations):
+        # score every page passes to each of its links
+        contributions = list(map(mul, ranks, inverse_out_degrees))
+        dangling_rank = sum(ranks[node] for node in dangling_nodes)
+        base = (1 - damping + damping * dangling_rank) / num_nodes
+
+        new_ranks = [base + damping * incoming for incoming in gather_sums(contributions, in_offsets, in_sources)]
+
+        change = sum(abs(new - old) for (new, old) in zip(new_ranks, ranks))
+        ranks = new_ranks
+        if change < tolerance:
+            break
+
+    return ranks
+
+
+def hits(offsets: array, targets: array, tolerance: float = 1e-8, max_iterations: int = 100) -> tuple[list[float], list[float]]:
+    """
+    Returns the (hub, authority) scores, each normalized to sum to 1.
+    """
+    num_nodes = len(offsets) - 1
+    if num_nodes == 0:
+        return [], []
+
+    in_offsets, in_sources = transpose(num_nodes, offsets, targets)
+    hubs = [1 / num_nodes] * num_nodes
+    authorities = hubs
+
+    for _ in range(max_iterations):
+        # a good authority is linked by good hubs, a good hub links to good authorities
+        new_authorities = normalize(gather_sums(hubs, in_offsets, in_sources))
+        new_hubs = normalize(gather_sums(new_authorities, offsets, targets))
+
+        change = sum(abs(new - old) for (new, old) in zip(new_hubs, hubs))
+        hubs, authorities = new_hubs, new_authorities
+        if change < tolerance:
+            break
+
+    return hubs, authorities
+
+
+def normalize(scores: list[float]) -> list[float]:
+    total = sum(scores)
+    if total == 0:
+        return [1 / len(scores)] * len(scores)
+    return [score / total for score in scores]
+
+
+def store_link_scores(connection: sqlite3.Connection, url_ids: list[str], page_ranks: list[float],
+                      hub_scores: list[float] | None = None, authority_scores: list[float] | None = None) -> None:
+    if hub_scores is None:
+        hub_scores = authority_scores = [None] * len(url_ids)
+
+    with connection:
+        connection.execute("DROP TABLE IF EXISTS id_to_link_scores;")
+        connection.execute("CREATE TABLE id_to_link_scores(urlId TEXT PRIMARY KEY, pageRank REAL, hubScore REAL, authorityScore REAL);")
+        connection.executemany("INSERT INTO id_to_link_scores VALUES(?, ?, ?, ?);",
+                               zip(url_ids, page_ranks, hub_scores, authority_scores))
+
+
+def analyze_links(db_path: str, damping: float = 0.85, tolerance: float = 1e-8, max_iterations: int = 100,
+                  with_hits: bool = False) -> None:
+    connection = sqlite3.connect(db_path)
+
+    start_time = time.time()
+    url_ids, offsets, targets = load_link_graph(connection)
+    print(f"Link graph: {len(url_ids)} pages, {len(targets)} links ({time.time() - start_time:.2f} seconds)")
+
+    start_time = time.time()
+    page_ranks = pagerank(offsets, targets, damping, tolerance, max_iterations)
+    print(f"PageRank: {time.time() - start_time:.2f} seconds")
+
+    hub_scores = authority_scores = None
+    if with_hits:
+        start_time = time.time()
+        hub_scores, authority_scores = hits(offsets, targets, tolerance, max_iterations)
+        print(f"HITS: {time.time() - start_time:.2f} seconds")
+
+    store_link_scores(connection, url_ids, page_ranks, hub_scores, authority_scores)
+
+    # every shard scores its own documents, so it gets a copy of the scores
+    for shard_path in load_shard_paths(connection.cursor(), db_path):
+        shard_connection = sqlite3.connect(shard_path)
+        store_link_scores(shard_connection, url_ids, page_ranks, hub_scores, authority_scores)
+        shard_connection.close()
+
+    connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute PageRank (and HITS) scores of the crawled pages.")
+    parser.add_argument("--db", default="main.db")
+    parser.add_argument("--damping", type=float, default=0.85)
+    parser.add_argument("--tolerance", type=float, default=1e-8, help="stop once the L1 change of the scores is below this")
+    parser.add_argument("--max-iterations", type=int, default=100)
+    parser.add_argument("--hits", action="store_true", help="also compute HITS hub and authority scores")
+    args = parser.parse_args()
+
+    # the scores are written into a new generation of the database, published once they are all stored
+    staging_path = create_staging_database(args.db)
+    analyze_links(staging_path, args.damping, args.tolerance, args.max_iterations, args.hits)
+    publish_database(args.db, staging_path)
@@ -0,0 +1,181 @@
+import os
+import mmap
+import struct
+import sqlite3
+import threading
+from array import array
+from collections import Counter
+from itertools import accumulate, repeat
+from Snapshot import DatabaseCache, database_path
+
+"""
+Link graph of a crawl in CSR form over integer document IDs, for the parent/child links of the search results and
+for link analysis, instead of the space-joined ID strings of id_to_children_url_id and id_to_parents_url_id.
+
+Every URL of id_to_url gets a document ID in `link_graph_nodes` (docId, urlId, url), the crawled pages first.
+The file next to the database (`main.db.links`) holds, after a header, four uint32 arrays: the offsets and targets
+of the child links, then those of the parent links. The children of document d are
+children[child_offsets[d]:child_offsets[d + 1]], in the order of id_to_children_url_id. The file is memory-mapped,
+so opening it costs nothing and the pages of the graph are shared by all processes reading it; it is written in the
+native byte order and belongs to its database generation.
+
+It is built at the end of a crawl (and by reindex.py and LinkAnalysis.py); without it, Retrieval falls back to the
+link tables.
+"""
+
+# magic, number of nodes, number of crawled pages (nodes 0 .. num_crawled - 1), number of child links, parent links
+HEADER = struct.Struct("<8sIIII")
+MAGIC = b"LINKCSR1"
+IN_CHUNK_SIZE = 500
+
+
+def link_graph_path(db_path: str) -> str:
+    return db_path + ".links"
+
+
+def build_csr(num_nodes: int, sources: array, targets: array) -> tuple[array, array]:
+    # the edges are ordered by source with one C-level sort instead of a Python loop per edge;
+    # the sort is stable, so the links of a node keep their order
+    order = sorted(range(len(sources)), key=sources.__getitem__)
+    sorted_targets = array("I", map(targets.__getitem__, order))
+
+    degrees = Counter(sources)
+    offsets = array("I", accumulate((degrees.get(node, 0) for node in range(num_nodes)), initial=0))
+    return offsets, sorted_targets
+
+
+def transpose(num_nodes: int, offsets: array, targets: array) -> tuple[array, array]:
+    # reverses every link, i.e. returns the incoming links of every page in CSR form
+    sources = array("I")
+    for node in range(num_nodes):
+        sources.extend(repeat(node, offsets[node + 1] - offsets[node]))
+    return build_csr(num_nodes, targets, sources)
+
+
+def build_link_graph(connection: sqlite3.Connection) -> None:
+    """
+    Writes link_graph_nodes and the CSR file of the database from its link tables.
+    """
+    cursor = connection.cursor()
+    crawled = [url_id for (url_id,) in cursor.execute("SELECT urlId FROM id_to_page_title ORDER BY rowid;")]
+    node_ids = {url_id: node for (node, url_id) in enumerate(crawled)}
+    for (url_id,) in cursor.execute("SELECT urlId FROM id_to_url ORDER BY rowid;"):
+        node_ids.setdefault(url_id, len(node_ids))
+
+    def csr(table: str, column: str) -> tuple[array, array]:
+        # the lists are streamed row by row, only the two integer arrays grow with the number of links
+        sources = array("I")
+        targets = array("I")
+        for (url_id, linked_url_ids) in cursor.execute(f"SELECT urlId, {column} FROM {table} ORDER BY rowid;"):
+            source = node_ids.setdefault(url_id, len(node_ids))
+            for linked_url_id in (linked_url_ids or "").split():
+                sources.append(source)
+                targets.append(node_ids.setdefault(linked_url_id, len(node_ids)))
+        return sources, targets
+
+    child_edges = csr("id_to_children_url_id", "childrenUrlId")
+    parent_edges = csr("id_to_parents_url_id", "parentsUrlId")
+    child_offsets, children = build_csr(len(node_ids), *child_edges)
+    parent_offsets, parents = build_csr(len(node_ids), *parent_edges)
+
+    with connection:
+        connection.execute("DROP TABLE IF EXISTS link_graph_nodes;")
+        connection.execute("CREATE TABLE link_graph_nodes(docId INTEGER PRIMARY KEY, urlId TEXT UNIQUE, url TEXT);")
+        # URLs missing from id_to_url keep a NULL url, like the lookups in id_to_url they replace
+        connection.executemany("INSERT INTO link_graph_nodes(docId, urlId, url) "
+                               "SELECT ?, ?, (SELECT url FROM id_to_url WHERE urlId = ?);",
+                               ((node, url_id, url_id) for (url_id, node) in node_ids.items()))
+
+    path = link_graph_path(database_path(connection))
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(node_ids), len(crawled), len(children), len(parents)))
+        for values in (child_offsets, children, parent_offsets, parents):
+            values.tofile(f)
+    os.replace(temp_path, path)
+
+
+class LinkGraph:
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.num_nodes, self.num_crawled, num_children, num_parents) = HEADER.unpack_from(self.mapping)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a link graph")
+        values = memoryview(self.mapping)[HEADER.size:].cast("I")
+        (self.child_offsets, self.children, self.parent_offsets, self.parents) = split(
+            values, (self.num_nodes + 1, num_children, self.num_nodes + 1, num_parents))
+
+    def child_ids(self, doc_id: int) -> memoryview:
+        return self.children[self.child_offsets[doc_id]:self.child_offsets[doc_id + 1]]
+
+    def parent_ids(self, doc_id: int) -> memoryview:
+        return self.parents[self.parent_offsets[doc_id]:self.parent_offsets[doc_id + 1]]
+
+    def crawled_graph(self) -> tuple[array, array]:
+        """
+        CSR (offsets, targets) of the links between crawled pages, without duplicate links and links to themselves.
+        """
+        sources = array("I")
+        targets = array("I")
+        for source in range(self.num_crawled):
+            for target in set(self.child_ids(source)):
+                if target < self.num_crawled and target != source:
+                    sources.append(source)
+                    targets.append(target)
+        return build_csr(self.num_crawled, sources, targets)
+
+
+def split(values: memoryview, sizes) -> list[memoryview]:
+    parts = []
+    start = 0
+    for size in sizes:
+        parts.append(values[start:start + size])
+        start += size
+    return parts
+
+
+def select_in(cursor: sqlite3.Cursor, query: str, values: list) -> list:
+    # the IN lists stay below SQLite's limit on the number of parameters
+    rows = []
+    for start in range(0, len(values), IN_CHUNK_SIZE):
+        chunk = values[start:start + IN_CHUNK_SIZE]
+        rows.extend(cursor.execute(query.format(",".join("?" * len(chunk))), chunk).fetchall())
+    return rows
+
+
+def resolve_doc_ids(cursor: sqlite3.Cursor, url_ids: list[str]) -> dict[str, int]:
+    return dict(select_in(cursor, "SELECT urlId, docId FROM link_graph_nodes WHERE urlId IN ({});", url_ids))
+
+
+def resolve_urls(cursor: sqlite3.Cursor, doc_ids: list[int]) -> dict[int, str]:
+    return dict(select_in(cursor, "SELECT docId, url FROM link_graph_nodes WHERE docId IN ({});", doc_ids))
+
+
+# {database file: (number of nodes, LinkGraph)} of the last generations; an evicted graph is unmapped once the
+# requests still using it are done
+_graphs = DatabaseCache()
+_graphs_lock = threading.Lock()
+
+
+def open_link_graph(connection: sqlite3.Connection) -> LinkGraph | None:
+    """
+    Returns the link graph of the database, or None if it was not built (or is out of date).
+    """
+    try:
+        (max_doc_id,) = connection.execute("SELECT MAX(docId) FROM link_graph_nodes;").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    num_nodes = max_doc_id + 1 if max_doc_id is not None else 0
+    path = database_path(connection)
+    if path is None or not os.path.exists(link_graph_path(path)):
+        return None
+    with _graphs_lock:
+        cached = _graphs.get(path)
+        if cached is None or cached[0] != num_nodes:
+            graph = LinkGraph(link_graph_path(path))
+            if graph.num_nodes != num_nodes:
+                return None
+            cached = (num_nodes, graph)
+            _graphs.put(path, cached)
+        return cached[1]
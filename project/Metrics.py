@@ -0,0 +1,167 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+"""
+Small in-process metrics: counters, latency histograms and per-request stage timings.
+Everything is recorded into the process-wide `REGISTRY`, which renders itself in the Prometheus text format.
+"""
+
+# upper bounds (seconds) of the latency histogram buckets, from 0.1 ms to 30 s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile by linear interpolation inside the bucket that contains it.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for (i, bucket_count) in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def snapshot(self) -> dict:
+        return {"count": self.count, "sum": self.sum, "mean": self.sum / self.count if self.count else 0.0,
+                "p50": self.quantile(0.5), "p95": self.quantile(0.95), "p99": self.quantile(0.99)}
+
+
+class MetricsRegistry:
+    """
+    Thread-safe collection of counters, gauges and histograms, identified by a name and optional labels.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def key(name: str, labels: dict | None) -> tuple:
+        return (name, tuple(sorted(labels.items())) if labels else ())
+
+    def increment(self, name: str, amount: float = 1, labels: dict | None = None) -> None:
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, labels: dict | None = None) -> None:
+        with self.lock:
+            self.gauges[self.key(name, labels)] = value
+
+    def observe(self, name: str, value: float, labels: dict | None = None) -> None:
+        key = self.key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self) -> dict:
+        """
+        Returns {"counters": {...}, "gauges": {...}, "histograms": {...}} keyed by name{labels}.
+        """
+        with self.lock:
+            return {"counters": {format_key(key): value for (key, value) in self.counters.items()},
+                    "gauges": {format_key(key): value for (key, value) in self.gauges.items()},
+                    "histograms": {format_key(key): histogram.snapshot() for (key, histogram) in self.histograms.items()}}
+
+    def render_text(self) -> str:
+        # Prometheus text exposition format
+        lines = []
+        with self.lock:
+            for (kind, metrics) in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted({name for (name, _) in metrics}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for ((metric_name, labels), value) in sorted(metrics.items()):
+                        if metric_name == name:
+                            lines.append(f"{format_key((name, labels))} {value}")
+
+            for name in sorted({name for (name, _) in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for ((metric_name, labels), histogram) in sorted(self.histograms.items()):
+                    if metric_name != name:
+                        continue
+                    cumulative = 0
+                    for (bound, bucket_count) in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                        cumulative += bucket_count
+                        lines.append(f"{format_key((name + '_bucket', labels + (('le', str(bound)),)))} {cumulative}")
+                    lines.append(f"{format_key((name + '_sum', labels))} {histogram.sum}")
+                    lines.append(f"{format_key((name + '_count', labels))} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+
+def format_key(key: tuple) -> str:
+    (name, labels) = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{label}="{value}"' for (label, value) in labels) + "}"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class StageTimer:
+    """
+    Times the stages of one request, e.g.
+
+        timer = StageTimer("retrieval_stage_seconds")
+        with timer.span("parse"):
+            ...
+
+    Every span is added to the `histogram` of the registry (labelled with the stage), and the durations of this
+    request are kept in `stages` for logging.
+    """
+
+    def __init__(self, histogram: str, registry: MetricsRegistry = REGISTRY):
+        self.histogram = histogram
+        self.registry = registry
+        self.stages = {}
+        self.start_time = time.perf_counter()
+
+    @contextmanager
+    def span(self, stage: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start_time)
+
+    def record(self, stage: str, seconds: float) -> None:
+        # a stage that runs several times per request (e.g. once per phrase) is summed
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.registry.observe(self.histogram, seconds, {"stage": stage})
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start_time
+
+    def breakdown(self) -> str:
+        return " ".join(f"{stage}={seconds * 1000:.1f}ms" for (stage, seconds) in self.stages.items())
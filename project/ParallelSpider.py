@@ -0,0 +1,334 @@
+import os
+import time
+import sqlite3
+import asyncio
+import argparse
+import multiprocessing
+from collections import deque
+from Indexer import Indexer
+from PostingList import PostingList
+from Spider import Spider
+from ShardedIndex import unregister_shards
+from SegmentedIndex import drop_segments
+from ConnectionManager import get_connection_manager
+from Generations import create_staging_database, publish_database
+from LinkGraph import build_link_graph
+
+
+def frontier_path_for(db_path: str) -> str:
+    # e.g. main.db -> main.frontier.db
+    root, ext = os.path.splitext(db_path)
+    return f"{root}.frontier{ext}"
+
+
+def partial_path_for(db_path: str, worker_id: int) -> str:
+    # e.g. main.db -> main.part0.db, main.part1.db, ...
+    root, ext = os.path.splitext(db_path)
+    return f"{root}.part{worker_id}{ext}"
+
+
+def remove_database(path: str) -> None:
+    for suffix in ("", "-wal", "-shm", ".vocab.snapshot"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def create_frontier_db(frontier_path: str, num_processes: int) -> None:
+    connection = sqlite3.connect(frontier_path)
+    connection.execute("PRAGMA journal_mode=WAL;")
+    with connection:
+        # state: 0 = pending, 1 = claimed by a crawler process
+        connection.execute("CREATE TABLE frontier(url TEXT PRIMARY KEY, parentUrlId TEXT, state INTEGER);")
+        connection.execute("CREATE INDEX frontier_state ON frontier(state);")
+        connection.execute("CREATE TABLE frontier_workers(workerId INTEGER PRIMARY KEY, inFlight INTEGER);")
+        connection.execute("CREATE TABLE frontier_counters(name TEXT PRIMARY KEY, value INTEGER);")
+        connection.execute("INSERT INTO frontier_counters VALUES('claimed', 0);")
+        connection.executemany("INSERT INTO frontier_workers VALUES(?, 0);", [(i,) for i in range(num_processes)])
+    connection.close()
+
+
+class SharedFrontier:
+    """
+    Deduplicating crawl frontier shared by several crawler processes through a SQLite file.
+    It implements the part of the asyncio.Queue interface that Spider uses (get, put_nowait, task_done, join, qsize),
+    so an unmodified Spider can crawl from it.
+
+    URLs are claimed in small batches inside BEGIN IMMEDIATE transactions, so every URL is handed to exactly one process.
+    Each process publishes how many claimed URLs it still has in flight; the crawl is over when nothing is pending and
+    nothing is in flight anywhere, or when `max_pages` URLs have been claimed in total.
+    """
+
+    def __init__(self, frontier_path: str, max_pages: int, worker_id: int = 0, claim_batch_size: int = 8,
+                 poll_interval: float = 0.05):
+        self.connection = sqlite3.connect(frontier_path, timeout=60, isolation_level=None)
+        self.connection.execute("PRAGMA synchronous=NORMAL;")
+        self.max_pages = max_pages
+        self.worker_id = worker_id
+        self.claim_batch_size = claim_batch_size
+        self.poll_interval = poll_interval
+
+        self.claimed = deque()
+        self.in_flight = 0
+        self.waiting = 0
+        self.pending_links = []
+        self.last_empty_claim = 0.0
+
+    def transaction(self, statements) -> None:
+        self.connection.execute("BEGIN IMMEDIATE;")
+        try:
+            statements()
+            self.connection.execute("COMMIT;")
+        except Exception:
+            self.connection.execute("ROLLBACK;")
+            raise
+
+    def flush_links(self) -> None:
+        if not self.pending_links:
+            return
+        links = self.pending_links
+        self.pending_links = []
+        self.transaction(lambda: self.connection.executemany(
+            "INSERT OR IGNORE INTO frontier(url, parentUrlId, state) VALUES(?, ?, 0);", links))
+
+    def claim(self) -> None:
+        # don't hammer the frontier while it is empty
+        if time.monotonic() - self.last_empty_claim < self.poll_interval:
+            return
+        self.flush_links()
+
+        rows = []
+
+        def claim_rows():
+            claimed = self.connection.execute("SELECT value FROM frontier_counters WHERE name = 'claimed';").fetchone()[0]
+            limit = min(max(self.claim_batch_size, self.waiting), self.max_pages - claimed)
+            if limit <= 0:
+                return
+            rows.extend(self.connection.execute(
+                "SELECT rowid, url, parentUrlId FROM frontier WHERE state = 0 ORDER BY rowid LIMIT ?;", (limit,)).fetchall())
+            self.connection.executemany("UPDATE frontier SET state = 1 WHERE rowid = ?;", [(row[0],) for row in rows])
+            self.connection.execute("UPDATE frontier_counters SET value = value + ? WHERE name = 'claimed';", (len(rows),))
+            self.connection.execute("UPDATE frontier_workers SET inFlight = ? WHERE workerId = ?;",
+                                    (self.in_flight + len(rows), self.worker_id))
+
+        self.transaction(claim_rows)
+        if not rows:
+            self.last_empty_claim = time.monotonic()
+        self.in_flight += len(rows)
+        self.claimed.extend((url, parent_url_id) for (_, url, parent_url_id) in rows)
+
+    def finished(self) -> bool:
+        # publish our own in-flight count, then check whether any process can still add work
+        self.connection.execute("UPDATE frontier_workers SET inFlight = ? WHERE workerId = ?;",
+                                (self.in_flight, self.worker_id))
+        claimed = self.connection.execute("SELECT value FROM frontier_counters WHERE name = 'claimed';").fetchone()[0]
+        if claimed >= self.max_pages:
+            return True
+        pending = self.connection.execute("SELECT EXISTS(SELECT 1 FROM frontier WHERE state = 0);").fetchone()[0]
+        in_flight = self.connection.execute("SELECT SUM(inFlight) FROM frontier_workers;").fetchone()[0]
+        return not pending and in_flight == 0
+
+
+    # asyncio.Queue interface
+
+    async def get(self):
+        self.waiting += 1
+        try:
+            while not self.claimed:
+                self.claim()
+                if not self.claimed:
+                    await asyncio.sleep(self.poll_interval)
+        finally:
+            self.waiting -= 1
+        return self.claimed.popleft()
+
+    async def put(self, item) -> None:
+        self.put_nowait(item)
+
+    def put_nowait(self, item) -> None:
+        # links are buffered and inserted in one transaction when the page is done
+        self.pending_links.append(item)
+
+    def task_done(self) -> None:
+        # links have to reach the frontier before the page stops counting as in flight
+        self.flush_links()
+        self.in_flight -= 1
+
+    def qsize(self) -> int:
+        # URLs waiting anywhere: claimed by this process, buffered for insertion, or pending in the shared frontier
+        pending = self.connection.execute("SELECT COUNT(*) FROM frontier WHERE state = 0;").fetchone()[0]
+        return len(self.claimed) + len(self.pending_links) + pending
+
+    async def join(self) -> None:
+        while True:
+            self.flush_links()
+            if self.in_flight == 0 and self.finished():
+                return
+            await asyncio.sleep(self.poll_interval)
+
+
+class FrontierSpider(Spider):
+    """
+    The Spider run by one crawler process: it takes its URLs from the shared frontier
+    and builds a partial index in its own database.
+    """
+
+    def __init__(self, start_url: str, max_pages: int, db_connection: sqlite3.Connection, indexer: Indexer,
+                 frontier: SharedFrontier):
+        super().__init__(start_url, max_pages, db_connection, indexer)
+        self.frontier = frontier
+
+    def create_frontier(self):
+        return self.frontier
+
+    def write_batch(self, batch):
+        # the partial index is only read by the merge, so it is written once when the crawl is over (see
+        # crawl_process): rewriting the whole index with every batch made a process quadratic in its pages
+        self.write_page_rows(batch)
+        self.db.commit()
+        batch.clear()
+
+    def print_database_summary(self):
+        print(f"Crawler process {self.frontier.worker_id} crawled {len(self.visited_urls)} pages.")
+
+
+def crawl_process(worker_id: int, start_url: str, max_pages: int, db_path: str, num_workers: int) -> None:
+    db_connection = sqlite3.connect(partial_path_for(db_path, worker_id), check_same_thread=False)
+    db_connection.execute("PRAGMA journal_mode=WAL;")
+    indexer = Indexer(db_connection)
+    frontier = SharedFrontier(frontier_path_for(db_path), max_pages, worker_id)
+    spider = FrontierSpider(start_url, max_pages, db_connection, indexer, frontier)
+    asyncio.run(spider.crawl_async(num_workers=num_workers))
+    indexer.updateSQLiteDB()
+    db_connection.commit()
+    db_connection.close()
+
+
+class ParallelSpider:
+    """
+    Coordinator of a multi-process crawl: it starts `num_processes` crawler processes, each with its own
+    aiohttp fetch loop and partial index, and merges the partial indexes into `db_path` once they are done.
+    """
+
+    def __init__(self, start_url: str, max_pages: int, db_path: str, num_processes: int, num_workers: int = 40):
+        self.start_url = start_url
+        self.max_pages = max_pages
+        self.db_path = db_path
+        self.num_processes = num_processes
+        self.num_workers = num_workers
+
+    def crawl(self) -> None:
+        start_time = time.time()
+
+        frontier_path = frontier_path_for(self.db_path)
+        remove_database(frontier_path)
+        for worker_id in range(self.num_processes):
+            remove_database(partial_path_for(self.db_path, worker_id))
+        create_frontier_db(frontier_path, self.num_processes)
+
+        processes = [multiprocessing.Process(target=crawl_process,
+                                             args=(worker_id, self.start_url, self.max_pages, self.db_path, self.num_workers))
+                     for worker_id in range(self.num_processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        crawl_time = time.time() - start_time
+
+        self.merge_partial_indexes()
+
+        remove_database(frontier_path)
+        for worker_id in range(self.num_processes):
+            remove_database(partial_path_for(self.db_path, worker_id))
+
+        print(f"Crawling time: {crawl_time:.2f} seconds, merging time: {time.time() - start_time - crawl_time:.2f} seconds")
+
+    def merge_partial_indexes(self) -> None:
+        connection_manager = get_connection_manager(self.db_path)
+        db_connection = connection_manager.writer()
+        # the merged index is a single, unsharded index written in place (the database may be a copy of a sharded
+        # or segmented generation)
+        unregister_shards(db_connection)
+        drop_segments(db_connection)
+        indexer = Indexer(db_connection)
+        spider = Spider(self.start_url, self.max_pages, db_connection, indexer)
+        spider.clear_spider_tables()
+
+        # format is as follows:
+        # {urlId: [linkedUrlId1, linkedUrlId2, ...]}
+        children = {}
+        parents = {}
+
+        for worker_id in range(self.num_processes):
+            partial_path = partial_path_for(self.db_path, worker_id)
+            if not os.path.exists(partial_path):
+                continue
+
+            # URL IDs are the same in every partial database, so the page tables can be copied as they are
+            db_connection.execute("ATTACH DATABASE ? AS part;", (partial_path,))
+            with db_connection:
+                for table in ("url_to_id", "id_to_url", "crawled_page_to_id"):
+                    db_connection.execute(f"INSERT OR IGNORE INTO {table} SELECT * FROM part.{table};")
+                for table in ("id_to_page_title", "id_to_last_modification_date", "id_to_page_size"):
+                    db_connection.execute(f"INSERT OR REPLACE INTO {table} SELECT * FROM part.{table};")
+                spider.documents.copy_from("part")
+                spider.tokens.copy_from("part")
+
+            # a page can be linked from pages crawled by different processes, so the link lists are merged
+            for (table, links) in (("id_to_children_url_id", children), ("id_to_parents_url_id", parents)):
+                for (url_id, linked_url_ids) in db_connection.execute(f"SELECT * FROM part.{table};").fetchall():
+                    merged = links.setdefault(url_id, [])
+                    for linked_url_id in (linked_url_ids or "").split():
+                        if linked_url_id not in merged:
+                            merged.append(linked_url_id)
+            db_connection.commit()
+            db_connection.execute("DETACH DATABASE part;")
+
+            partial_connection = sqlite3.connect(partial_path)
+            self.merge_index(indexer, Indexer(partial_connection))
+            partial_connection.close()
+
+        with db_connection:
+            db_connection.executemany("INSERT OR REPLACE INTO id_to_children_url_id VALUES(?, ?);",
+                                      [(url_id, " ".join(ids)) for (url_id, ids) in children.items()])
+            db_connection.executemany("INSERT OR REPLACE INTO id_to_parents_url_id VALUES(?, ?);",
+                                      [(url_id, " ".join(ids)) for (url_id, ids) in parents.items()])
+        indexer.updateSQLiteDB()
+        build_link_graph(db_connection)
+        spider.print_database_summary()
+        connection_manager.checkpoint()
+        connection_manager.close()
+
+    def merge_index(self, indexer: Indexer, partial: Indexer) -> None:
+        # word IDs are generated independently by every process, so they are mapped through the words themselves
+        indexer.addNewWord(list(partial.word_to_id.keys()))
+        word_id_map = {partial_word_id: indexer.word_to_id[word] for (word, partial_word_id) in partial.word_to_id.items()}
+
+        # every page was crawled by exactly one process, so the postings of different processes never overlap
+        for (target_index, partial_index) in ((indexer.body_inverted_index, partial.body_inverted_index),
+                                              (indexer.title_inverted_index, partial.title_inverted_index)):
+            for (word_id, postings) in partial_index.items():
+                target_postings = target_index.get(word_id_map[word_id])
+                if target_postings is None:
+                    target_postings = target_index[word_id_map[word_id]] = PostingList(indexer.posting_store)
+                for (url_id, posting) in postings.items():
+                    target_postings.append(url_id, posting["positions"])
+
+        for (url_id, word_ids) in partial.forward_index.items():
+            indexer.forward_index[url_id] = [word_id_map[word_id] for word_id in word_ids if word_id in word_id_map]
+            indexer.changed_documents.add(url_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl with several processes sharing one frontier.")
+    parser.add_argument("--start-url", default="https://www.cse.ust.hk/~kwtleung/COMP4321/testpage.htm")
+    parser.add_argument("--max-pages", type=int, default=300)
+    parser.add_argument("--db", default="main.db")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--workers", type=int, default=40, help="fetch coroutines per process")
+    args = parser.parse_args()
+
+    # like Spider.py, the crawl builds and then publishes a new generation of the database
+    staging_path = create_staging_database(args.db)
+    ParallelSpider(args.start_url, args.max_pages, staging_path, args.processes, args.workers).crawl()
+    publish_database(args.db, staging_path)
+    print(f"Published {staging_path}")
@@ -0,0 +1,100 @@
+import time
+import queue
+import asyncio
+import threading
+
+"""
+Write-behind persistence of a crawl. The fetch coroutines parse and stem the pages on the event loop and hand the
+results to a Persister; its thread is the only one touching the database and the Indexer, and it commits the pages in
+group transactions (every `batch_size` pages or `flush_interval` seconds, whichever comes first).
+
+The queue between them is bounded: when the writer falls behind, put() waits until there is room again, so the
+crawl slows down to the speed of the disk instead of buffering an unbounded number of pages in memory. A put()
+cancelled while waiting (the crawl is stopping) keeps its page in `overflow`, which close() hands over before stopping.
+"""
+
+# stops the writer thread once everything before it is written
+_CLOSE = object()
+
+
+class Persister(threading.Thread):
+    def __init__(self, spider, max_pending: int = 256, batch_size: int = 10, flush_interval: float = 2.0):
+        super().__init__(name="Persister", daemon=True)
+        self.spider = spider
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # pages stored since the last group commit
+        self.batch = []
+        # pages whose put() was cancelled while the queue was full, only touched on the event loop
+        self.overflow = []
+        self.error = None
+
+    async def put(self, record) -> None:
+        """
+        Queues a page record for the writer, waiting (without blocking the event loop) while the queue is full.
+        """
+        wait_start = None
+        while True:
+            if self.error is not None:
+                raise RuntimeError("the persister thread failed") from self.error
+            try:
+                self.queue.put_nowait(record)
+                break
+            except queue.Full:
+                if wait_start is None:
+                    wait_start = time.perf_counter()
+                try:
+                    await asyncio.sleep(0.005)
+                except asyncio.CancelledError:
+                    # the crawl is stopping, but the page is already counted as visited: close() writes it
+                    self.overflow.append(record)
+                    raise
+        if wait_start is not None:
+            self.spider.metrics.persist_wait(time.perf_counter() - wait_start)
+
+    def pending(self) -> int:
+        return self.queue.qsize() + len(self.overflow)
+
+    def run(self) -> None:
+        try:
+            last_flush = time.monotonic()
+            while True:
+                timeout = max(0.0, last_flush + self.flush_interval - time.monotonic()) if self.batch else None
+                try:
+                    record = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    record = None
+                if record is _CLOSE:
+                    break
+                if record is not None:
+                    self.spider.store_page(record, self.batch)
+                if self.batch and (len(self.batch) >= self.batch_size or time.monotonic() - last_flush >= self.flush_interval):
+                    self.spider.flush_batch(self.batch)
+                    last_flush = time.monotonic()
+
+            # the last (partial) block of the document store and the last pages
+            self.spider.documents.flush()
+            if self.batch:
+                self.spider.flush_batch(self.batch)
+            self.spider.db.commit()
+        except BaseException as e:
+            self.error = e
+            # unblock producers waiting for room, nothing is written anymore
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+    async def close(self) -> None:
+        """
+        Writes everything that is queued (including the pages of cancelled puts) and stops the thread.
+        """
+        if self.is_alive():
+            while self.overflow:
+                await self.put(self.overflow.pop(0))
+            await self.put(_CLOSE)
+            await asyncio.to_thread(self.join)
+        if self.error is not None:
+            raise RuntimeError("the persister thread failed") from self.error
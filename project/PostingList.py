@@ -0,0 +1,185 @@
+import threading
+from array import array
+from bisect import bisect_left
+from collections.abc import MutableMapping
+
+# posting lists read per "IN (...)" query
+IN_CHUNK_SIZE = 500
+
+
+class PostingStore:
+    """
+    Columns shared by all posting lists of an index: the URL ID <-> dense document ID mapping
+    and one positions array that every posting list points into.
+    """
+    __slots__ = ("url_ids", "dense_ids", "positions")
+
+    def __init__(self):
+        self.url_ids: list[str] = []
+        self.dense_ids: dict[str, int] = {}
+        self.positions = array("I")
+
+    def denseId(self, url_id: str) -> int:
+        # dense IDs are handed out in the order documents are first seen, i.e. crawl order
+        dense_id = self.dense_ids.get(url_id)
+        if dense_id is None:
+            dense_id = len(self.url_ids)
+            self.dense_ids[url_id] = dense_id
+            self.url_ids.append(url_id)
+        return dense_id
+
+
+class PostingList(MutableMapping):
+    """
+    Compact posting list: parallel array('I') columns of dense document IDs (kept sorted), term frequencies
+    and offsets into the shared positions array, instead of one {"frequency": n, "positions": [...]} dict per document.
+
+    It still behaves like the old {url_id: {"frequency": n, "positions": [...]}} dict: reading a posting builds
+    that small dict on the fly, and assigning one appends it to the columns.
+    """
+    __slots__ = ("store", "doc_ids", "frequencies", "offsets")
+
+    def __init__(self, store: PostingStore):
+        self.store = store
+        self.doc_ids = array("I")
+        self.frequencies = array("I")
+        self.offsets = array("I")
+
+    def _row(self, url_id: str) -> int:
+        dense_id = self.store.dense_ids.get(url_id)
+        if dense_id is None:
+            return -1
+        row = bisect_left(self.doc_ids, dense_id)
+        if row < len(self.doc_ids) and self.doc_ids[row] == dense_id:
+            return row
+        return -1
+
+    def _posting(self, row: int) -> dict:
+        offset = self.offsets[row]
+        frequency = self.frequencies[row]
+        return {"frequency": frequency, "positions": self.store.positions[offset:offset + frequency].tolist()}
+
+    def append(self, url_id: str, positions) -> None:
+        """
+        Adds or replaces the posting of a document; the fast path is a document newer than all the others.
+        """
+        store = self.store
+        dense_id = store.denseId(url_id)
+        offset = len(store.positions)
+        store.positions.extend(positions)
+        frequency = len(store.positions) - offset
+
+        if not self.doc_ids or dense_id > self.doc_ids[-1]:
+            self.doc_ids.append(dense_id)
+            self.frequencies.append(frequency)
+            self.offsets.append(offset)
+            return
+
+        row = bisect_left(self.doc_ids, dense_id)
+        if row < len(self.doc_ids) and self.doc_ids[row] == dense_id:
+            # the old positions stay unused in the shared array
+            self.frequencies[row] = frequency
+            self.offsets[row] = offset
+        else:
+            self.doc_ids.insert(row, dense_id)
+            self.frequencies.insert(row, frequency)
+            self.offsets.insert(row, offset)
+
+    def frequency(self, url_id: str) -> int:
+        row = self._row(url_id)
+        if row < 0:
+            raise KeyError(url_id)
+        return self.frequencies[row]
+
+
+    # dict interface
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def __iter__(self):
+        url_ids = self.store.url_ids
+        for dense_id in self.doc_ids:
+            yield url_ids[dense_id]
+
+    def __contains__(self, url_id) -> bool:
+        return self._row(url_id) >= 0
+
+    def __getitem__(self, url_id: str) -> dict:
+        row = self._row(url_id)
+        if row < 0:
+            raise KeyError(url_id)
+        return self._posting(row)
+
+    def __setitem__(self, url_id: str, posting: dict) -> None:
+        self.append(url_id, posting["positions"])
+
+    def __delitem__(self, url_id: str) -> None:
+        row = self._row(url_id)
+        if row < 0:
+            raise KeyError(url_id)
+        del self.doc_ids[row]
+        del self.frequencies[row]
+        del self.offsets[row]
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        # one pass over the columns instead of one binary search per document
+        url_ids = self.store.url_ids
+        return [(url_ids[dense_id], self._posting(row)) for (row, dense_id) in enumerate(self.doc_ids)]
+
+    def values(self):
+        return [self._posting(row) for row in range(len(self.doc_ids))]
+
+    def __repr__(self) -> str:
+        return f"PostingList({dict(self.items())!r})"
+
+
+def decode_posting_list(value: str, store: PostingStore) -> PostingList:
+    # same text format as Indexer.decode_postings, parsed straight into the columns
+    postings = PostingList(store)
+
+    for entry in value.split(" "):
+        url_id, _, positions = entry.split(";")
+        postings.append(url_id, map(int, positions.split(",")))
+
+    return postings
+
+
+class PostingCache:
+    """
+    Body and title posting lists of one version of a database, decoded on demand: a query only decodes the lists of
+    its own words, and they are kept for the next queries of the process (see Statistics.IndexStatistics.postings).
+    """
+
+    def __init__(self, store: PostingStore):
+        self.store = store
+        self.body: dict[str, PostingList] = {}
+        self.title: dict[str, PostingList] = {}
+        # rowid of every decoded body list, i.e. the order in which the whole index is read
+        self.rowids: dict[str, int] = {}
+        # word IDs looked up in the tables (decoded or known to be missing)
+        self.loaded = set()
+        # the lists of one store are decoded by one thread at a time
+        self.lock = threading.Lock()
+
+    def load(self, cursor, word_ids) -> None:
+        with self.lock:
+            missing = [word_id for word_id in set(word_ids) if word_id is not None and word_id not in self.loaded]
+            for start in range(0, len(missing), IN_CHUNK_SIZE):
+                chunk = missing[start:start + IN_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                for (rowid, word_id, value) in cursor.execute(
+                        f"SELECT rowid, wordId, value FROM body_inverted_index WHERE wordId IN ({placeholders});", chunk).fetchall():
+                    self.body[word_id] = decode_posting_list(value, self.store)
+                    self.rowids[word_id] = rowid
+                for (word_id, value) in cursor.execute(
+                        f"SELECT wordId, value FROM title_inverted_index WHERE wordId IN ({placeholders});", chunk).fetchall():
+                    self.title[word_id] = decode_posting_list(value, self.store)
+                self.loaded.update(chunk)
+
+    def in_index_order(self, word_ids) -> list[str]:
+        # the loaded word IDs of the body index, in the order of the table
+        return sorted((word_id for word_id in set(word_ids) if word_id in self.rowids), key=self.rowids.__getitem__)
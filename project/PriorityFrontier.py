@@ -0,0 +1,192 @@
+import re
+import heapq
+import asyncio
+from SeenUrlSet import url_hash
+
+"""
+Best-first crawl frontier: the URL with the highest priority is crawled next, so a fixed page budget (max_pages) is
+spent on the most valuable pages first instead of wherever the BFS happens to be.
+
+The priority comes from a frontier policy, selected with Spider(frontier_policy=get_frontier_policy(...)):
+
+    depth    pages closest to the start URL first (BFS by link distance, not by discovery order)
+    inlinks  pages with the most in-links observed so far
+    opic     online page importance (OPIC, Abiteboul et al. 2003), an online estimate of PageRank: every crawled
+             page gives its cash to its links in equal parts, the URL with the most cash is crawled next
+    rules    sum of the weights of the URL patterns (--url-rule PATTERN=WEIGHT) a URL matches
+
+A policy sees the links of every crawled page (observe), so priorities can rise after a URL was queued; the queued
+URL is then pushed again with its new priority, and the outdated heap entry is skipped when it comes up. Ties are
+broken by discovery order. Unlike SpillingQueue, every queued URL is kept in memory.
+
+The policies keep their statistics by the 64-bit hash of the URL (SeenUrlSet.url_hash), not by the URL string, and
+only for URLs that are not crawled yet: a crawled page drops its own entry when its links are observed, and the links
+pointing to crawled pages are forgotten. What is left are the queued URLs and those whose fetch failed.
+"""
+
+
+class DepthPolicy:
+    def __init__(self):
+        # {URL hash: shortest link distance from a start URL seen so far}
+        self.depths = {}
+
+    def seed(self, url: str) -> None:
+        self.depths[url_hash(url)] = 0
+
+    def observe(self, url: str, links: list[str]) -> None:
+        depth = self.depths.pop(url_hash(url), 0) + 1
+        for link in links:
+            key = url_hash(link)
+            if depth < self.depths.get(key, depth + 1):
+                self.depths[key] = depth
+
+    def priority(self, url: str) -> float:
+        return -self.depths.get(url_hash(url), 0)
+
+    def forget(self, url: str) -> None:
+        self.depths.pop(url_hash(url), None)
+
+
+class InLinkPolicy:
+    def __init__(self):
+        # {URL hash: in-links observed}
+        self.in_links = {}
+
+    def seed(self, url: str) -> None:
+        pass
+
+    def observe(self, url: str, links: list[str]) -> None:
+        self.in_links.pop(url_hash(url), None)
+        for link in set(links):
+            key = url_hash(link)
+            self.in_links[key] = self.in_links.get(key, 0) + 1
+
+    def priority(self, url: str) -> float:
+        return self.in_links.get(url_hash(url), 0)
+
+    def forget(self, url: str) -> None:
+        self.in_links.pop(url_hash(url), None)
+
+
+class OpicPolicy:
+    def __init__(self):
+        # {URL hash: cash}
+        self.cash = {}
+
+    def seed(self, url: str) -> None:
+        key = url_hash(url)
+        self.cash[key] = self.cash.get(key, 0.0) + 1.0
+
+    def observe(self, url: str, links: list[str]) -> None:
+        # the cash of a crawled page is spent, pages without links lose it
+        cash = self.cash.pop(url_hash(url), 0.0)
+        links = set(links)
+        if not links:
+            return
+        share = cash / len(links)
+        for link in links:
+            key = url_hash(link)
+            self.cash[key] = self.cash.get(key, 0.0) + share
+
+    def priority(self, url: str) -> float:
+        return self.cash.get(url_hash(url), 0.0)
+
+    def forget(self, url: str) -> None:
+        self.cash.pop(url_hash(url), None)
+
+
+class UrlRulePolicy:
+    def __init__(self, rules: list[tuple[str, float]]):
+        self.rules = [(re.compile(pattern), weight) for (pattern, weight) in rules]
+
+    def seed(self, url: str) -> None:
+        pass
+
+    def observe(self, url: str, links: list[str]) -> None:
+        pass
+
+    def priority(self, url: str) -> float:
+        return sum(weight for (pattern, weight) in self.rules if pattern.search(url))
+
+    def forget(self, url: str) -> None:
+        pass
+
+
+FRONTIER_POLICIES = {"depth": DepthPolicy, "inlinks": InLinkPolicy, "opic": OpicPolicy, "rules": UrlRulePolicy}
+
+
+def parse_url_rule(rule: str) -> tuple[str, float]:
+    # PATTERN=WEIGHT, e.g. "/news/=2" or "\.pdf$=-5"
+    (pattern, _, weight) = rule.rpartition("=")
+    if not pattern:
+        raise ValueError(f"URL rule '{rule}' is not PATTERN=WEIGHT")
+    return pattern, float(weight)
+
+
+def get_frontier_policy(name: str, url_rules: list[str] | None = None):
+    if name == "rules":
+        return UrlRulePolicy([parse_url_rule(rule) for rule in url_rules or []])
+    try:
+        return FRONTIER_POLICIES[name]()
+    except KeyError:
+        raise ValueError(f"unknown frontier policy '{name}', expected one of {', '.join(FRONTIER_POLICIES)}") from None
+
+
+class PriorityFrontier(asyncio.Queue):
+    """
+    asyncio.Queue of (url, parent URL ID) returning the URL with the highest priority first.
+    Every URL is put once (Spider keeps the enqueued URLs).
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        super().__init__()
+
+    def _init(self, maxsize):
+        # heap of (-priority, discovery order, url)
+        self._queue = []
+        # {url: (priority, discovery order, parent URL ID)} of the queued URLs
+        self._entries = {}
+        self._discovered = 0
+
+    # asyncio.Queue only counts self._queue, which also holds outdated entries
+
+    def qsize(self):
+        return len(self._entries)
+
+    def empty(self):
+        return not self._entries
+
+    def _put(self, item):
+        (url, parent_url_id) = item
+        if parent_url_id is None:
+            self.policy.seed(url)
+        priority = self.policy.priority(url)
+        self._entries[url] = (priority, self._discovered, parent_url_id)
+        heapq.heappush(self._queue, (-priority, self._discovered, url))
+        self._discovered += 1
+
+    def _get(self):
+        while True:
+            (negative_priority, discovered, url) = heapq.heappop(self._queue)
+            entry = self._entries.get(url)
+            if entry is not None and entry[0] == -negative_priority:
+                del self._entries[url]
+                return (url, entry[2])
+
+    def observe_links(self, url: str, links: list[str], crawled=()) -> None:
+        """
+        Lets the policy see the links of a crawled page, and re-queues the queued links whose priority changed.
+        The policy forgets the links that are in `crawled` (the visited URLs), their priority is never used again.
+        """
+        self.policy.observe(url, links)
+        for link in set(links):
+            entry = self._entries.get(link)
+            if entry is None:
+                if link in crawled:
+                    self.policy.forget(link)
+                continue
+            priority = self.policy.priority(link)
+            if priority != entry[0]:
+                self._entries[link] = (priority, entry[1], entry[2])
+                heapq.heappush(self._queue, (-priority, entry[1], link))
@@ -0,0 +1,146 @@
+import re
+from collections import namedtuple
+
+"""
+Parser of boolean queries:
+
+    computer AND (science OR engineering) NOT "data mining"
+    title:hkust AND admission
+    title:("computer science" OR engineering)
+
+AND, OR and NOT are operators only in upper case, so lower-case "and"/"or"/"not" stay ordinary (stop)words.
+Operands written next to each other without an operator are combined with OR, like a plain query. NOT binds
+tighter than AND, which binds tighter than OR; "a NOT b" means "a AND NOT b". `title:` restricts the following word,
+phrase or parenthesized group to the page titles, otherwise a word matches the body or the title.
+A query without any of this syntax is not parsed here and is scored like before (Retrieval.process_query).
+"""
+
+# leaves hold the raw text until Retrieval maps them to word IDs, field is None (body or title) or "title"
+Term = namedtuple("Term", ["text", "field"])
+Phrase = namedtuple("Phrase", ["text", "field"])
+And = namedtuple("And", ["items"])
+Or = namedtuple("Or", ["items"])
+Not = namedtuple("Not", ["item"])
+
+TOKEN_PATTERN = re.compile(r'\s*(?:(?P<open>\()|(?P<close>\))|(?P<field>title:)|"(?P<phrase>[^"]*)"|(?P<word>[^\s()"]+))')
+OPERATORS = ("AND", "OR", "NOT")
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+def has_operators(query: str) -> bool:
+    # boolean syntax: an upper-case operator, a parenthesis or a field restriction
+    return any(token[0] in ("open", "close", "field") or (token[0] == "word" and token[1] in OPERATORS)
+               for token in tokenize(query))
+
+
+def tokenize(query: str) -> list[tuple[str, str]]:
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(query):
+        kind = match.lastgroup
+        if kind is not None:
+            tokens.append((kind, match.group(kind)))
+    return tokens
+
+
+def parse_query(query: str):
+    """
+    Returns the query tree of `query` (None for an empty query). Raises QuerySyntaxError on unbalanced parentheses
+    or a dangling operator.
+    """
+    parser = _Parser(tokenize(query))
+    tree = parser.parse_or(None)
+    if parser.position < len(parser.tokens):
+        raise QuerySyntaxError(f"unexpected '{parser.tokens[parser.position][1]}'")
+    return tree
+
+
+class _Parser:
+    # recursive descent over: or := and ([OR] and)* ; and := unary (AND unary | NOT unary)* ; unary := NOT unary | primary
+
+    def __init__(self, tokens: list[tuple[str, str]]):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def is_operator(self, name: str) -> bool:
+        return self.peek() == ("word", name)
+
+    def starts_operand(self) -> bool:
+        kind, value = self.peek()
+        return kind in ("open", "field", "phrase") or (kind == "word" and value not in ("AND", "OR"))
+
+    def parse_or(self, field):
+        items = [self.parse_and(field)]
+        while True:
+            if self.is_operator("OR"):
+                self.position += 1
+            elif not self.starts_operand():
+                break
+            items.append(self.parse_and(field))
+        items = [item for item in items if item is not None]
+        if not items:
+            return None
+        return items[0] if len(items) == 1 else Or(tuple(items))
+
+    def parse_and(self, field):
+        items = [self.parse_unary(field)]
+        while True:
+            if self.is_operator("AND"):
+                self.position += 1
+                items.append(self.parse_unary(field))
+            elif self.is_operator("NOT"):
+                # "a NOT b" is "a AND NOT b"
+                items.append(self.parse_unary(field))
+            else:
+                break
+        items = [item for item in items if item is not None]
+        if not items:
+            return None
+        return items[0] if len(items) == 1 else And(tuple(items))
+
+    def parse_unary(self, field):
+        if self.is_operator("NOT"):
+            self.position += 1
+            item = self.parse_unary(field)
+            return Not(item) if item is not None else None
+        return self.parse_primary(field)
+
+    def parse_primary(self, field):
+        kind, value = self.peek()
+        if kind is None or (kind == "word" and value in OPERATORS):
+            raise QuerySyntaxError("missing operand" + (f" after '{self.tokens[self.position - 1][1]}'" if self.position else ""))
+        self.position += 1
+
+        if kind == "field":
+            return self.parse_primary("title")
+        if kind == "open":
+            item = self.parse_or(field)
+            if self.peek()[0] != "close":
+                raise QuerySyntaxError("missing ')'")
+            self.position += 1
+            return item
+        if kind == "close":
+            raise QuerySyntaxError("unexpected ')'")
+        if kind == "phrase":
+            return Phrase(value.lower(), field) if value.strip() else None
+        return Term(value.lower(), field)
+
+
+def leaves(tree, negated: bool = False):
+    """
+    Yields (leaf, negated) for every Term/Phrase of the tree; negated leaves only exclude documents.
+    """
+    if tree is None:
+        return
+    if isinstance(tree, (Term, Phrase)):
+        yield (tree, negated)
+    elif isinstance(tree, Not):
+        yield from leaves(tree.item, not negated)
+    else:
+        for item in tree.items:
+            yield from leaves(item, negated)
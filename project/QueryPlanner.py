@@ -0,0 +1,101 @@
+import time
+from contextlib import contextmanager
+from QueryParser import Term, Phrase, And, Or, Not
+
+"""
+Cost-based planning of the phrase matching of a query, and the record of the plan that Retrieval.explain prints.
+
+The cost of an operation is the number of postings it reads, estimated before anything is evaluated: a term reads its
+posting lists, a phrase is looked up from its rarest word, in the body and in the title. The body counts are the
+document frequencies of the statistics tables (term_statistics), the title index has no statistics and its counts are
+the lengths of the title lists, which are loaded with the query words anyway (see Retrieval.load_query_index).
+Phrases are matched cheapest first, each only in the documents that matched every phrase before it, and a boolean
+query passes its matching documents down as the first restriction. Once no document is left, the remaining phrases
+are skipped and, for a boolean query, nothing is scored. The terms are scored in query order (a different order
+would change the floating-point sums of the scores), their cost is shown all the same.
+"""
+
+
+def term_cost(word_id, counts) -> int:
+    # `counts` map a word ID to its number of postings, one per index
+    return sum(count(word_id) for count in counts)
+
+
+def phrase_cost(phrase_word_ids, counts) -> int:
+    # a phrase is looked up from its rarest word in every index
+    return sum(min(count(word_id) for word_id in phrase_word_ids) for count in counts)
+
+
+def order_by_cost(operations: list, cost) -> list[tuple[int, int]]:
+    """
+    Returns (position, estimated cost) of the operations, cheapest first (ties keep the query order).
+    """
+    costs = [cost(operation) for operation in operations]
+    return sorted(enumerate(costs), key=lambda item: item[1])
+
+
+class PlanStep:
+    __slots__ = ("operation", "detail", "estimated_cost", "documents", "seconds", "note")
+
+    def __init__(self, operation: str, detail, estimated_cost: int, documents: int | None = None, note: str = ""):
+        self.operation = operation
+        # word ID, list of word IDs (phrase) or boolean query tree
+        self.detail = detail
+        self.estimated_cost = estimated_cost
+        # documents left after the step
+        self.documents = documents
+        self.seconds = 0.0
+        self.note = note
+
+
+class QueryPlan:
+    """
+    Steps of the evaluation of one query, in the order they ran, e.g.
+
+        with plan.step("phrase", phrase_word_ids, cost) as step:
+            ...
+            step.documents = len(matches)
+    """
+
+    def __init__(self):
+        self.steps = []
+
+    @contextmanager
+    def step(self, operation: str, detail, estimated_cost: int):
+        step = PlanStep(operation, detail, estimated_cost)
+        self.steps.append(step)
+        start_time = time.perf_counter()
+        try:
+            yield step
+        finally:
+            step.seconds = time.perf_counter() - start_time
+
+    def skip(self, operation: str, detail, estimated_cost: int, note: str) -> None:
+        self.steps.append(PlanStep(operation, detail, estimated_cost, 0, note))
+
+    def explain(self, word) -> str:
+        """
+        The plan as a table, `word` maps a word ID to its text.
+        """
+        lines = [f"{'#':>3}  {'operation':<9} {'est. cost':>10} {'docs':>8} {'ms':>8}  detail"]
+        for (number, step) in enumerate(self.steps, 1):
+            documents = "" if step.documents is None else step.documents
+            detail = describe(step.detail, word) + (f"  ({step.note})" if step.note else "")
+            lines.append(f"{number:>3}  {step.operation:<9} {step.estimated_cost:>10} {documents:>8} "
+                         f"{step.seconds * 1000:>8.2f}  {detail}")
+        return "\n".join(lines)
+
+
+def describe(detail, word) -> str:
+    if isinstance(detail, list):
+        return '"' + " ".join(describe(word_id, word) for word_id in detail) + '"'
+    if isinstance(detail, Term):
+        return ("title:" if detail.field else "") + describe(detail.text, word)
+    if isinstance(detail, Phrase):
+        return ("title:" if detail.field else "") + describe(list(detail.text), word)
+    if isinstance(detail, Not):
+        return "NOT " + describe(detail.item, word)
+    if isinstance(detail, (And, Or)):
+        operator = " AND " if isinstance(detail, And) else " OR "
+        return "(" + operator.join(describe(item, word) for item in detail.items) + ")"
+    return word(detail)
@@ -1,54 +1,179 @@
 # FILE: Retrieval.py
-import sqlite3
 import math
 import re
+import logging
+import threading
 from collections import defaultdict
+from functools import cached_property
+from Metrics import REGISTRY, StageTimer
+from Scoring import CollectionStatistics, get_scoring
+from Statistics import load_statistics
+from ConnectionManager import get_reader
 from StopwordRemovalStem import StopwordRemovalStem
+from PostingList import IN_CHUNK_SIZE, PostingCache, PostingStore, decode_posting_list
+from DocumentStore import TokenStore
+from QueryParser import OPERATORS, Term, Phrase, Not, QuerySyntaxError, has_operators, parse_query, leaves
+from KGramIndex import load_kgram_index
+from BooleanQuery import BooleanEvaluator, restricted_postings
+from QueryPlanner import QueryPlan, order_by_cost, phrase_cost, term_cost
+from Snippets import get_snippet
+from SimilarPages import SimilarPages
+from LinkGraph import open_link_graph, resolve_doc_ids, resolve_urls
+from Snapshot import load_vocabulary
+from SegmentedIndex import has_segments, load_segmented_index
+from ShardedIndex import load_shard_paths, get_shard_pool, shard_term_statistics, merge_term_statistics, shard_top_documents
+
+logger = logging.getLogger("Retrieval")
+# queries slower than the threshold are logged here with their stage breakdown
+slow_query_logger = logging.getLogger("Retrieval.slow_queries")
+
+# indexed words a misspelt query term is expanded to with fuzzy=True
+FUZZY_EXPANSIONS = 3
+
+# guards the creation of the posting cache of a database version
+_posting_cache_lock = threading.Lock()
+
+
+def index_word_ids(query_word_ids, phrase_word_ids_list, query_tree) -> set:
+    # the word IDs whose posting lists a query reads: its scored words, its phrases and the negated words of its tree
+    word_ids = set(query_word_ids)
+    for phrase_word_ids in phrase_word_ids_list:
+        word_ids.update(phrase_word_ids)
+    for (leaf, _) in leaves(query_tree):
+        word_ids.update(leaf.text if isinstance(leaf, Phrase) else (leaf.text,))
+    word_ids.discard(None)
+    return word_ids
 
 
 class Retrieval:
-    def __init__(self, db_path):
-        self.conn = sqlite3.connect(db_path)
+    def __init__(self, db_path, link_score="pageRank", link_score_weight=2.0, slow_query_seconds=None, scoring="tfidf",
+                 fuzzy=False):
+        # read-only connection of this thread to the published generation of the database, reused by every Retrieval
+        # the thread creates (see ConnectionManager.py); a Retrieval keeps reading the generation it started with
+        self.conn = get_reader(db_path)
         self.cursor = self.conn.cursor()
         self.stop_stem = StopwordRemovalStem()
+        self.posting_store = PostingStore()
+
+        # if the Indexer partitioned the postings into shards, queries fan out to them
+        self.shard_paths = load_shard_paths(self.cursor, db_path)
+
+        # if the Indexer writes log-structured segments, the postings are read from the live segments
+        self.segmented = has_segments(self.cursor)
+
+        # offline link analysis scores (see LinkAnalysis.py), blended into the ranking if they were computed;
+        # they are loaded on first use (link_scores)
+        self.link_score = link_score
+        self.link_score_weight = link_score_weight
+
+        # weighting of the body postings, see Scoring.py
+        self.scoring_name = scoring
+        self.scoring = get_scoring(scoring)
+
+        # query terms that are not in the index are replaced by their closest indexed words (see KGramIndex.py)
+        self.fuzzy = fuzzy
+
+        # per-stage timings of the current query, see Metrics.py
+        self.slow_query_seconds = slow_query_seconds
+        self.timer = StageTimer("retrieval_stage_seconds")
+        # evaluation plan of the current query, see QueryPlanner.py
+        self.plan = QueryPlan()
+
+    @cached_property
+    def statistics(self):
+        # collection & term statistics written by the Indexer (see Statistics.py); segments are merged at query time,
+        # so their statistics are derived from the postings
+        if self.segmented:
+            return None
+        return load_statistics(self.conn)
+
+    @cached_property
+    def similar_pages_index(self):
+        # MinHash LSH over the forward index of the main database, or of every shard (see SimilarPages.py)
+        connections = [get_reader(path) for path in self.shard_paths] or [self.conn]
+        return SimilarPages(connections, self.segmented)
+
+    @cached_property
+    def link_graph(self):
+        # CSR parent/child links of the results page, if they were built (see LinkGraph.py)
+        return open_link_graph(self.conn)
+
+    @cached_property
+    def link_scores(self):
+        return self.load_link_scores()
+
+    def load_link_scores(self):
+        if self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='id_to_link_scores';").fetchone() is None:
+            return {}
+        rows = self.cursor.execute(f"SELECT urlId, {self.link_score} FROM id_to_link_scores WHERE {self.link_score} IS NOT NULL;").fetchall()
+        if not rows:
+            return {}
+        # scaled so that the best linked page gets the full weight
+        max_score = max(score for _, score in rows) or 1
+        return {url_id: self.link_score_weight * score / max_score for url_id, score in rows}
+
+    def load_posting_store(self):
+        # body and title postings share one store, with dense document IDs handed out in crawl order
+        store = PostingStore()
+        for (url_id,) in self.cursor.execute("SELECT urlId FROM forward_index ORDER BY rowid;").fetchall():
+            store.denseId(url_id)
+        return store
 
     def load_inverted_index(self):
+        if self.segmented:
+            self.posting_store = PostingStore()
+            return load_segmented_index(self.conn, "body", self.posting_store)
+
+        self.posting_store = self.load_posting_store()
         self.cursor.execute("SELECT * FROM body_inverted_index;")
         body_inverted_index = {}
         for word_id, value in self.cursor.fetchall():
-            postings = {}
-            for entry in value.split():
-                url_id, frequency, *positions = entry.split(";")
-                postings[url_id] = {
-                    "frequency": int(frequency),
-                    "positions": list(map(int, positions[0].split(",")))  # split positions by commas (?)
-                }
-            body_inverted_index[word_id] = postings
+            body_inverted_index[word_id] = decode_posting_list(value, self.posting_store)
         return body_inverted_index
 
+    def load_query_index(self, word_ids):
+        """
+        Returns the body and title indexes with (at least) the posting lists of `word_ids`. With statistics tables, only
+        those lists are decoded, once per process and database version; otherwise the whole index is loaded.
+        """
+        if self.statistics is None:
+            # live segments are merged on load, and the statistics of an older index are derived from all postings
+            return self.load_inverted_index(), self.load_title_index()
+        with _posting_cache_lock:
+            if self.statistics.postings is None:
+                self.statistics.postings = PostingCache(self.load_posting_store())
+        postings = self.statistics.postings
+        postings.load(self.cursor, word_ids)
+        self.posting_store = postings.store
+        return postings.body, postings.title
+
+    def document_word_ids(self, doc_ids):
+        """
+        The body word IDs of the documents in index order, with their posting lists loaded, or None if the whole index
+        is loaded anyway.
+        """
+        if self.statistics is None or not doc_ids:
+            return None
+        word_ids = set()
+        for start in range(0, len(doc_ids), IN_CHUNK_SIZE):
+            chunk = doc_ids[start:start + IN_CHUNK_SIZE]
+            for (value,) in self.cursor.execute(f"SELECT value FROM forward_index WHERE urlId IN ({','.join('?' * len(chunk))});",
+                                                chunk).fetchall():
+                word_ids.update(value.split(" "))
+        postings = self.statistics.postings
+        postings.load(self.cursor, word_ids)
+        return postings.in_index_order(word_ids)
+
     def load_title_index(self):
+        if self.segmented:
+            return load_segmented_index(self.conn, "title", self.posting_store)
+
         self.cursor.execute("SELECT * FROM title_inverted_index;")
         title_inverted_index = {}
         for word_id, value in self.cursor.fetchall():
-            postings = {}
-            for entry in value.split():
-                url_id, frequency, *positions = entry.split(";")
-                postings[url_id] = {
-                    "frequency": int(frequency),
-                    "positions": list(map(int, positions[0].split(","))) 
-                }
-            title_inverted_index[word_id] = postings
+            title_inverted_index[word_id] = decode_posting_list(value, self.posting_store)
         return title_inverted_index
 
-    def calculate_tfxidf(self, term_frequency, max_tf, doc_count, total_docs):
-        # skip terms where doc_count is 0 to avoid division by zero (according to TA answer)
-        if doc_count == 0:
-            return 0
-        
-        tf = term_frequency / max_tf
-        idf = math.log2(total_docs / doc_count)  # Removed the +1
-        return tf * idf
-
     def cosine_similarity(self, query_vector, doc_vector):
         dot_product = sum(query_vector[term] * doc_vector.get(term, 0) for term in query_vector)
         query_magnitude = math.sqrt(sum(weight ** 2 for weight in query_vector.values()))
@@ -68,9 +193,10 @@ class Retrieval:
                 tokens.append(match.group(0))
         return tokens
 
-    def phrase_in_postings(self, phrase_word_ids, inverted_index):
+    def phrase_in_postings(self, phrase_word_ids, inverted_index, candidates=None):
         """
         Returns a set of doc_ids where the phrase (list of word_ids) appears consecutively.
+        With `candidates` (a set of doc_ids), only those documents are checked.
         """
         if not phrase_word_ids:
             return set()
@@ -78,54 +204,168 @@ class Retrieval:
         postings_lists = []
         for wid in phrase_word_ids:
             postings = inverted_index.get(wid, {})
+            if not postings:
+                return set()
             postings_lists.append(postings)
-        # find common doc_ids
-        common_doc_ids = set(postings_lists[0].keys())
-        for postings in postings_lists[1:]:
-            common_doc_ids &= set(postings.keys())
+        # the documents of the rarest word (or the candidates, if there are fewer) are looked up in the other lists
+        rarest = min(postings_lists, key=len)
+        if candidates is None:
+            doc_ids = rarest
+        elif len(candidates) < len(rarest):
+            doc_ids = [doc_id for doc_id in candidates if doc_id in rarest]
+        else:
+            doc_ids = [doc_id for doc_id in rarest if doc_id in candidates]
+        others = [postings for postings in postings_lists if postings is not rarest]
         result_docs = set()
-        for doc_id in common_doc_ids:
+        for doc_id in doc_ids:
+            if not all(doc_id in postings for postings in others):
+                continue
             # get positions for each word in this doc
             positions_lists = [postings[doc_id]["positions"] for postings in postings_lists]
-            # for the first word, check if there is a sequence of positions for the phrase
-            first_positions = positions_lists[0]
-            for pos in first_positions:
-                match = True
-                for offset in range(1, len(positions_lists)):
-                    if (pos + offset) not in positions_lists[offset]:
-                        match = False
-                        break
-                if match:
+            # the sequence is anchored at the word with the fewest positions, the others are looked up in sets
+            anchor = min(range(len(positions_lists)), key=lambda offset: len(positions_lists[offset]))
+            shifted = [(offset - anchor, set(positions)) for offset, positions in enumerate(positions_lists) if offset != anchor]
+            for pos in positions_lists[anchor]:
+                if all(pos + shift in positions for shift, positions in shifted):
                     result_docs.add(doc_id)
                     break
         return result_docs
 
-    def retrieve(self, query, max_results=50):
-        if not query.strip():
-            print("The query is empty. Please provide a valid query.")
-            return []
-        print(f"Raw query: '{query}'")
-
-        body_inverted_index = self.load_inverted_index()
-        title_inverted_index = self.load_title_index()
-
-        query_terms = self.parse_query_with_phrases(query)
-        print(f"Query terms (with phrases): {query_terms}")
-
-        # stem and remove stopwords from query terms
-        processed_query_terms = []
-        for term in query_terms:
-            if " " in term:  # phrase
-                words = term.split()
-                processed_words = self.stop_stem.transform(words)
-                if processed_words:
-                    processed_query_terms.append(" ".join(processed_words))
+    def process_query(self, query):
+        """
+        Parses, stems and maps the query to word IDs.
+        Returns (query_word_ids, phrase_word_ids_list).
+        """
+        with self.timer.span("parse"):
+            query_terms = self.parse_query_with_phrases(query)
+            logger.debug("Query terms (with phrases): %s", query_terms)
+
+            # stem and remove stopwords from query terms
+            processed_query_terms = []
+            for term in query_terms:
+                if " " in term:  # phrase
+                    words = term.split()
+                    processed_words = self.stop_stem.transform(words)
+                    if processed_words:
+                        processed_query_terms.append(" ".join(processed_words))
+                else:
+                    processed = self.stop_stem.transform([term])
+                    if processed:
+                        processed_query_terms.append(processed[0])
+            logger.debug("Processed query terms (with phrases): %s", processed_query_terms)
+
+        with self.timer.span("term_lookup"):
+            return self.lookup_word_ids(processed_query_terms)
+
+    def analyze_query(self, query):
+        """
+        Returns (query_word_ids, phrase_word_ids_list, query_tree). The tree is None for a plain query (no AND/OR/NOT,
+        parentheses or title:), which is scored over every matching document like before.
+        """
+        if has_operators(query):
+            try:
+                return self.process_boolean_query(query)
+            except QuerySyntaxError as e:
+                logger.info("Query '%s' is not a valid boolean query (%s), it is treated as plain words", query, e)
+        return (*self.process_query(query), None)
+
+    def process_boolean_query(self, query):
+        # the words that are not negated are scored, the tree restricts which documents may match (see QueryParser.py)
+        with self.timer.span("parse"):
+            query_tree = parse_query(query)
+        with self.timer.span("term_lookup"):
+            query_tree = self.resolve_query_tree(query_tree)
+
+        query_word_ids = {}
+        phrase_word_ids_list = []
+        for (leaf, negated) in leaves(query_tree):
+            if negated:
+                continue
+            if isinstance(leaf, Phrase):
+                phrase_word_ids_list.append(list(leaf.text))
+                query_word_ids.update(dict.fromkeys(leaf.text))
             else:
-                processed = self.stop_stem.transform([term])
-                if processed:
-                    processed_query_terms.append(processed[0])
-        print(f"Processed query terms (with phrases): {processed_query_terms}")
+                query_word_ids[leaf.text] = None
+        query_word_ids.pop(None, None)
+        return list(query_word_ids), [word_ids for word_ids in phrase_word_ids_list if None not in word_ids], query_tree
 
+    def resolve_query_tree(self, tree):
+        """
+        Stems the words of the tree and maps them to word IDs (None if the word is not in the index).
+        Stopwords are dropped, so are the operators left without operands.
+        """
+        if tree is None:
+            return None
+        if isinstance(tree, (Term, Phrase)):
+            words = self.stop_stem.transform(re.findall(r"\b\w+\b", tree.text))
+            if not words:
+                return None
+            word_ids = tuple(self.lookup_word_id(word) for word in words)
+            return Term(word_ids[0], tree.field) if len(word_ids) == 1 else Phrase(word_ids, tree.field)
+        if isinstance(tree, Not):
+            item = self.resolve_query_tree(tree.item)
+            return Not(item) if item is not None else None
+        items = [item for item in map(self.resolve_query_tree, tree.items) if item is not None]
+        if not items:
+            return None
+        return items[0] if len(items) == 1 else type(tree)(tuple(items))
+
+    def lookup_word_id(self, word):
+        row = self.cursor.execute("SELECT wordId FROM word_to_id WHERE word = ?", (word,)).fetchone()
+        if row:
+            return row[0]
+        if self.fuzzy:
+            corrections = self.corrections(word, 1)
+            if corrections:
+                return corrections[0][1]
+        return None
+
+    def corrections(self, word, limit=FUZZY_EXPANSIONS):
+        """
+        Returns [(word, word_id)] of the indexed words closest to a stemmed word that is not in the index, the ones
+        in the most documents first.
+        """
+        _, words = load_kgram_index(self.conn).closest(word)
+        if not words:
+            return []
+        word_ids = dict(self.cursor.execute(f"SELECT word, wordId FROM word_to_id WHERE word IN ({','.join('?' * len(words))})",
+                                            words).fetchall())
+        document_frequencies = {}
+        if self.statistics is not None and len(words) > 1:
+            document_frequencies = {word_id: term.document_frequency
+                                    for word_id, term in self.statistics.term_statistics(self.cursor, word_ids.values()).items()}
+        words.sort(key=lambda w: -document_frequencies.get(word_ids.get(w), 0))
+        return [(w, word_ids[w]) for w in words if w in word_ids][:limit]
+
+    def did_you_mean(self, query):
+        """
+        Returns the query with every word that is not in the index replaced by the closest indexed word, as it
+        appears in the pages (not its stem), or None if there is nothing to correct.
+        """
+        corrected = False
+        tokens = TokenStore(self.conn)
+
+        def correct(match):
+            nonlocal corrected
+            word = match.group(0)
+            stems = self.stop_stem.transform([word.lower()]) if word not in OPERATORS else []
+            if not stems or self.cursor.execute("SELECT 1 FROM word_to_id WHERE word = ?", (stems[0],)).fetchone():
+                return word
+            corrections = self.corrections(stems[0], 1)
+            if not corrections:
+                return word
+            # a stem without a known surface form (e.g. a title-only word) is not suggested
+            surface = tokens.surface_forms([corrections[0][0]]).get(corrections[0][0])
+            if surface is None:
+                return word
+            corrected = True
+            return surface
+
+        # "title:" is kept as it is
+        suggestion = re.sub(r"\b\w+\b(?!:)", correct, query)
+        return suggestion if corrected else None
+
+    def lookup_word_ids(self, processed_query_terms):
         # map query terms to word IDs based on database schema
         query_word_ids = []
         phrase_word_ids_list = []
@@ -135,10 +375,9 @@ class Retrieval:
                 words = term.split()
                 word_ids = []
                 for w in words:
-                    self.cursor.execute("SELECT wordId FROM word_to_id WHERE word = ?", (w,))
-                    row = self.cursor.fetchone()
-                    if row:
-                        word_ids.append(row[0])
+                    word_id = self.lookup_word_id(w)
+                    if word_id:
+                        word_ids.append(word_id)
                         # ad each word in phrase as a single term if not already present
                         if w not in single_terms_set:
                             single_terms_set.add(w)
@@ -151,72 +390,380 @@ class Retrieval:
         for term in single_terms_set:
             self.cursor.execute("SELECT wordId FROM word_to_id WHERE word = ?", (term,))
             row = self.cursor.fetchone()
-            print(f"Term: {term}, Word ID: {row}")
+            logger.debug("Term: %s, Word ID: %s", term, row)
             if row:
                 query_word_ids.append(row[0])  # add the wordId to the list if term exists in the database
+            elif self.fuzzy:
+                # a misspelt term is expanded to its closest indexed words
+                query_word_ids += [word_id for (_, word_id) in self.corrections(term)]
 
+        return query_word_ids, phrase_word_ids_list
+
+    def build_query_vector(self, query_word_ids, indexed_word_ids):
         # build query vector for single terms
         query_vector = defaultdict(float)
         for word_id in query_word_ids:
-            if word_id in body_inverted_index:
+            if word_id in indexed_word_ids:
                 query_vector[word_id] += 1
 
-        # phrase search: get doc_ids that match all phrases in body or title
-        phrase_doc_sets = []
-        for phrase_word_ids in phrase_word_ids_list:
-            body_docs = self.phrase_in_postings(phrase_word_ids, body_inverted_index)
-            title_docs = self.phrase_in_postings(phrase_word_ids, title_inverted_index)
-            phrase_doc_sets.append(body_docs | title_docs)
-        # If there are phrase queries, only keep docs that match all phrases
-        if phrase_doc_sets:
-            docs_with_phrases = set.intersection(*phrase_doc_sets) if phrase_doc_sets else set()
-        else:
-            docs_with_phrases = None  # no phrase constraint
-
-        # check if query_vector is empty and no phrase matches
-        if not query_vector and not phrase_doc_sets:
-            print("No matching terms found in the index for the given query.")
-            return []
-
         # normalize query vector based on max tf
         if query_vector:
             max_tf_query = max(query_vector.values())
             for word_id in query_vector:
                 query_vector[word_id] /= max_tf_query
+        return query_vector
 
-        # calculate document scores
-        doc_scores = defaultdict(float)
-        total_docs = len(body_inverted_index)
-
-        for word_id, query_weight in query_vector.items():
-            if word_id in body_inverted_index:
-                postings = body_inverted_index[word_id]
-                doc_count = len(postings)
-                for doc_id, data in postings.items():
-                    tfidf = self.calculate_tfxidf(data["frequency"], max(data["frequency"] for data in postings.values()), doc_count, total_docs)
-                    doc_scores[doc_id] += query_weight * tfidf
-            if word_id in title_inverted_index:
-                title_postings = title_inverted_index[word_id]
-                # boost score if word is in title
-                for doc_id in title_postings:
-                    doc_scores[doc_id] += 7 
-
+    def term_statistics(self, word_ids, body_inverted_index):
+        """
+        Returns {word_id: (doc_count, max_tf)} for the given word IDs that occur in the body index.
+        """
+        if self.statistics is not None:
+            return {word_id: (term.document_frequency, term.max_term_frequency)
+                    for word_id, term in self.statistics.term_statistics(self.cursor, word_ids).items()}
+
+        # no statistics tables: one pass over the frequencies of every posting list
+        statistics = {}
+        for word_id in word_ids:
+            postings = body_inverted_index.get(word_id)
+            if postings:
+                statistics[word_id] = (len(postings), max(postings.frequencies))
+        return statistics
+
+    def document_lengths(self, body_inverted_index):
+        # {doc_id: number of body words}
+        if self.statistics is not None:
+            return self.statistics.document_lengths(self.cursor)
+
+        document_lengths = defaultdict(int)
+        for postings in body_inverted_index.values():
+            for doc_id, frequency in zip(postings, postings.frequencies):
+                document_lengths[doc_id] += frequency
+        return document_lengths
+
+    def collection_statistics(self, body_inverted_index):
+        if self.statistics is not None:
+            return CollectionStatistics(self.statistics.document_count, self.statistics.average_length)
+
+        document_lengths = self.document_lengths(body_inverted_index)
+        document_count = len(document_lengths)
+        return CollectionStatistics(document_count, sum(document_lengths.values()) / document_count if document_count else 0)
+
+    def score_documents(self, query_vector, phrase_word_ids_list, body_inverted_index, title_inverted_index,
+                        term_statistics, collection, query_tree=None):
+        """
+        Scores every document in the given indexes against the query.
+        `term_statistics` and `collection` are passed in so that a shard can be scored with global statistics.
+        With a boolean `query_tree`, only the documents matching the tree are scored (and all of them are returned).
+        The steps are recorded in self.plan (see QueryPlanner.py).
+        """
+        self.plan = QueryPlan()
+        candidates = None
+        candidate_url_ids = None
+        if query_tree is not None:
+            with self.timer.span("boolean_match"):
+                candidates = BooleanEvaluator(body_inverted_index, title_inverted_index, self.posting_store,
+                                              self.phrase_in_postings, self.plan).evaluate(query_tree)
+            if not candidates:
+                # nothing can match, nothing is scored
+                return defaultdict(float)
+            url_ids = self.posting_store.url_ids
+            candidate_url_ids = {url_ids[dense_id] for dense_id in candidates}
+
+        # the body costs are the document frequencies of the statistics, without reading the postings
+        counts = (lambda word_id: term_statistics[word_id][0] if word_id in term_statistics else 0,
+                  lambda word_id: len(title_inverted_index.get(word_id, ())))
+        phrase_matches = self.match_phrases(phrase_word_ids_list, body_inverted_index, title_inverted_index,
+                                            candidate_url_ids, counts)
+
+        with self.timer.span("scoring"):
+            # calculate document scores
+            doc_scores = defaultdict(float)
+            document_lengths = self.document_lengths(body_inverted_index) if self.scoring.needs_document_lengths else {}
+            average_length = collection.average_length
+
+            for word_id, query_weight in query_vector.items():
+                with self.plan.step("term", word_id, term_cost(word_id, counts)) as step:
+                    if word_id in body_inverted_index:
+                        postings = body_inverted_index[word_id]
+                        doc_count, max_tf = term_statistics[word_id]
+                        # the IDF part of the weight is computed once per term
+                        term_weight = self.scoring.term_weight(doc_count, max_tf, collection)
+                        # a boolean query only looks up the postings of its candidates
+                        rows = zip(postings, postings.frequencies) if candidates is None else restricted_postings(postings, candidates)
+                        for doc_id, frequency in rows:
+                            weight = term_weight(frequency, document_lengths.get(doc_id, average_length))
+                            doc_scores[doc_id] += query_weight * weight
+                    if word_id in title_inverted_index:
+                        title_postings = title_inverted_index[word_id]
+                        if candidates is not None:
+                            title_postings = [doc_id for doc_id, _ in restricted_postings(title_postings, candidates)]
+                        # boost score if word is in title
+                        for doc_id in title_postings:
+                            doc_scores[doc_id] += 7 
+                    step.documents = len(doc_scores)
+
+            self.boost_phrases(doc_scores, phrase_matches)
+            if candidates is not None:
+                # every matching document is a result, also those without a scored word (e.g. "NOT word")
+                url_ids = self.posting_store.url_ids
+                doc_scores = defaultdict(float, {url_ids[dense_id]: doc_scores.get(url_ids[dense_id], 0.0) for dense_id in candidates})
+            self.add_link_scores(doc_scores)
+
+        return doc_scores
+
+    def match_phrases(self, phrase_word_ids_list, body_inverted_index, title_inverted_index, candidates=None, counts=None):
+        """
+        Returns (body docs of every phrase, title docs of every phrase, docs that match all phrases in body or title),
+        or None if the query has no phrases.
+        The phrases are matched cheapest first, each only in the documents (`candidates` to begin with) that matched
+        all phrases before it; once none is left, the other phrases are not matched (their doc sets stay empty).
+        `counts` estimate the postings of a word in the body and title index (see QueryPlanner.py), by default the
+        lengths of the posting lists.
+        """
+        if not phrase_word_ids_list:
+            return None  # no phrase constraint
+
+        if counts is None:
+            counts = [lambda word_id, index=index: len(index.get(word_id, ())) for index in (body_inverted_index, title_inverted_index)]
+        phrase_body_docs = [set() for _ in phrase_word_ids_list]
+        phrase_title_docs = [set() for _ in phrase_word_ids_list]
+        docs_with_phrases = candidates
+        for position, cost in order_by_cost(phrase_word_ids_list, lambda phrase_word_ids: phrase_cost(phrase_word_ids, counts)):
+            phrase_word_ids = phrase_word_ids_list[position]
+            if docs_with_phrases is not None and not docs_with_phrases:
+                self.plan.skip("phrase", phrase_word_ids, cost, "no documents left")
+                continue
+            with self.timer.span("phrase_match"), self.plan.step("phrase", phrase_word_ids, cost) as step:
+                body_docs = self.phrase_in_postings(phrase_word_ids, body_inverted_index, docs_with_phrases)
+                title_docs = self.phrase_in_postings(phrase_word_ids, title_inverted_index, docs_with_phrases)
+                # only keep docs that match all phrases
+                docs_with_phrases = body_docs | title_docs if docs_with_phrases is None else docs_with_phrases & (body_docs | title_docs)
+                step.documents = len(docs_with_phrases)
+            phrase_body_docs[position] = body_docs
+            phrase_title_docs[position] = title_docs
+        return phrase_body_docs, phrase_title_docs, docs_with_phrases
+
+    def boost_phrases(self, doc_scores, phrase_matches):
         # for phrase matches, boost their score, with extra boost if phrase is in title
-        if phrase_doc_sets:
-            for idx, phrase_word_ids in enumerate(phrase_word_ids_list):
-                body_docs = self.phrase_in_postings(phrase_word_ids, body_inverted_index)
-                title_docs = self.phrase_in_postings(phrase_word_ids, title_inverted_index)
-                for doc_id in docs_with_phrases:
-                    if doc_id in title_docs:
-                        doc_scores[doc_id] += 10  # higher boost for phrase in title
-                    elif doc_id in body_docs:
-                        doc_scores[doc_id] += 3  # normal boost for phrase in body
+        if phrase_matches is None:
+            return
+        phrase_body_docs, phrase_title_docs, docs_with_phrases = phrase_matches
+        for body_docs, title_docs in zip(phrase_body_docs, phrase_title_docs):
+            for doc_id in docs_with_phrases:
+                if doc_id in title_docs:
+                    doc_scores[doc_id] += 10  # higher boost for phrase in title
+                elif doc_id in body_docs:
+                    doc_scores[doc_id] += 3  # normal boost for phrase in body
+
+    def add_link_scores(self, doc_scores):
+        # blend in the precomputed link analysis score of every matching document
+        for doc_id in doc_scores:
+            doc_scores[doc_id] += self.link_scores.get(doc_id, 0)
+
+    def collect_doc_word_frequencies(self, doc_ids, body_inverted_index, word_ids=None):
+        """
+        Returns {doc_id: {word_id: frequency}} for the given documents, in a single pass over the index
+        (or over the posting lists of `word_ids`, the words of the documents).
+        """
+        doc_word_frequencies = {doc_id: {} for doc_id in doc_ids}
+        word_postings = body_inverted_index.items() if word_ids is None else ((word_id, body_inverted_index[word_id]) for word_id in word_ids)
+        for word_id, postings in word_postings:
+            for doc_id, word_frequencies in doc_word_frequencies.items():
+                if doc_id in postings:
+                    word_frequencies[word_id] = postings[doc_id]["frequency"]
+        return doc_word_frequencies
+
+    def collect_query_positions(self, doc_ids, word_ids, body_inverted_index):
+        """
+        Returns {doc_id: {word_id: body positions}} of the query terms in the given documents, for their snippets.
+        """
+        doc_positions = {doc_id: {} for doc_id in doc_ids}
+        for word_id in word_ids:
+            postings = body_inverted_index.get(word_id)
+            if not postings:
+                continue
+            for doc_id, positions in doc_positions.items():
+                if doc_id in postings:
+                    positions[word_id] = postings[doc_id]["positions"]
+        return doc_positions
+
+    def retrieve(self, query, max_results=50):
+        if not query.strip():
+            logger.info("The query is empty. Please provide a valid query.")
+            return []
+        logger.debug("Raw query: '%s'", query)
+
+        self.timer = StageTimer("retrieval_stage_seconds")
+        self.plan = QueryPlan()
+        if self.shard_paths:
+            results = self.retrieve_from_shards(query, max_results)
+        else:
+            results = self.retrieve_from_index(query, max_results)
+        self.record_query(query, len(results))
+        return results
+
+    def explain(self, query, max_results=50):
+        """
+        Runs the query and returns its plan: the operations in the order they ran, with their estimated cost (postings
+        read), the documents left after them and their time. For a sharded index, the shards plan their part
+        themselves and only the coordinator's stages are shown.
+        """
+        results = self.retrieve(query, max_results)
+        words = {}
+
+        def word(word_id):
+            if word_id is None:
+                return "(not indexed)"
+            if word_id not in words:
+                row = self.cursor.execute("SELECT word FROM id_to_word WHERE wordId = ?", (word_id,)).fetchone()
+                words[word_id] = row[0] if row else str(word_id)
+            return words[word_id]
+
+        lines = [f"Query '{query}': {len(results)} results in {self.timer.elapsed() * 1000:.1f}ms ({self.timer.breakdown()})"]
+        if self.plan.steps:
+            lines.append(self.plan.explain(word))
+        return "\n".join(lines)
+
+    def record_query(self, query, result_count):
+        elapsed = self.timer.elapsed()
+        REGISTRY.increment("retrieval_queries_total")
+        REGISTRY.observe("retrieval_query_seconds", elapsed)
+        logger.debug("Query '%s': %d results in %.1fms (%s)", query, result_count, elapsed * 1000, self.timer.breakdown())
+
+        if self.slow_query_seconds is not None and elapsed >= self.slow_query_seconds:
+            REGISTRY.increment("retrieval_slow_queries_total")
+            slow_query_logger.warning("Slow query '%s': %.1fms (%s)", query, elapsed * 1000, self.timer.breakdown())
+
+    def retrieve_from_index(self, query, max_results=50):
+        query_word_ids, phrase_word_ids_list, query_tree = self.analyze_query(query)
+        with self.timer.span("load_index"):
+            body_inverted_index, title_inverted_index = self.load_query_index(
+                index_word_ids(query_word_ids, phrase_word_ids_list, query_tree))
+
+        # document frequencies and max tf come from the statistics tables, without touching the postings
+        term_statistics = self.term_statistics(set(query_word_ids), body_inverted_index)
+        query_vector = self.build_query_vector(query_word_ids, term_statistics)
+
+        # check if query_vector is empty and no phrase matches
+        if not query_vector and not phrase_word_ids_list and query_tree is None:
+            logger.info("No matching terms found in the index for the given query.")
+            return []
+
+        collection = self.collection_statistics(body_inverted_index)
+        doc_scores = self.score_documents(query_vector, phrase_word_ids_list, body_inverted_index,
+                                          title_inverted_index, term_statistics, collection, query_tree)
 
         # finally rank documents by score
-        ranked_docs = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)[:max_results]
+        with self.timer.span("ranking"):
+            ranked_docs = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)[:max_results]
+
+            doc_ids = [doc_id for doc_id, _ in ranked_docs]
+            # the keywords of the results read the posting lists of all their words
+            doc_word_frequencies = self.collect_doc_word_frequencies(doc_ids, body_inverted_index, self.document_word_ids(doc_ids))
+            doc_positions = self.collect_query_positions(doc_ids, query_vector, body_inverted_index)
+        with self.timer.span("hydrate"):
+            return self.fetch_results(ranked_docs, doc_word_frequencies, doc_positions)
+
+    def retrieve_from_shards(self, query, max_results=50):
+        # the vocabulary lives in the main database, the postings live in the shards
+        query_word_ids, phrase_word_ids_list, query_tree = self.analyze_query(query)
+        pool = get_shard_pool(len(self.shard_paths))
+
+        # scatter: collect the local statistics of every shard and merge them into global IDF statistics
+        with self.timer.span("shard_statistics"):
+            futures = [pool.submit(shard_term_statistics, path, query_word_ids) for path in self.shard_paths]
+            term_statistics, collection = merge_term_statistics([future.result() for future in futures])
+
+        query_vector = self.build_query_vector(query_word_ids, term_statistics)
+
+        # check if query_vector is empty and no phrase matches
+        if not query_vector and not phrase_word_ids_list and query_tree is None:
+            logger.info("No matching terms found in the index for the given query.")
+            return []
+
+        # gather: every shard scores its own documents with the global statistics and returns its local top-k
+        with self.timer.span("shard_scoring"):
+            futures = [pool.submit(shard_top_documents, path, dict(query_vector), phrase_word_ids_list,
+                                   term_statistics, collection, self.scoring_name, max_results, query_tree)
+                       for path in self.shard_paths]
+            ranked_docs = []
+            doc_word_frequencies = {}
+            doc_positions = {}
+            for future in futures:
+                shard_ranked_docs, shard_doc_word_frequencies, shard_doc_positions, shard_stages = future.result()
+                # the stages the shards ran in their processes, summed over the shards
+                for (stage, seconds) in shard_stages.items():
+                    self.timer.record(f"shard:{stage}", seconds)
+                ranked_docs += shard_ranked_docs
+                doc_word_frequencies.update(shard_doc_word_frequencies)
+                doc_positions.update(shard_doc_positions)
+
+        # combine the local top-k lists into the global top-k
+        with self.timer.span("ranking"):
+            ranked_docs = sorted(ranked_docs, key=lambda x: x[1], reverse=True)[:max_results]
+
+        with self.timer.span("hydrate"):
+            return self.fetch_results(ranked_docs, doc_word_frequencies, doc_positions)
+
+    def similar_pages(self, url_id, max_results=10):
+        """
+        Results for the pages most similar to the page `url_id` (LSH candidates re-ranked by TF-IDF cosine),
+        without the page itself.
+        """
+        self.timer = StageTimer("retrieval_stage_seconds")
+        with self.timer.span("similar_pages"):
+            ranked_docs = self.similar_pages_index.similar(url_id, max_results)
+        with self.timer.span("hydrate"):
+            results = self.fetch_results(ranked_docs, {})
+        self.record_query(f"similar:{url_id}", len(results))
+        return results
+
+    def fetch_links(self, url_ids, max_links=10):
+        """
+        {urlId: (parent URLs, child URLs)} of the documents: from the stored link graph, one slice per document and
+        one batched URL lookup for the whole page (see LinkGraph.py), or from the link tables if it was not built.
+        """
+        links = {}
+        if self.link_graph is not None:
+            doc_ids = resolve_doc_ids(self.cursor, url_ids)
+            neighbors = {url_id: (self.link_graph.parent_ids(doc_id)[:max_links].tolist(),
+                                  self.link_graph.child_ids(doc_id)[:max_links].tolist())
+                         for (url_id, doc_id) in doc_ids.items()}
+            urls = resolve_urls(self.cursor, list({node for pair in neighbors.values() for ids in pair for node in ids}))
+            for (url_id, (parent_ids, child_ids)) in neighbors.items():
+                links[url_id] = ([urls.get(node) or "This page has no parent link." for node in parent_ids],
+                                 [urls.get(node) or "This page has no child link." for node in child_ids])
+            return links
+
+        for url_id in url_ids:
+            # get the parent links
+            self.cursor.execute("SELECT parentsUrlId FROM id_to_parents_url_id WHERE urlId = ?", (url_id,))
+            parents_row = self.cursor.fetchone()
+            parent_links = []
+            if parents_row:
+                parent_ids = parents_row[0].split()[:max_links]
+                for parent_id in parent_ids:
+                    self.cursor.execute("SELECT url FROM id_to_url WHERE urlId = ?", (parent_id,))
+                    parent_url_row = self.cursor.fetchone()
+                    parent_links.append(parent_url_row[0] if parent_url_row else "This page has no parent link.")
 
+            # get the child links
+            self.cursor.execute("SELECT childrenUrlId FROM id_to_children_url_id WHERE urlId = ?", (url_id,))
+            children_row = self.cursor.fetchone()
+            child_links = []
+            if children_row:
+                child_ids = children_row[0].split()[:max_links]
+                for child_id in child_ids:
+                    self.cursor.execute("SELECT url FROM id_to_url WHERE urlId = ?", (child_id,))
+                    child_url_row = self.cursor.fetchone()
+                    child_links.append(child_url_row[0] if child_url_row else "This page has no child link.")
+            links[url_id] = (parent_links, child_links)
+        return links
+
+    def fetch_results(self, ranked_docs, doc_word_frequencies, doc_positions=None):
         # fetch metadata of ranked documents to display
         results = []
+        links = self.fetch_links([doc_id for doc_id, _ in ranked_docs])
         for doc_id, score in ranked_docs:
 
             # get the page title
@@ -245,16 +792,14 @@ class Retrieval:
 
             # get the keyword frequency pairs (get the top 5 most frequent stemmed keywords)
             frequency_dict = {}
-            # iterate over all word IDs in the body_inverted_index
-            for word_id, postings in body_inverted_index.items():
-                if doc_id in postings:
-                    freq = postings[doc_id]["frequency"]
-                    self.cursor.execute("SELECT word FROM id_to_word WHERE wordId = ?", (word_id,))
-                    word_row = self.cursor.fetchone()
-                    word = word_row[0] if word_row else "N/A"
-                    # only consider words - alphabetic (filter out numbers)
-                    if word and word != "N/A" and word.isalpha():
-                        frequency_dict[word] = freq
+            # iterate over all word IDs of this document
+            for word_id, freq in doc_word_frequencies.get(doc_id, {}).items():
+                self.cursor.execute("SELECT word FROM id_to_word WHERE wordId = ?", (word_id,))
+                word_row = self.cursor.fetchone()
+                word = word_row[0] if word_row else "N/A"
+                # only consider words - alphabetic (filter out numbers)
+                if word and word != "N/A" and word.isalpha():
+                    frequency_dict[word] = freq
 
             # sort the dictionary by frequency and get the top 5
             top_keywords = sorted(frequency_dict.items(), key=lambda item: item[1], reverse=True)[:5]
@@ -263,28 +808,11 @@ class Retrieval:
             keywords_frequencies = [f"{word} {freq}" for word, freq in top_keywords]
             top5FrequentKeywords = " ".join([word for word, _ in top_keywords if word])
 
-            # get the parent links
-            self.cursor.execute("SELECT parentsUrlId FROM id_to_parents_url_id WHERE urlId = ?", (doc_id,))
-            parents_row = self.cursor.fetchone()
-            parent_links = []
-            if parents_row:
-                parent_ids = parents_row[0].split()[:10]
-                for parent_id in parent_ids:
-                    self.cursor.execute("SELECT url FROM id_to_url WHERE urlId = ?", (parent_id,))
-                    parent_url_row = self.cursor.fetchone()
-                    parent_links.append(parent_url_row[0] if parent_url_row else "This page has no parent link.")
+            # get the parent and child links (at most 10 of each)
+            parent_links, child_links = links.get(doc_id, ([], []))
 
-            # get the child links
-            self.cursor.execute("SELECT childrenUrlId FROM id_to_children_url_id WHERE urlId = ?", (doc_id,))
-            children_row = self.cursor.fetchone()
-            child_links = []
-            if children_row:
-                child_ids = children_row[0].split()[:10]
-                for child_id in child_ids:
-                    self.cursor.execute("SELECT url FROM id_to_url WHERE urlId = ?", (child_id,))
-                    child_url_row = self.cursor.fetchone()
-                    child_links.append(child_url_row[0] if child_url_row else "This page has no child link.")
-            
+            # query-biased snippet from the stored body words, see Snippets.py
+            snippet = get_snippet(self.conn, doc_id, (doc_positions or {}).get(doc_id, {}))
 
             results.append({"doc_id": doc_id,
                             "score": score,
@@ -296,16 +824,15 @@ class Retrieval:
                             "parent_links": parent_links,
                             "child_links": child_links,
                             "top5FrequentKeywords": top5FrequentKeywords,
+                            "snippet": snippet,
                             })
 
         return results
     
     # For BONUS: allows user to query the stemmed words from database
     def get_all_keywords(self):
-        self.cursor.execute("SELECT word FROM word_to_id;")
-        rows = self.cursor.fetchall()
-
-        all_keywords = [row[0] for row in rows]
+        # the vocabulary comes from its binary snapshot when it is up to date
+        all_keywords = list(load_vocabulary(self.conn))
 
         return all_keywords
 
@@ -313,6 +840,7 @@ if __name__ == "__main__":
     retrieval = Retrieval("main.db")
     query = 'classification for "information retrieval"'
     results = retrieval.retrieve(query)
+    print(retrieval.explain(query))
 
     for result in results:
         print(f'Document ID: {result["doc_id"]}')
@@ -329,4 +857,5 @@ if __name__ == "__main__":
         for link in result["child_links"]:
             print(link)
         print(f'Top 5 Frequent Keywords: {result["top5FrequentKeywords"]}')
+        print(f'Snippet: {" ".join(text for text, _ in result["snippet"])}')
         print("\n")
\ No newline at end of file
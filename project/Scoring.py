@@ -0,0 +1,56 @@
+import math
+from collections import namedtuple
+
+"""
+Scoring functions of the body postings, selected with Retrieval(scoring=...).
+
+A scoring function turns the statistics of one query term into a weight function of (term frequency, document length),
+so everything that only depends on the term (IDF, max tf) is computed once per query term, not once per posting.
+"""
+
+# N and the average number of body words of a document
+CollectionStatistics = namedtuple("CollectionStatistics", ["document_count", "average_length"])
+
+
+class TfIdfScoring:
+    """
+    tf/max_tf * log2(N/df), the original weighting of the search engine.
+    """
+    needs_document_lengths = False
+
+    def term_weight(self, doc_count: int, max_tf: int, collection: CollectionStatistics):
+        # skip terms where doc_count is 0 to avoid division by zero (according to TA answer)
+        if doc_count == 0:
+            return lambda term_frequency, document_length: 0
+        idf = math.log2(collection.document_count / doc_count)
+        return lambda term_frequency, document_length: term_frequency / max_tf * idf
+
+
+class BM25Scoring:
+    """
+    Okapi BM25 with the non-negative IDF log(1 + (N - df + 0.5) / (df + 0.5)).
+    """
+    needs_document_lengths = True
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+    def term_weight(self, doc_count: int, max_tf: int, collection: CollectionStatistics):
+        idf = math.log(1 + (collection.document_count - doc_count + 0.5) / (doc_count + 0.5))
+        k1 = self.k1
+        # length normalization: k1 * (1 - b + b * dl / avgdl) = base + slope * dl
+        base = k1 * (1 - self.b)
+        slope = k1 * self.b / collection.average_length if collection.average_length else 0
+        return lambda term_frequency, document_length: \
+            idf * term_frequency * (k1 + 1) / (term_frequency + base + slope * document_length)
+
+
+SCORING_FUNCTIONS = {"tfidf": TfIdfScoring, "bm25": BM25Scoring}
+
+
+def get_scoring(name: str):
+    try:
+        return SCORING_FUNCTIONS[name]()
+    except KeyError:
+        raise ValueError(f"unknown scoring function '{name}', expected one of {', '.join(SCORING_FUNCTIONS)}") from None
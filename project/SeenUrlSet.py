@@ -0,0 +1,111 @@
+import sys
+import hashlib
+from array import array
+from bisect import bisect_left
+from heapq import merge
+
+"""
+Compact set of URLs for the crawler (visited and enqueued URLs). A set of URL strings costs more than 100 bytes per
+URL; this keeps a 64-bit hash of each URL instead, in sorted array('Q') runs of 8 bytes per URL.
+
+New hashes go to a small Python set first. When it is full, it is sorted into a run, and runs of similar size are
+merged (like the segments of SegmentedIndex), so there are O(log n) runs and every hash is merged O(log n) times.
+A lookup checks the recent set and binary searches each run. Two URLs share a hash with probability ~ n^2 / 2^65
+(about 3 in a million for 10 million URLs), in which case the second one is taken for already seen.
+
+An optional Bloom filter in front answers most lookups of new URLs without searching the runs, for about
+`bloom_bits_per_url` / 8 more bytes per URL. It is sized for `expected_urls`, and it is only worth it when most
+lookups are for URLs that were not seen yet.
+"""
+
+# hashes kept in the Python set before they are sorted into a run (~60 bytes each)
+RECENT_SIZE = 4096
+
+
+def url_hash(url: str) -> int:
+    return int.from_bytes(hashlib.blake2b(url.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "little")
+
+
+class BloomFilter:
+    def __init__(self, expected_items: int, bits_per_item: int = 10):
+        self.num_bits = max(64, expected_items * bits_per_item)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        # the number of hash functions minimizing the false positive rate: bits per item * ln 2
+        self.num_hashes = max(1, round(bits_per_item * 0.693))
+
+    def positions(self, item_hash: int):
+        # double hashing with the two halves of the 64-bit hash
+        first = item_hash & 0xFFFFFFFF
+        step = (item_hash >> 32) | 1
+        return [(first + i * step) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item_hash: int) -> None:
+        bits = self.bits
+        for position in self.positions(item_hash):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item_hash: int) -> bool:
+        bits = self.bits
+        for position in self.positions(item_hash):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class SeenUrlSet:
+    def __init__(self, urls=(), expected_urls: int = 0, bloom_bits_per_url: int = 0):
+        # sorted runs, largest (oldest) first
+        self.runs: list[array] = []
+        self.recent: set[int] = set()
+        self.size = 0
+        self.bloom = BloomFilter(expected_urls, bloom_bits_per_url) if expected_urls and bloom_bits_per_url else None
+        for url in urls:
+            self.add(url)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, url: str) -> bool:
+        return self.contains_hash(url_hash(url))
+
+    def contains_hash(self, key: int) -> bool:
+        if self.bloom is not None and key not in self.bloom:
+            return False
+        if key in self.recent:
+            return True
+        for run in self.runs:
+            position = bisect_left(run, key)
+            if position < len(run) and run[position] == key:
+                return True
+        return False
+
+    def add(self, url: str) -> bool:
+        """
+        Adds the URL, returns False if it was already in the set.
+        """
+        key = url_hash(url)
+        if self.contains_hash(key):
+            return False
+        self.recent.add(key)
+        self.size += 1
+        if self.bloom is not None:
+            self.bloom.add(key)
+        if len(self.recent) >= RECENT_SIZE:
+            self.compact()
+        return True
+
+    def compact(self) -> None:
+        run = array("Q", sorted(self.recent))
+        self.recent = set()
+        # merge with the previous runs as long as they are not much larger, keeping the run sizes geometric
+        while self.runs and len(self.runs[-1]) <= 2 * len(run):
+            run = array("Q", merge(self.runs.pop(), run))
+        self.runs.append(run)
+
+    def memory_bytes(self) -> int:
+        # hashes in the runs, plus the recent set with its int objects, plus the Bloom filter
+        memory = sum(run.buffer_info()[1] * run.itemsize for run in self.runs)
+        memory += sys.getsizeof(self.recent) + sum(sys.getsizeof(key) for key in self.recent)
+        if self.bloom is not None:
+            memory += len(self.bloom.bits)
+        return memory
@@ -0,0 +1,312 @@
+import time
+import sqlite3
+import threading
+from Indexer import Indexer, encode_postings, decode_postings
+from PostingList import PostingStore, PostingList
+from SimilarPages import SimilarityIndex
+
+"""
+Log-structured index: new pages are buffered in memory and flushed as small immutable segments,
+and a background merger combines segments (tiered merge policy) and purges the old versions of re-indexed documents.
+"""
+
+SEGMENT_FIELDS = ("body", "title")
+
+
+def create_segment_tables(db_connection: sqlite3.Connection) -> None:
+    with db_connection:
+        # AUTOINCREMENT makes sure segment IDs are never reused, newer segments always have larger IDs
+        db_connection.execute('''
+            CREATE TABLE IF NOT EXISTS segments (
+                segmentId INTEGER PRIMARY KEY AUTOINCREMENT,
+                level INTEGER,
+                docCount INTEGER,
+                createdAt REAL
+            )
+        ''')
+        # value format is the same as body_inverted_index: urlId1;frequency1;position1 urlId2;...
+        db_connection.execute('''
+            CREATE TABLE IF NOT EXISTS segment_postings (
+                segmentId INTEGER,
+                field TEXT,
+                wordId TEXT,
+                value TEXT,
+                PRIMARY KEY (segmentId, field, wordId)
+            )
+        ''')
+        db_connection.execute('''
+            CREATE TABLE IF NOT EXISTS segment_forward_index (
+                segmentId INTEGER,
+                urlId TEXT,
+                value TEXT,
+                PRIMARY KEY (segmentId, urlId)
+            )
+        ''')
+        db_connection.execute("CREATE INDEX IF NOT EXISTS segment_forward_index_url ON segment_forward_index(urlId);")
+        # a document is dead in every segment older than its tombstone's segmentId
+        db_connection.execute('''
+            CREATE TABLE IF NOT EXISTS deleted_documents (
+                urlId TEXT PRIMARY KEY,
+                segmentId INTEGER
+            )
+        ''')
+
+
+def drop_segments(db_connection: sqlite3.Connection) -> None:
+    # go back to the plain (non segmented) index tables
+    with db_connection:
+        for table in ("segments", "segment_postings", "segment_forward_index", "deleted_documents"):
+            db_connection.execute(f"DROP TABLE IF EXISTS {table};")
+
+
+def has_segments(cursor: sqlite3.Cursor) -> bool:
+    return cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='segments';").fetchone() is not None
+
+
+def load_segmented_index(connection: sqlite3.Connection, field: str, store: PostingStore | None = None) -> dict:
+    """
+    Returns the live postings of one field over all segments as PostingLists, like Retrieval.load_inverted_index.
+    Everything is read in one transaction, so a concurrent flush or merge is either fully visible or not at all.
+    """
+    inverted_index = {}
+    connection.execute("BEGIN;")
+    try:
+        tombstones = dict(connection.execute("SELECT urlId, segmentId FROM deleted_documents;").fetchall())
+        rows = connection.execute("SELECT segmentId, wordId, value FROM segment_postings WHERE field = ? ORDER BY segmentId;",
+                                  (field,)).fetchall()
+    finally:
+        connection.execute("COMMIT;")
+
+    if store is None:
+        store = PostingStore()
+    for (segment_id, word_id, value) in rows:
+        postings = inverted_index.get(word_id)
+        if postings is None:
+            postings = inverted_index[word_id] = PostingList(store)
+        # segments are read oldest first, so a newer version of a document replaces the older one
+        for (url_id, posting) in decode_postings(value).items():
+            if tombstones.get(url_id, 0) <= segment_id:
+                postings.append(url_id, posting["positions"])
+
+    # drop words whose postings all belong to deleted documents
+    return {word_id: postings for (word_id, postings) in inverted_index.items() if postings}
+
+
+class SegmentMerger(threading.Thread):
+    """
+    Background thread that applies a tiered merge policy: whenever `merge_factor` segments share a level,
+    they are merged into one segment of the next level. Dead documents are dropped while merging.
+    The merger uses its own connection, so readers keep using the old segments until the merge commits.
+    """
+
+    def __init__(self, db_path: str, merge_factor: int = 4):
+        super().__init__(daemon=True)
+        self.db_path = db_path
+        self.merge_factor = merge_factor
+        self.wake_up = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.stopped = False
+
+    def run(self) -> None:
+        connection = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        while not self.stopped:
+            self.wake_up.wait()
+            self.wake_up.clear()
+            while not self.stopped and self.mergeOnce(connection):
+                pass
+            # another flush may have asked for a merge in the meantime
+            if not self.wake_up.is_set():
+                self.idle.set()
+        connection.close()
+
+    def requestMerge(self) -> None:
+        self.idle.clear()
+        self.wake_up.set()
+
+    def waitUntilIdle(self) -> None:
+        self.idle.wait()
+
+    def stop(self) -> None:
+        self.stopped = True
+        self.wake_up.set()
+        self.join()
+
+    def pickSegments(self, connection: sqlite3.Connection) -> tuple[list[int], int] | None:
+        levels = {}
+        for (segment_id, level) in connection.execute("SELECT segmentId, level FROM segments ORDER BY segmentId;").fetchall():
+            levels.setdefault(level, []).append(segment_id)
+        for level in sorted(levels):
+            if len(levels[level]) >= self.merge_factor:
+                return levels[level][:self.merge_factor], level + 1
+        return None
+
+    def mergeOnce(self, connection: sqlite3.Connection) -> bool:
+        # only this thread removes segments, so the picked segments are still there when the merge commits
+        picked = self.pickSegments(connection)
+        if picked is None:
+            return False
+        segment_ids, level = picked
+        placeholders = ",".join("?" * len(segment_ids))
+
+        tombstones = dict(connection.execute("SELECT urlId, segmentId FROM deleted_documents;").fetchall())
+
+        # format is as follows:
+        # {field: {wordId: {urlId: {"frequency": n, "positions": [...]}}}}
+        merged_postings = {field: {} for field in SEGMENT_FIELDS}
+        for (segment_id, field, word_id, value) in connection.execute(
+                f"SELECT segmentId, field, wordId, value FROM segment_postings WHERE segmentId IN ({placeholders}) ORDER BY segmentId;",
+                segment_ids).fetchall():
+            postings = merged_postings[field].setdefault(word_id, {})
+            for (url_id, posting) in decode_postings(value).items():
+                if tombstones.get(url_id, 0) <= segment_id:
+                    postings[url_id] = posting
+
+        merged_forward_index = {}
+        source_segment = {}
+        for (segment_id, url_id, value) in connection.execute(
+                f"SELECT segmentId, urlId, value FROM segment_forward_index WHERE segmentId IN ({placeholders}) ORDER BY segmentId;",
+                segment_ids).fetchall():
+            if tombstones.get(url_id, 0) <= segment_id:
+                merged_forward_index[url_id] = value
+                source_segment[url_id] = segment_id
+
+        connection.execute("BEGIN IMMEDIATE;")
+        try:
+            # a flush may have re-indexed some of the merged pages while the segments were being read
+            tombstones = dict(connection.execute("SELECT urlId, segmentId FROM deleted_documents;").fetchall())
+            dead_url_ids = {url_id for (url_id, segment_id) in source_segment.items() if tombstones.get(url_id, 0) > segment_id}
+            for url_id in dead_url_ids:
+                del merged_forward_index[url_id]
+            if dead_url_ids:
+                for field in SEGMENT_FIELDS:
+                    for postings in merged_postings[field].values():
+                        for url_id in dead_url_ids & postings.keys():
+                            del postings[url_id]
+
+            cursor = connection.execute("INSERT INTO segments(level, docCount, createdAt) VALUES(?, ?, ?);",
+                                        (level, len(merged_forward_index), time.time()))
+            merged_segment_id = cursor.lastrowid
+            connection.executemany("INSERT INTO segment_postings VALUES(?, ?, ?, ?);",
+                                   [(merged_segment_id, field, word_id, encode_postings(postings))
+                                    for field in SEGMENT_FIELDS
+                                    for (word_id, postings) in merged_postings[field].items() if postings])
+            connection.executemany("INSERT INTO segment_forward_index VALUES(?, ?, ?);",
+                                   [(merged_segment_id, url_id, value) for (url_id, value) in merged_forward_index.items()])
+            connection.execute(f"DELETE FROM segment_postings WHERE segmentId IN ({placeholders});", segment_ids)
+            connection.execute(f"DELETE FROM segment_forward_index WHERE segmentId IN ({placeholders});", segment_ids)
+            connection.execute(f"DELETE FROM segments WHERE segmentId IN ({placeholders});", segment_ids)
+
+            # a tombstone is no longer needed once every segment it could hide has been merged away
+            connection.execute("DELETE FROM deleted_documents WHERE segmentId <= (SELECT MIN(segmentId) FROM segments);")
+            connection.execute("COMMIT;")
+        except Exception:
+            connection.execute("ROLLBACK;")
+            raise
+        return True
+
+
+class SegmentedIndexer:
+    """
+    Drop-in replacement for Indexer that never rewrites the index: every updateSQLiteDB() call appends
+    the pages buffered since the last call as a new immutable segment, and the SegmentMerger
+    combines segments in the background.
+    """
+
+    def __init__(self, db_connection: sqlite3.Connection, db_path: str, merge_factor: int = 4):
+        # the main indexer only owns the vocabulary, its postings tables stay empty
+        self.vocabulary = Indexer(db_connection)
+        self.connection = db_connection
+        create_segment_tables(db_connection)
+
+        self.new_words = []
+        self.buffer = self.newBuffer()
+
+        self.merger = SegmentMerger(db_path, merge_factor)
+        self.merger.start()
+
+    def newBuffer(self) -> Indexer:
+        # in-memory Indexer sharing the global vocabulary, holding the pages of the next segment
+        # (filled by the crawler's persister thread)
+        buffer = Indexer(sqlite3.connect(":memory:", check_same_thread=False))
+        buffer.word_to_id = self.vocabulary.word_to_id
+        buffer.id_to_word = self.vocabulary.id_to_word
+        return buffer
+
+    @property
+    def word_to_id(self) -> dict:
+        return self.vocabulary.word_to_id
+
+    @property
+    def id_to_word(self) -> dict:
+        return self.vocabulary.id_to_word
+
+
+    # Indexer interface
+
+    def addNewWord(self, words: list[str]) -> None:
+        for word in words:
+            if word not in self.vocabulary.word_to_id:
+                self.new_words += [word]
+        self.vocabulary.addNewWord(words)
+
+    def buildBodyInvertedIndex(self, words: list[str], url_id: str) -> None:
+        self.buffer.buildBodyInvertedIndex(words, url_id)
+
+    def buildTitleInvertedIndex(self, words: list[str], url_id: str) -> None:
+        self.buffer.buildTitleInvertedIndex(words, url_id)
+
+    def buildForwardIndex(self, words: list[str], url_id: str, remove_old_content: bool = False) -> None:
+        self.buffer.buildForwardIndex(words, url_id, remove_old_content)
+
+    def prepareSQLiteDB(self) -> None:
+        self.vocabulary.prepareSQLiteDB()
+
+    def updateSQLiteDB(self) -> None:
+        self.flushSegment()
+
+
+    # segment management
+
+    def flushSegment(self) -> None:
+        buffer = self.buffer
+        self.buffer = self.newBuffer()
+        new_words = self.new_words
+        self.new_words = []
+
+        with self.connection:
+            # only the words created since the last flush are appended to the vocabulary tables
+            self.connection.executemany("INSERT OR IGNORE INTO word_to_id VALUES(?, ?);",
+                                        [(word, self.word_to_id[word]) for word in new_words])
+            self.connection.executemany("INSERT OR IGNORE INTO id_to_word VALUES(?, ?);",
+                                        [(self.word_to_id[word], word) for word in new_words])
+
+            if not buffer.forward_index:
+                return
+
+            cursor = self.connection.execute("INSERT INTO segments(level, docCount, createdAt) VALUES(0, ?, ?);",
+                                             (len(buffer.forward_index), time.time()))
+            segment_id = cursor.lastrowid
+
+            # pages that are already in an older segment are re-indexed: the old versions become dead
+            for url_id in buffer.forward_index:
+                if self.connection.execute("SELECT 1 FROM segment_forward_index WHERE urlId = ? LIMIT 1;", (url_id,)).fetchone():
+                    self.connection.execute("INSERT OR REPLACE INTO deleted_documents VALUES(?, ?);", (url_id, segment_id))
+
+            for (field, inverted_index) in (("body", buffer.body_inverted_index), ("title", buffer.title_inverted_index)):
+                self.connection.executemany("INSERT INTO segment_postings VALUES(?, ?, ?, ?);",
+                                            [(segment_id, field, word_id, encode_postings(postings))
+                                             for (word_id, postings) in inverted_index.items()])
+            self.connection.executemany("INSERT INTO segment_forward_index VALUES(?, ?, ?);",
+                                        [(segment_id, url_id, " ".join(word_ids))
+                                         for (url_id, word_ids) in buffer.forward_index.items()])
+            # signatures are per page, not per segment: a re-indexed page replaces its old signature
+            SimilarityIndex(self.connection).update(buffer.forward_index.items())
+
+        self.merger.requestMerge()
+
+    def close(self) -> None:
+        # flush the last pages and let the running merges finish
+        self.flushSegment()
+        self.merger.waitUntilIdle()
+        self.merger.stop()
@@ -0,0 +1,190 @@
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from Indexer import Indexer
+from ConnectionManager import get_connection_manager
+from Scoring import CollectionStatistics, get_scoring
+from Metrics import MetricsRegistry, StageTimer
+from Statistics import load_statistics
+
+
+def shard_path_for(db_path: str, shard_id: int) -> str:
+    # e.g. main.db -> main.shard0.db, main.shard1.db, ...
+    root, ext = os.path.splitext(db_path)
+    return f"{root}.shard{shard_id}{ext}"
+
+
+def load_shard_paths(cursor: sqlite3.Cursor, db_path: str) -> list[str]:
+    """
+    Returns the shard database paths registered in the main database, or an empty list if the index is not sharded.
+    Shard paths are stored relative to the directory of the main database.
+    """
+    if cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='index_shards';").fetchone() is None:
+        return []
+    db_dir = os.path.dirname(os.path.abspath(db_path))
+    rows = cursor.execute("SELECT path FROM index_shards ORDER BY shardId;").fetchall()
+    return [os.path.join(db_dir, row[0]) for row in rows]
+
+
+def unregister_shards(db_connection: sqlite3.Connection) -> None:
+    # go back to a single, unsharded index in the main database
+    db_connection.execute("DROP TABLE IF EXISTS index_shards;")
+    db_connection.commit()
+
+
+class ShardedIndexer:
+    """
+    Drop-in replacement for Indexer that partitions documents across N shard databases by URL ID.
+    The vocabulary (word_to_id & id_to_word) stays in the main database so that word IDs are global,
+    while each shard keeps its own body/title inverted index and forward index.
+    """
+
+    def __init__(self, db_connection: sqlite3.Connection, db_path: str, num_shards: int):
+        # the main indexer only owns the vocabulary, its postings tables stay empty
+        self.vocabulary = Indexer(db_connection)
+        self.connection = db_connection
+
+        self.shard_paths = [shard_path_for(db_path, shard_id) for shard_id in range(num_shards)]
+        self.shards: list[Indexer] = []
+        for path in self.shard_paths:
+            connection = get_connection_manager(path).writer()
+            shard = Indexer(connection)
+
+            # every shard shares the global vocabulary
+            shard.word_to_id = self.vocabulary.word_to_id
+            shard.id_to_word = self.vocabulary.id_to_word
+            self.shards.append(shard)
+
+        self.registerShards()
+
+    @property
+    def word_to_id(self) -> dict:
+        return self.vocabulary.word_to_id
+
+    @property
+    def id_to_word(self) -> dict:
+        return self.vocabulary.id_to_word
+
+    def shardFor(self, url_id: str) -> Indexer:
+        # URL IDs are uuid4 integers, so they are already uniformly distributed
+        return self.shards[int(url_id) % len(self.shards)]
+
+    def registerShards(self) -> None:
+        self.connection.execute("CREATE TABLE IF NOT EXISTS index_shards(shardId INTEGER PRIMARY KEY, path TEXT);")
+        self.connection.execute("DELETE FROM index_shards;")
+        self.connection.executemany("INSERT INTO index_shards VALUES(?, ?);",
+                                    [(shard_id, os.path.basename(path)) for (shard_id, path) in enumerate(self.shard_paths)])
+        self.connection.commit()
+
+
+    # Indexer interface, routed to the vocabulary or to the shard owning the URL ID
+
+    def addNewWord(self, words: list[str]) -> None:
+        self.vocabulary.addNewWord(words)
+
+    def buildBodyInvertedIndex(self, words: list[str], url_id: str) -> None:
+        self.shardFor(url_id).buildBodyInvertedIndex(words, url_id)
+
+    def buildTitleInvertedIndex(self, words: list[str], url_id: str) -> None:
+        self.shardFor(url_id).buildTitleInvertedIndex(words, url_id)
+
+    def buildForwardIndex(self, words: list[str], url_id: str, remove_old_content: bool = False) -> None:
+        self.shardFor(url_id).buildForwardIndex(words, url_id, remove_old_content)
+
+    def prepareSQLiteDB(self) -> None:
+        self.vocabulary.prepareSQLiteDB()
+        for shard in self.shards:
+            shard.prepareSQLiteDB()
+
+    def updateSQLiteDB(self) -> None:
+        # shards only store their postings, the vocabulary is written once to the main database
+        for shard in self.shards:
+            shard.updateIndexTables()
+        self.vocabulary.updateSQLiteDB()
+
+
+# Query-time side: these functions run inside the worker processes of the shard pool
+
+_shard_pool = None
+
+# per-process cache of opened shards
+# format is as follows:
+# {shard_path: (retrieval, data_version, body_inverted_index, title_inverted_index)}
+_open_shards = {}
+
+
+def get_shard_pool(num_shards: int) -> ProcessPoolExecutor:
+    global _shard_pool
+    if _shard_pool is None:
+        _shard_pool = ProcessPoolExecutor(max_workers=min(num_shards, os.cpu_count() or 1))
+    return _shard_pool
+
+
+def _load_shard(shard_path: str) -> tuple:
+    # Retrieval imports this module, so import it lazily here
+    from Retrieval import Retrieval
+
+    cached = _open_shards.get(shard_path)
+    retrieval = cached[0] if cached else Retrieval(shard_path)
+
+    # data_version changes whenever another connection (i.e. the crawler) commits to the shard,
+    # so the postings are only decoded again after the shard was actually updated
+    data_version = retrieval.cursor.execute("PRAGMA data_version;").fetchone()[0]
+    if cached is None or cached[1] != data_version:
+        body_inverted_index = retrieval.load_inverted_index()
+        title_inverted_index = retrieval.load_title_index()
+        retrieval.link_scores = retrieval.load_link_scores()
+        retrieval.statistics = None if retrieval.segmented else load_statistics(retrieval.conn)
+        cached = (retrieval, data_version, body_inverted_index, title_inverted_index)
+        _open_shards[shard_path] = cached
+    return cached
+
+
+def shard_term_statistics(shard_path: str, word_ids: list[str]) -> tuple[dict, CollectionStatistics]:
+    """
+    Returns the local {word_id: (doc_count, max_tf)} of the query terms and the collection statistics of the shard.
+    """
+    retrieval, _, body_inverted_index, _ = _load_shard(shard_path)
+    return retrieval.term_statistics(word_ids, body_inverted_index), retrieval.collection_statistics(body_inverted_index)
+
+
+def merge_term_statistics(shard_statistics: list[tuple[dict, CollectionStatistics]]) -> tuple[dict, CollectionStatistics]:
+    """
+    Merges the local statistics of every shard into global ones: document frequencies, document counts and
+    document lengths are summed, max tf is the maximum over all shards.
+    """
+    term_statistics = {}
+    total_docs = 0
+    total_length = 0
+    for (local_statistics, collection) in shard_statistics:
+        total_docs += collection.document_count
+        total_length += collection.document_count * collection.average_length
+        for (word_id, (doc_count, max_tf)) in local_statistics.items():
+            global_doc_count, global_max_tf = term_statistics.get(word_id, (0, 0))
+            term_statistics[word_id] = (global_doc_count + doc_count, max(global_max_tf, max_tf))
+    return term_statistics, CollectionStatistics(total_docs, total_length / total_docs if total_docs else 0)
+
+
+def shard_top_documents(shard_path: str, query_vector: dict, phrase_word_ids_list: list[list[str]],
+                        term_statistics: dict, collection: CollectionStatistics, scoring: str,
+                        max_results: int, query_tree=None) -> tuple[list, dict, dict, dict]:
+    """
+    Scores the documents of one shard with the global statistics. A boolean query tree is evaluated locally,
+    every document lives in exactly one shard.
+    Returns the local top-k (doc_id, score) pairs, the keyword frequencies of those documents, the positions of
+    the query terms in them (for the snippets) and the {stage: seconds} timings of the shard.
+    """
+    retrieval, _, body_inverted_index, title_inverted_index = _load_shard(shard_path)
+    # the registry of a pool process is never served, the timings are sent back to the coordinator instead
+    retrieval.timer = StageTimer("retrieval_stage_seconds", MetricsRegistry())
+    if retrieval.scoring_name != scoring:
+        retrieval.scoring_name = scoring
+        retrieval.scoring = get_scoring(scoring)
+    doc_scores = retrieval.score_documents(query_vector, phrase_word_ids_list, body_inverted_index,
+                                           title_inverted_index, term_statistics, collection, query_tree)
+    ranked_docs = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)[:max_results]
+    doc_word_frequencies = retrieval.collect_doc_word_frequencies([doc_id for doc_id, _ in ranked_docs],
+                                                                  body_inverted_index)
+    doc_positions = retrieval.collect_query_positions([doc_id for doc_id, _ in ranked_docs], query_vector,
+                                                      body_inverted_index)
+    return ranked_docs, doc_word_frequencies, doc_positions, retrieval.timer.stages
@@ -0,0 +1,210 @@
+import math
+import random
+import sqlite3
+import heapq
+import struct
+import hashlib
+from array import array
+from collections import Counter
+from Statistics import load_statistics
+
+"""
+"Similar pages" of a search result, found with MinHash signatures and locality-sensitive hashing over the term sets
+of the forward index, written by the Indexer next to the postings:
+
+    minhash_signatures(urlId, signature)   NUM_HASHES minimum hash values of the page's word IDs, as an array('Q')
+    lsh_buckets(bucket, urlId)             one row per band of the signature, bucket = blake2b digest of the band's values
+
+Two pages with Jaccard similarity s share a band with probability 1 - (1 - s^ROWS)^BANDS, so the candidates of a page
+are read from its BANDS buckets instead of comparing it with every other page. The candidates are then re-ranked by
+the cosine of their TF-IDF vectors (the forward index keeps term sets, so tf is 0 or 1, weighted by log2(N/df)).
+"""
+
+NUM_HASHES = 64
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+# Mersenne prime of the hash family (a * x + b) mod PRIME
+PRIME = (1 << 61) - 1
+# fixed seed: signatures written by different processes and crawls must be comparable
+_random = random.Random(4321)
+HASH_PARAMETERS = [(_random.randrange(1, PRIME), _random.randrange(0, PRIME)) for _ in range(NUM_HASHES)]
+
+# candidates re-ranked per lookup, the ones sharing the most bands first
+MAX_CANDIDATES = 200
+# per-word hash values kept while signatures are computed
+WORD_CACHE_SIZE = 200000
+IN_CHUNK_SIZE = 500
+
+
+def signature(word_ids, cache: dict) -> array:
+    """
+    MinHash signature of a set of word IDs. `cache` keeps the hash values of every word seen so far, the same words
+    appear in most pages.
+    """
+    vectors = []
+    for word_id in set(word_ids):
+        vector = cache.get(word_id)
+        if vector is None:
+            x = int(word_id) % PRIME
+            vector = cache[word_id] = tuple((a * x + b) % PRIME for (a, b) in HASH_PARAMETERS)
+        vectors.append(vector)
+    return array("Q", map(min, zip(*vectors)))
+
+
+def band_buckets(minhashes: array) -> list[int]:
+    # a 64-bit digest of the band number and its values, the same on every platform and Python version
+    # (the built-in hash() of a tuple is not guaranteed to be); signed, as SQLite integers are
+    band_format = struct.Struct(f"<{ROWS + 1}Q")
+    return [int.from_bytes(hashlib.blake2b(band_format.pack(band, *minhashes[band * ROWS:(band + 1) * ROWS]),
+                                           digest_size=8).digest(), "little", signed=True)
+            for band in range(BANDS)]
+
+
+def decode_signature(blob: bytes) -> array:
+    minhashes = array("Q")
+    minhashes.frombytes(blob)
+    return minhashes
+
+
+class SimilarityIndex:
+    """
+    Writes the signatures and LSH buckets of one index database (the main database, or a shard).
+    """
+
+    def __init__(self, connection: sqlite3.Connection):
+        # writes go through the connection of the caller and are committed with its transaction
+        self.connection = connection
+        self.create_tables()
+
+    def create_tables(self) -> None:
+        self.connection.execute("CREATE TABLE IF NOT EXISTS minhash_signatures(urlId TEXT PRIMARY KEY, signature BLOB);")
+        # clustered by bucket, a lookup reads BANDS short ranges
+        self.connection.execute("CREATE TABLE IF NOT EXISTS lsh_buckets(bucket INTEGER, urlId TEXT, "
+                                "PRIMARY KEY (bucket, urlId)) WITHOUT ROWID;")
+
+    def clear(self) -> None:
+        self.connection.execute("DELETE FROM minhash_signatures;")
+        self.connection.execute("DELETE FROM lsh_buckets;")
+
+    def remove(self, url_id: str) -> None:
+        row = self.connection.execute("SELECT signature FROM minhash_signatures WHERE urlId = ?;", (url_id,)).fetchone()
+        if row is None:
+            return
+        self.connection.executemany("DELETE FROM lsh_buckets WHERE bucket = ? AND urlId = ?;",
+                                    [(bucket, url_id) for bucket in band_buckets(decode_signature(row[0]))])
+        self.connection.execute("DELETE FROM minhash_signatures WHERE urlId = ?;", (url_id,))
+
+    def update(self, documents, replace: bool = True) -> None:
+        """
+        (Re)computes the signatures of `documents`, (url_id, word_ids) pairs of the forward index. With `replace`,
+        the buckets of an older signature of the same page are removed first.
+        """
+        cache = {}
+        for (url_id, word_ids) in documents:
+            if replace:
+                self.remove(url_id)
+            if not word_ids:
+                continue
+            minhashes = signature(word_ids, cache)
+            self.connection.execute("INSERT OR REPLACE INTO minhash_signatures VALUES(?, ?);", (url_id, minhashes.tobytes()))
+            self.connection.executemany("INSERT OR IGNORE INTO lsh_buckets VALUES(?, ?);",
+                                        [(bucket, url_id) for bucket in band_buckets(minhashes)])
+            if len(cache) > WORD_CACHE_SIZE:
+                cache.clear()
+
+    def rebuild(self, forward_rows) -> None:
+        # from scratch, out of (urlId, value) rows of the forward_index table
+        self.clear()
+        self.update(((url_id, value.split(" ") if value else []) for (url_id, value) in forward_rows), replace=False)
+
+
+class SimilarPages:
+    """
+    Query-time lookup over one or several index databases (the shards of a sharded index), each with its own
+    signatures, forward index and statistics.
+    """
+
+    def __init__(self, connections: list[sqlite3.Connection], segmented: bool = False):
+        self.connections = connections
+        # a segmented index keeps its forward index in segment_forward_index
+        self.segmented = segmented
+
+    def find_signature(self, url_id: str) -> array | None:
+        for connection in self.connections:
+            try:
+                row = connection.execute("SELECT signature FROM minhash_signatures WHERE urlId = ?;", (url_id,)).fetchone()
+            except sqlite3.OperationalError:
+                # built before the similarity tables existed
+                return None
+            if row is not None:
+                return decode_signature(row[0])
+        return None
+
+    def candidates(self, minhashes: array, url_id: str) -> list[str]:
+        # pages sharing at least one band with the signature, the most shared bands first
+        buckets = band_buckets(minhashes)
+        placeholders = ",".join("?" * len(buckets))
+        shared_bands = Counter()
+        for connection in self.connections:
+            for (candidate,) in connection.execute(f"SELECT urlId FROM lsh_buckets WHERE bucket IN ({placeholders});", buckets):
+                shared_bands[candidate] += 1
+        shared_bands.pop(url_id, None)
+        return [candidate for (candidate, _) in shared_bands.most_common(MAX_CANDIDATES)]
+
+    def forward_terms(self, url_ids: list[str]) -> dict[str, list[str]]:
+        if self.segmented:
+            # the newest version of a page is in its newest segment
+            query = "SELECT urlId, value FROM segment_forward_index WHERE urlId IN ({}) ORDER BY segmentId;"
+        else:
+            query = "SELECT urlId, value FROM forward_index WHERE urlId IN ({});"
+        terms = {}
+        for connection in self.connections:
+            for start in range(0, len(url_ids), IN_CHUNK_SIZE):
+                chunk = url_ids[start:start + IN_CHUNK_SIZE]
+                for (url_id, value) in connection.execute(query.format(",".join("?" * len(chunk))), chunk):
+                    terms[url_id] = value.split(" ") if value else []
+        return terms
+
+    def term_weights(self, word_ids) -> dict[str, float]:
+        """
+        IDF of the words, log2(N/df) summed over the databases; 1 for every word if no statistics were written.
+        """
+        document_count = 0
+        document_frequencies = Counter()
+        for connection in self.connections:
+            statistics = None if self.segmented else load_statistics(connection)
+            if statistics is None:
+                return dict.fromkeys(word_ids, 1.0)
+            document_count += statistics.document_count
+            for (word_id, term) in statistics.term_statistics(connection.cursor(), word_ids).items():
+                document_frequencies[word_id] += term.document_frequency
+        # title-only words have no body statistics, they count as rare
+        return {word_id: math.log2(document_count / document_frequencies.get(word_id, 1)) if document_count else 1.0
+                for word_id in word_ids}
+
+    def similar(self, url_id: str, max_results: int = 10) -> list[tuple[str, float]]:
+        """
+        Returns [(url_id, cosine similarity)] of the pages most similar to `url_id`, best first.
+        """
+        minhashes = self.find_signature(url_id)
+        if minhashes is None:
+            return []
+        candidates = self.candidates(minhashes, url_id)
+        if not candidates:
+            return []
+
+        terms = self.forward_terms([url_id] + candidates)
+        source_terms = set(terms.get(url_id, []))
+        weights = self.term_weights(set().union(*map(set, terms.values())))
+        source_norm = math.sqrt(sum(weights[word_id] ** 2 for word_id in source_terms))
+        if not source_norm:
+            return []
+
+        scores = []
+        for candidate in candidates:
+            candidate_terms = set(terms.get(candidate, []))
+            dot_product = sum(weights[word_id] ** 2 for word_id in source_terms & candidate_terms)
+            candidate_norm = math.sqrt(sum(weights[word_id] ** 2 for word_id in candidate_terms))
+            if dot_product and candidate_norm:
+                scores.append((candidate, dot_product / (source_norm * candidate_norm)))
+        return heapq.nlargest(max_results, scores, key=lambda item: item[1])
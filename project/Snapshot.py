@@ -0,0 +1,106 @@
+import os
+import marshal
+import sqlite3
+from collections import OrderedDict
+
+"""
+Binary snapshots for a fast cold start: structures that are expensive to rebuild from their source
+(the vocabulary tables, the stopword file) are also written with marshal next to the source, together with a stamp
+of the source. A process only rebuilds them when the stamp no longer matches.
+"""
+
+
+def load_snapshot(path: str, stamp):
+    try:
+        # one read + loads is several times faster than marshal.load on the file object
+        with open(path, "rb") as f:
+            snapshot_stamp, data = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    return data if snapshot_stamp == stamp else None
+
+
+def save_snapshot(path: str, stamp, data) -> None:
+    # written to a temporary file first, so a concurrent reader never sees half a snapshot
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(marshal.dumps((stamp, data)))
+        os.replace(temp_path, path)
+    except OSError:
+        # a read-only deployment simply keeps rebuilding from the source
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class DatabaseCache:
+    """
+    Per-process cache of a structure built for a database file (e.g. its k-gram index). Every publish creates a new
+    generation file, so only the `size` most recently used databases are kept and those whose file was deleted are
+    dropped. Not thread-safe, the caller holds its own lock.
+    """
+
+    def __init__(self, size: int = 2):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, path: str | None):
+        entry = self.entries.get(path)
+        if entry is not None:
+            self.entries.move_to_end(path)
+        return entry
+
+    def put(self, path: str | None, entry) -> None:
+        self.entries[path] = entry
+        self.entries.move_to_end(path)
+        for cached_path in [cached_path for cached_path in self.entries
+                            if cached_path is not None and not os.path.exists(cached_path)]:
+            del self.entries[cached_path]
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+
+def file_stamp(path: str) -> tuple:
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def database_path(connection: sqlite3.Connection) -> str | None:
+    # file of the main database, None for an in-memory database
+    for (_, name, path) in connection.execute("PRAGMA database_list;").fetchall():
+        if name == "main":
+            return path or None
+    return None
+
+
+def vocabulary_stamp(cursor: sqlite3.Cursor) -> tuple | None:
+    """
+    The vocabulary tables only ever grow (they are rewritten in insertion order or appended to),
+    so the last row identifies their content without scanning them.
+    """
+    try:
+        return cursor.execute("SELECT rowid, word, wordId FROM word_to_id ORDER BY rowid DESC LIMIT 1;").fetchone()
+    except sqlite3.OperationalError:
+        return None
+
+
+def load_vocabulary(connection: sqlite3.Connection) -> dict[str, str]:
+    """
+    Returns {word: word_id} from the snapshot of the database if it is up to date, otherwise from `word_to_id`
+    (and refreshes the snapshot).
+    """
+    cursor = connection.cursor()
+    stamp = vocabulary_stamp(cursor)
+    if stamp is None:
+        return {}
+
+    path = database_path(connection)
+    if path is not None:
+        word_to_id = load_snapshot(path + ".vocab.snapshot", stamp)
+        if word_to_id is not None:
+            return word_to_id
+
+    word_to_id = dict(cursor.execute("SELECT word, wordId FROM word_to_id;").fetchall())
+    if path is not None:
+        save_snapshot(path + ".vocab.snapshot", stamp, word_to_id)
+    return word_to_id
@@ -0,0 +1,94 @@
+import threading
+from itertools import groupby
+from operator import itemgetter
+from collections import OrderedDict
+from DocumentStore import TokenStore
+from Snapshot import database_path
+
+"""
+Query-biased snippets of the search results, cut out of the stored body words (TokenStore) around the positions of
+the query terms in the body postings, so a result page needs neither the HTML of its hits nor a parser.
+
+The snippet is the window of SNIPPET_WORDS words with the most distinct query terms (then the most hits), found in one
+pass over the sorted hit positions. It is returned as [(text, highlighted)] segments, to be joined with spaces.
+"""
+
+SNIPPET_WORDS = 30
+# snippets kept per process, keyed by (database file, URL ID, query word IDs)
+CACHE_SIZE = 4096
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def best_window(hits: list[tuple[int, str]], width: int) -> tuple[int, int]:
+    """
+    `hits` are (word index, word_id) sorted by index. Returns the (first, last) word index of the hits inside the
+    window of `width` words with the most distinct terms, then the most hits.
+    """
+    counts = {}
+    best = (-1, -1)
+    best_range = (hits[0][0], hits[0][0])
+    left = 0
+    for (right, (index, word_id)) in enumerate(hits):
+        counts[word_id] = counts.get(word_id, 0) + 1
+        while index - hits[left][0] >= width:
+            left_word_id = hits[left][1]
+            counts[left_word_id] -= 1
+            if not counts[left_word_id]:
+                del counts[left_word_id]
+            left += 1
+        score = (len(counts), right - left + 1)
+        if score > best:
+            best = score
+            best_range = (hits[left][0], index)
+    return best_range
+
+
+def make_snippet(words: list[str], kept_indexes, positions: dict[str, list[int]], width: int = SNIPPET_WORDS) -> list[tuple[str, bool]]:
+    """
+    Returns the snippet segments of one document from its body words and the index positions of the query terms.
+    """
+    hits = sorted((kept_indexes[position], word_id) for (word_id, word_positions) in positions.items()
+                  for position in word_positions if position < len(kept_indexes))
+    if hits:
+        first, last = best_window(hits, width)
+        # the window is centered on its hits
+        start = max(0, first - (width - (last - first + 1)) // 2)
+    else:
+        # no body hit (e.g. only a title match): the beginning of the page
+        start = 0
+    end = min(len(words), start + width)
+    start = max(0, end - width)
+    highlighted = {index for (index, _) in hits if start <= index < end}
+
+    # consecutive words with the same highlighting form one segment
+    pieces = [(words[index], index in highlighted) for index in range(start, end) if words[index]]
+    segments = [(" ".join(word for (word, _) in group), is_hit) for (is_hit, group) in groupby(pieces, key=itemgetter(1))]
+    if start > 0:
+        segments.insert(0, ("...", False))
+    if end < len(words):
+        segments.append(("...", False))
+    return segments
+
+
+def get_snippet(connection, url_id: str, positions: dict[str, list[int]]) -> list[tuple[str, bool]]:
+    """
+    Snippet of the document for the query terms of `positions` ({word_id: body positions in the document}),
+    from the per-process cache or the token store of `connection`. Empty if the words of the page were not stored.
+    """
+    key = (database_path(connection), url_id, tuple(sorted(positions)))
+    with _cache_lock:
+        segments = _cache.get(key)
+        if segments is not None:
+            _cache.move_to_end(key)
+            return segments
+
+    tokens = TokenStore(connection).get(url_id)
+    segments = make_snippet(*tokens, positions) if tokens is not None else []
+
+    with _cache_lock:
+        _cache[key] = segments
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return segments
@@ -1,11 +1,25 @@
 import requests
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
-from collections import deque
+from collections import deque, namedtuple
+from contextlib import nullcontext
 import sqlite3
 import uuid
 import time
+import argparse
 from Indexer import Indexer
+from ShardedIndex import ShardedIndexer, unregister_shards
+from SegmentedIndex import SegmentedIndexer, drop_segments
+from ExternalSortIndexer import ExternalSortIndexer
+from CrawlMetrics import CrawlMetrics
+from ConnectionManager import get_connection_manager
+from Generations import create_staging_database, publish_database
+from DocumentStore import DocumentStore, TokenStore
+from LinkGraph import build_link_graph
+from Persister import Persister
+from SeenUrlSet import SeenUrlSet
+from SpillingQueue import SpillingQueue
+from PriorityFrontier import PriorityFrontier, get_frontier_policy
 import re
 from ContentExtractor import ContentExtractor
 from StopwordRemovalStem import StopwordRemovalStem  # Import StopwordRemovalStem class
@@ -15,6 +29,38 @@ import aiohttp
 from asyncio import Queue
 
 
+# a parsed page, handed from the fetch coroutines to the persister thread
+# new_urls: [(url, url_id)] of the URLs seen for the first time while parsing the page, child_url_ids: IDs of its links
+PageRecord = namedtuple("PageRecord", ["url_id", "url", "headers", "text", "last_modified", "page_title", "page_size",
+                                       "body_words", "processed_body_words", "processed_title_words", "new_urls",
+                                       "child_url_ids"])
+
+
+def parse_content(extractor: ContentExtractor, stop_stem: StopwordRemovalStem, headers, text: str, span=None) -> tuple:
+    """
+    Parses and stems a page, for the crawl and for reindex.py. Returns (last_modified, page_title, page_size,
+    body_words, processed_body_words, processed_title_words); `span(stage)` times the parse and stem stages.
+    """
+    span = span or (lambda stage: nullcontext())
+    with span("parse"):
+        last_modified = extractor.getLastModDate(headers)
+        page_title = extractor.getTitle(text)
+        body_text = extractor.getBodyText(text)
+        body_words = extractor.splitWords(body_text)
+    with span("stem"):
+        processed_body_words = stop_stem.transform(body_words)
+
+    processed_title_words = []
+    if page_title:
+        with span("parse"):
+            title_words = extractor.splitWords(page_title.lower())
+        with span("stem"):
+            processed_title_words = stop_stem.transform(title_words)
+
+    page_size = str(extractor.getPagesize(headers, body_text))
+    return last_modified, page_title, page_size, body_words, processed_body_words, processed_title_words
+
+
 """ NOTES """
 """ 
 - look at the BFS (if it aligns with the max page limit)
@@ -24,12 +70,34 @@ from asyncio import Queue
 
 
 class Spider:
-    def __init__(self, start_url: str, max_pages: int, db_connection: sqlite3.Connection, indexer: Indexer):
+    def __init__(self, start_url: str, max_pages: int, db_connection: sqlite3.Connection, indexer: Indexer,
+                 metrics_interval: float = 10.0, metrics_path: str | None = None, max_pending_pages: int = 256,
+                 flush_interval: float = 2.0, frontier_memory: int = 100000, expected_urls: int = 0,
+                 frontier_policy=None):
         self.start_url = start_url
         self.max_pages = max_pages
 
-        self.visited_urls = set()
-        self.enqueued_urls = set([start_url])
+        # the frontier keeps at most `frontier_memory` URLs in memory and spills the others to disk, and the sets of
+        # seen URLs keep 8-byte hashes instead of the URLs (see SpillingQueue.py and SeenUrlSet.py);
+        # with `expected_urls`, the sets get a Bloom filter sized for that many URLs
+        self.frontier_memory = frontier_memory
+        self.expected_urls = expected_urls
+        # with a frontier policy (see PriorityFrontier.py), the most valuable URLs are crawled first instead of BFS
+        self.frontier_policy = frontier_policy
+
+        # while crawling, the database and the indexer are only written by the persister thread (see Persister.py);
+        # at most `max_pending_pages` parsed pages wait for it, and it commits at least every `flush_interval` seconds
+        self.max_pending_pages = max_pending_pages
+        self.flush_interval = flush_interval
+        self.persister = None
+
+        # crawl metrics are emitted as JSON lines every `metrics_interval` seconds (to stdout or `metrics_path`)
+        self.metrics_interval = metrics_interval
+        self.metrics_path = metrics_path
+        self.metrics = CrawlMetrics(metrics_path)
+
+        self.visited_urls = self.new_url_set()
+        self.enqueued_urls = self.new_url_set([start_url])
 
         # instead of connecting to database, we pass the connection to the spider to avoid database access conflicts
         self.db = db_connection
@@ -40,8 +108,15 @@ class Spider:
         self.indexer = indexer
         self.extractor = ContentExtractor()
         self.stop_stem = StopwordRemovalStem()  # stopword removal and stemming part
+        # fetched pages are kept compressed, so the index can be rebuilt without crawling again (see reindex.py)
+        self.documents = DocumentStore(self.db)
+        # body words of every page, for the snippets of the search results (see Snippets.py)
+        self.tokens = TokenStore(self.db)
         self.create_spider_tables()
 
+        # URLs which are already in url_to_id, so parsing a page never waits for the database
+        self.known_urls = self.new_url_set(url for (url,) in self.db.execute("SELECT url FROM url_to_id"))
+
         self.db.commit()
 
     def create_spider_tables(self):
@@ -102,6 +177,10 @@ class Spider:
                     parentsUrlId TEXT
                 )
             ''')
+            # 9. document_blocks & document_offsets
+            self.documents.create_tables()
+            # 10. document_tokens
+            self.tokens.create_tables()
 
         self.db.commit()
 
@@ -116,16 +195,24 @@ class Spider:
             self.db.execute("DELETE FROM id_to_page_size")
             self.db.execute("DELETE FROM id_to_children_url_id")
             self.db.execute("DELETE FROM id_to_parents_url_id")
+            self.documents.clear()
+            self.tokens.clear()
 
         self.db.commit()
+        self.known_urls = self.new_url_set()
 
         # also clear indexer tables 
         self.indexer.prepareSQLiteDB()
         self.indexer.updateSQLiteDB()
 
     async def fetch_page(self, session, url: str):
+        start_time = time.perf_counter()
         try:
             async with session.get(url) as response:
+                # the body is read once here, text() below decodes the cached bytes
+                raw = await response.read()
+                if response.status >= 400:
+                    self.metrics.error(f"HTTP {response.status}")
                 try:
                     # try normally decode first 
                     text = await response.text()
@@ -137,33 +224,41 @@ class Spider:
                     except Exception:
                         text = raw.decode('utf-8', errors='replace')
                 headers = dict(response.headers)
+                self.metrics.fetched(time.perf_counter() - start_time, len(raw))
                 return type('Response', (), {'text': text, 'headers': headers, 'url': url})
         except Exception as e:
+            self.metrics.error(type(e).__name__)
             print(f"Failed to fetch {url}: {e}")
             return None
 
-    def get_or_create_url_id(self, url: str):
+    def get_or_create_url_id(self, url: str, new_urls: list):
         """
-        returns an existing urlId if found; otherwise creates a new uuid4
-        and inserts into url_to_id, id_to_url, crawled_page_to_id
+        returns the urlId of the URL; if the URL is new, also appends (url, urlId) to new_urls,
+        for insert_urls to add it into url_to_id, id_to_url, crawled_page_to_id
         """
-        cursor = self.db.execute('SELECT urlId FROM url_to_id WHERE url = ?', (url,))
-        row = cursor.fetchone()
-        if row:
-            return row[0]
-        new_id = str(int(uuid.uuid4()))
-        with self.db:
-            self.db.execute('INSERT INTO url_to_id (url, urlId) VALUES (?, ?)', (url, new_id))
-            self.db.execute('INSERT INTO id_to_url (urlId, url) VALUES (?, ?)', (new_id, url))
-            self.db.execute('INSERT INTO crawled_page_to_id (url, urlId) VALUES (?, ?)', (url, new_id))
-        
-        self.db.commit()
+        url_id = self.new_url_id(url)
+        if self.known_urls.add(url):
+            new_urls.append((url, url_id))
+        return url_id
+
+    def insert_urls(self, new_urls: list):
+        self.db.executemany('INSERT OR IGNORE INTO url_to_id (url, urlId) VALUES (?, ?)', new_urls)
+        self.db.executemany('INSERT OR IGNORE INTO id_to_url (urlId, url) VALUES (?, ?)',
+                            [(url_id, url) for (url, url_id) in new_urls])
+        self.db.executemany('INSERT OR IGNORE INTO crawled_page_to_id (url, urlId) VALUES (?, ?)', new_urls)
 
-        return new_id
+    def new_url_id(self, url: str) -> str:
+        # derived from the URL itself: no URL -> ID map is needed while crawling, every crawler process assigns the
+        # same ID to the same URL, and the rankings of two crawls can be compared by URL ID
+        return str(int(uuid.uuid5(uuid.NAMESPACE_URL, url)))
+
+    def new_url_set(self, urls=()) -> SeenUrlSet:
+        return SeenUrlSet(urls, self.expected_urls, 10 if self.expected_urls else 0)
 
     def update_parents(self, child_id: str, parent_id: str):
         """
         append parent_id to child's parentsUrlId list, and child_id to parent's childrenUrlId list
+        (committed with the next batch)
         """
         # update child => parents
         cursor = self.db.execute('SELECT parentsUrlId FROM id_to_parents_url_id WHERE urlId = ?', (child_id,))
@@ -175,8 +270,6 @@ class Spider:
                 self.db.execute('UPDATE id_to_parents_url_id SET parentsUrlId=? WHERE urlId=?', (updated_parents, child_id))
         else:
             self.db.execute('INSERT INTO id_to_parents_url_id (urlId, parentsUrlId) VALUES (?, ?)', (child_id, parent_id))
-        
-        self.db.commit()
 
         # update parent => children now
         cursor = self.db.execute('SELECT childrenUrlId FROM id_to_children_url_id WHERE urlId = ?', (parent_id,))
@@ -188,17 +281,18 @@ class Spider:
                 self.db.execute('UPDATE id_to_children_url_id SET childrenUrlId=? WHERE urlId=?', (updated_children, parent_id))
         else:
             self.db.execute('INSERT INTO id_to_children_url_id (urlId, childrenUrlId) VALUES (?, ?)', (parent_id, child_id))
-        
-        self.db.commit()
 
     async def worker(self, session, url_queue: Queue, batch, batch_size, stop_event):
         while not stop_event.is_set():
+            idle_start = time.perf_counter()
             try:
                 current_url, parent_url_id = await asyncio.wait_for(url_queue.get(), timeout=1)
             except asyncio.TimeoutError:
                 if stop_event.is_set():
                     break
                 continue
+            finally:
+                self.metrics.idle(time.perf_counter() - idle_start)
             if current_url in self.visited_urls:
                 url_queue.task_done()
                 continue
@@ -208,53 +302,90 @@ class Spider:
                 url_queue.task_done()
                 continue
 
-            current_url_id = self.get_or_create_url_id(current_url)
+            # the page is written by the persister thread, this only waits if it is too far behind
+            await self.persister.put(self.parse_page(current_url, response, url_queue))
+
+            url_queue.task_done()
+            if len(self.visited_urls) % batch_size == 0:
+                print(f"Crawled: {len(self.visited_urls)} pages...")
 
-            last_modified = self.extractor.getLastModDate(response.headers)
-            page_title = self.extractor.getTitle(response.text)
-            body_text = self.extractor.getBodyText(response.text)
-            body_words = self.extractor.splitWords(body_text)
-            processed_body_words = self.stop_stem.transform(body_words)
-            self.indexer.addNewWord(processed_body_words)
-            self.indexer.buildBodyInvertedIndex(processed_body_words, current_url_id)
-            self.indexer.buildForwardIndex(processed_body_words, current_url_id)
+            if len(self.visited_urls) >= self.max_pages:
+                stop_event.set()
+                break
 
-            if page_title:
-                title_words = self.extractor.splitWords(page_title.lower())
-                processed_title_words = self.stop_stem.transform(title_words)
-                self.indexer.addNewWord(processed_title_words)
-                self.indexer.buildTitleInvertedIndex(processed_title_words, current_url_id)
-                self.indexer.buildForwardIndex(processed_title_words, current_url_id)
+    def process_page(self, current_url: str, response, url_queue, batch):
+        """
+        parses, stems and indexes a fetched page, queues its new links and records the link structure
+        """
+        self.store_page(self.parse_page(current_url, response, url_queue), batch)
 
-            page_size = str(self.extractor.getPagesize(response.headers, body_text))
+    def parse_page(self, current_url: str, response, url_queue) -> PageRecord:
+        """
+        the part of process_page that runs on the event loop: parses and stems the page and queues its new links,
+        without touching the database
+        """
+        new_urls = []
+        current_url_id = self.get_or_create_url_id(current_url, new_urls)
 
-            batch.append((
-                current_url_id, last_modified, page_title, page_size
-            ))
+        (last_modified, page_title, page_size, body_words, processed_body_words, processed_title_words) = parse_content(
+            self.extractor, self.stop_stem, response.headers, response.text, self.metrics.span)
 
-            self.visited_urls.add(current_url)
+        self.visited_urls.add(current_url)
 
+        with self.metrics.span("parse"):
             links = self.extractor.getLinks(current_url, response.text)
-            for link in links:
-                if link not in self.visited_urls and link not in self.enqueued_urls:
-                    url_queue.put_nowait((link, current_url_id))
-                    self.enqueued_urls.add(link)
-                child_id = self.get_or_create_url_id(link)
+        if self.frontier_policy is not None:
+            url_queue.observe_links(current_url, links, self.visited_urls)
+        child_url_ids = []
+        for link in links:
+            if link not in self.visited_urls and self.enqueued_urls.add(link):
+                url_queue.put_nowait((link, current_url_id))
+            child_url_ids.append(self.get_or_create_url_id(link, new_urls))
+
+        return PageRecord(current_url_id, current_url, response.headers, response.text, last_modified, page_title,
+                          page_size, body_words, processed_body_words, processed_title_words, new_urls, child_url_ids)
+
+    def store_page(self, record: PageRecord, batch):
+        """
+        the part of process_page that writes: indexes the page, stores it and records the link structure
+        (on the persister thread while crawling)
+        """
+        current_url_id = record.url_id
+        with self.metrics.span("index"):
+            self.indexer.addNewWord(record.processed_body_words)
+            self.indexer.buildBodyInvertedIndex(record.processed_body_words, current_url_id)
+            self.indexer.buildForwardIndex(record.processed_body_words, current_url_id)
+            if record.page_title:
+                self.indexer.addNewWord(record.processed_title_words)
+                self.indexer.buildTitleInvertedIndex(record.processed_title_words, current_url_id)
+                self.indexer.buildForwardIndex(record.processed_title_words, current_url_id)
+
+        with self.metrics.span("store"):
+            self.documents.add(current_url_id, record.url, record.headers, record.text)
+            self.tokens.add(current_url_id, record.body_words, self.stop_stem.keptIndexes(record.body_words),
+                            record.processed_body_words)
+
+        batch.append((
+            current_url_id, record.last_modified, record.page_title, record.page_size
+        ))
+
+        with self.metrics.span("url_db"):
+            self.insert_urls(record.new_urls)
+            for child_id in record.child_url_ids:
                 self.update_parents(child_id, current_url_id)
 
-            url_queue.task_done()
-            if len(self.visited_urls) % batch_size == 0:
-                self.flush_batch(batch)
-                print(f"Crawled: {len(self.visited_urls)} pages...")
+    def flush_batch(self, batch):
+        with self.metrics.span("flush_batch"):
+            self.write_batch(batch)
 
-            if len(self.visited_urls) >= self.max_pages:
-                stop_event.set()
-                break
-        
+    def write_batch(self, batch):
+        # write all pending page info and update indexer DB (speeding up using batches)
+        self.write_page_rows(batch)
+        self.indexer.updateSQLiteDB()
         self.db.commit()
+        batch.clear()
 
-    def flush_batch(self, batch):
-        # write all pending page info and update indexer DB (speeding up using batches)
+    def write_page_rows(self, batch):
         with self.db:
             for current_url_id, last_modified, page_title, page_size in batch:
                 self.db.execute('INSERT OR REPLACE INTO id_to_last_modification_date (urlId, lastModificationDate) VALUES (?, ?)',
@@ -263,9 +394,6 @@ class Spider:
                                 (current_url_id, page_title))
                 self.db.execute('INSERT OR REPLACE INTO id_to_page_size (urlId, pageSize) VALUES (?, ?)',
                                 (current_url_id, page_size))
-        self.indexer.updateSQLiteDB()
-        self.db.commit()
-        batch.clear()
 
     # used asyncio to fasten the crawling 
     # and to avoid blocking the main thread
@@ -273,23 +401,55 @@ class Spider:
     # BONUS
     async def crawl_async(self, num_workers=40, batch_size=10):
         self.clear_spider_tables()
-        self.visited_urls = set()
-        self.enqueued_urls = set([self.start_url])
-        url_queue = Queue()
+        self.visited_urls = self.new_url_set()
+        self.enqueued_urls = self.new_url_set([self.start_url])
+        url_queue = self.create_frontier()
         await url_queue.put((self.start_url, None))
+        self.metrics = CrawlMetrics(self.metrics_path)
         start_time = time.time()
         batch = []
         stop_event = asyncio.Event()
+        self.persister = Persister(self, self.max_pending_pages, batch_size, self.flush_interval)
+        self.persister.start()
         async with aiohttp.ClientSession() as session:
             workers = [asyncio.create_task(self.worker(session, url_queue, batch, batch_size, stop_event)) for _ in range(num_workers)]
-            await url_queue.join()
+            reporter = asyncio.create_task(self.report_metrics(url_queue))
+            # the crawl ends when the frontier is drained or when a worker hits max_pages,
+            # in which case the frontier still holds URLs and join() alone would never return
+            join_task = asyncio.create_task(url_queue.join())
+            stop_task = asyncio.create_task(stop_event.wait())
+            await asyncio.wait([join_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
+            join_task.cancel()
+            stop_task.cancel()
             stop_event.set()
             for w in workers:
                 w.cancel()
-            await asyncio.gather(*workers, return_exceptions=True)
-        # final flush
-        if batch:
-            self.flush_batch(batch)
+            reporter.cancel()
+            await asyncio.gather(*workers, reporter, return_exceptions=True)
+        # final flush, including the last (partial) block of the document store
+        await self.persister.close()
+        self.print_database_summary()
+        self.metrics.report(len(self.visited_urls), url_queue.qsize())
+        self.metrics.summary(len(self.visited_urls), url_queue.qsize())
+
+        end_time = time.time()
+        elapsed = end_time - start_time
+        print(f"Total crawling time: {elapsed:.2f} seconds")
+
+        self.db.commit()
+
+    async def report_metrics(self, url_queue):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            self.metrics.report(len(self.visited_urls), url_queue.qsize(), self.persister.pending())
+
+    def create_frontier(self):
+        if self.frontier_policy is not None:
+            return PriorityFrontier(self.frontier_policy)
+        # FIFO queue for a single-process BFS crawl, spilling to disk beyond `frontier_memory` URLs
+        return SpillingQueue(self.frontier_memory)
+
+    def print_database_summary(self):
         # bonus: summary info on database
         cursor = self.db.execute("SELECT name FROM sqlite_master WHERE type='table'")
         tables = [row[0] for row in cursor.fetchall()]
@@ -306,32 +466,91 @@ class Spider:
                 print(f"  {col[1]} ({col[2]})")
             print()
 
-        end_time = time.time()
-        elapsed = end_time - start_time
-        print(f"Total crawling time: {elapsed:.2f} seconds")
-
-        self.db.commit()
-
     def crawl(self):
         asyncio.run(self.crawl_async())
         self.db.commit()
 
 
 if __name__ == "__main__":
-    # thread-safe connection
-    db_connection = sqlite3.connect("main.db", check_same_thread=False)
-    db_connection.execute("PRAGMA journal_mode=WAL;")  # for concurrency issues, allow WAL mode
-    indexer = Indexer(db_connection)  # pass shared connection to Indexer
+    parser = argparse.ArgumentParser(description="Crawl and index pages starting from a URL.")
+    parser.add_argument("--start-url", default="https://www.cse.ust.hk/~kwtleung/COMP4321/testpage.htm")
+    parser.add_argument("--max-pages", type=int, default=300)
+    parser.add_argument("--db", default="main.db")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="partition the index across this many shard databases (hash of URL ID)")
+    parser.add_argument("--segmented", action="store_true",
+                        help="write the index as immutable segments merged in the background instead of rewriting it")
+    parser.add_argument("--memory-budget", type=float, default=None,
+                        help="build the index with sorted runs spilled to disk above this many MB, merged at the end")
+    parser.add_argument("--metrics-interval", type=float, default=10.0, help="seconds between two crawl metrics reports")
+    parser.add_argument("--metrics-file", default=None, help="append the crawl metrics JSON lines to this file instead of stdout")
+    parser.add_argument("--max-pending-pages", type=int, default=256,
+                        help="parsed pages waiting to be written before the fetch workers are slowed down")
+    parser.add_argument("--flush-interval", type=float, default=2.0,
+                        help="seconds after which the pages written so far are committed, even if the batch is not full")
+    parser.add_argument("--frontier-memory", type=int, default=100000,
+                        help="URLs of the frontier kept in memory, the others wait in a temporary database")
+    parser.add_argument("--bloom-filter", type=int, default=0, metavar="EXPECTED_URLS",
+                        help="put a Bloom filter sized for this many URLs in front of the seen-URL sets")
+    parser.add_argument("--frontier", choices=["bfs", "depth", "inlinks", "opic", "rules"], default="bfs",
+                        help="order of the crawl: BFS, or best-first by the given priority (see PriorityFrontier.py)")
+    parser.add_argument("--url-rule", action="append", default=[], metavar="PATTERN=WEIGHT",
+                        help="with --frontier rules: priority added to the URLs matching the regular expression")
+    args = parser.parse_args()
+
+    # the crawl builds a new generation of the database (a copy of the current one), the search keeps reading
+    # the current generation until the new one is published (see Generations.py)
+    staging_path = create_staging_database(args.db)
+
+    # thread-safe writer connection in WAL mode
+    connection_manager = get_connection_manager(staging_path)
+    db_connection = connection_manager.writer()
+    if args.shards > 1:
+        drop_segments(db_connection)
+        indexer = ShardedIndexer(db_connection, staging_path, args.shards)
+    elif args.segmented:
+        unregister_shards(db_connection)
+        indexer = SegmentedIndexer(db_connection, staging_path)
+    elif args.memory_budget is not None:
+        unregister_shards(db_connection)
+        drop_segments(db_connection)
+        indexer = ExternalSortIndexer(db_connection, args.memory_budget)
+    else:
+        unregister_shards(db_connection)
+        drop_segments(db_connection)
+        indexer = Indexer(db_connection)  # pass shared connection to Indexer
     spider = Spider(
-        start_url="https://www.cse.ust.hk/~kwtleung/COMP4321/testpage.htm",
-        max_pages=300,
+        start_url=args.start_url,
+        max_pages=args.max_pages,
         db_connection=db_connection,  # pass shared connection to Spider
-        indexer=indexer
+        indexer=indexer,
+        metrics_interval=args.metrics_interval,
+        metrics_path=args.metrics_file,
+        max_pending_pages=args.max_pending_pages,
+        flush_interval=args.flush_interval,
+        frontier_memory=args.frontier_memory,
+        expected_urls=args.bloom_filter,
+        frontier_policy=get_frontier_policy(args.frontier, args.url_rule) if args.frontier != "bfs" else None
     )
     spider.crawl()
 
-    db_connection.commit()
-
-    db_connection.close()  # close the connection after crawling
-
+    if args.segmented:
+        indexer.close()
+    elif args.memory_budget is not None:
+        indexer.finalize()
 
+    db_connection.commit()
+    # parent/child links in CSR form for the search results and link analysis (see LinkGraph.py)
+    build_link_graph(db_connection)
+
+    # the published generation is complete on its own: no WAL left behind, no connection writing to it
+    if args.shards > 1:
+        for shard_path in indexer.shard_paths:
+            get_connection_manager(shard_path).checkpoint()
+            get_connection_manager(shard_path).close()
+    connection_manager.checkpoint()
+    connection_manager.close()  # close the connection after crawling
+
+    # a crawl that failed before this point leaves an unpublished generation, removed by the next publish
+    publish_database(args.db, staging_path)
+    print(f"Published {staging_path}")
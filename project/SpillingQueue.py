@@ -0,0 +1,76 @@
+import sqlite3
+import asyncio
+from collections import deque
+
+"""
+FIFO crawl frontier with a bounded memory footprint. Up to `max_in_memory` URLs are kept in a deque; beyond that,
+new URLs are appended to a temporary SQLite database in chunks and read back in order once the deque is empty, so a
+crawl that discovers millions of links only keeps a few thousand of them in memory.
+
+It is an asyncio.Queue (overriding the same hooks as asyncio.PriorityQueue, plus the size), so Spider uses it unchanged.
+"""
+
+# URLs written to or read from the spill database at once
+SPILL_CHUNK_SIZE = 1000
+
+
+class SpillingQueue(asyncio.Queue):
+    def __init__(self, max_in_memory: int = 100000):
+        self.max_in_memory = max_in_memory
+        super().__init__()
+
+    def _init(self, maxsize):
+        self._queue = deque()
+        # items waiting to be spilled, newer than everything on disk
+        self._tail = []
+        self._spilled = 0
+        self._spill = None
+
+    # asyncio.Queue only counts self._queue
+
+    def qsize(self):
+        return len(self._queue) + len(self._tail) + self._spilled
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def _put(self, item):
+        if not self._spilled and not self._tail and len(self._queue) < self.max_in_memory:
+            self._queue.append(item)
+            return
+        self._tail.append(item)
+        if len(self._tail) >= SPILL_CHUNK_SIZE:
+            self._flush_tail()
+
+    def _get(self):
+        if not self._queue:
+            self._refill()
+        return self._queue.popleft()
+
+    def _flush_tail(self):
+        if self._spill is None:
+            # "" is a private temporary database on disk, deleted when it is closed
+            self._spill = sqlite3.connect("")
+            self._spill.execute("CREATE TABLE frontier(position INTEGER PRIMARY KEY, url TEXT, parentUrlId TEXT);")
+        with self._spill:
+            # items are (url, parent URL ID or None)
+            self._spill.executemany("INSERT INTO frontier(url, parentUrlId) VALUES(?, ?);", self._tail)
+        self._spilled += len(self._tail)
+        self._tail = []
+
+    def _refill(self):
+        # the spilled items are older than the tail, they come first
+        if self._spilled:
+            rows = self._spill.execute("SELECT position, url, parentUrlId FROM frontier ORDER BY position LIMIT ?;",
+                                       (SPILL_CHUNK_SIZE,)).fetchall()
+            with self._spill:
+                self._spill.execute("DELETE FROM frontier WHERE position <= ?;", (rows[-1][0],))
+            self._spilled -= len(rows)
+            self._queue.extend((url, parent_url_id) for (_, url, parent_url_id) in rows)
+        else:
+            self._queue.extend(self._tail)
+            self._tail = []
+
+    def spilled(self) -> int:
+        return self._spilled
+
@@ -0,0 +1,136 @@
+import sqlite3
+import threading
+from collections import namedtuple
+from Snapshot import DatabaseCache, database_path
+
+"""
+Collection and term statistics of the body index, written by the Indexer next to the postings:
+
+    collection_statistics(name, value)   documentCount, totalLength, averageLength and a version counter
+    term_statistics(wordId, documentFrequency, collectionFrequency, maxTermFrequency)
+    document_lengths(urlId, length)      number of body words of every document
+
+Retrieval reads them through a per-process cache (one entry per database file and version, for the last
+generations), so the IDF inputs of a query term are a dictionary lookup instead of a pass over its posting list, and
+BM25 gets its document lengths without scanning the index. The posting lists decoded for the queries are cached with
+them, so a query only decodes the lists of its own words once per version.
+"""
+
+TermStatistics = namedtuple("TermStatistics", ["document_frequency", "collection_frequency", "max_term_frequency"])
+
+# term statistics looked up per "IN (...)" query
+IN_CHUNK_SIZE = 500
+
+
+class StatisticsBuilder:
+    """
+    Accumulates the statistics while the body postings are written, one term at a time.
+    """
+
+    def __init__(self):
+        self.term_rows = []
+        self.document_lengths = {}
+
+    def add_term(self, word_id: str, postings) -> None:
+        # postings: (url_id, frequency) pairs of the term
+        document_frequency = collection_frequency = max_term_frequency = 0
+        document_lengths = self.document_lengths
+        for (url_id, frequency) in postings:
+            document_frequency += 1
+            collection_frequency += frequency
+            if frequency > max_term_frequency:
+                max_term_frequency = frequency
+            document_lengths[url_id] = document_lengths.get(url_id, 0) + frequency
+        if document_frequency:
+            self.term_rows.append((word_id, document_frequency, collection_frequency, max_term_frequency))
+
+    def write(self, connection: sqlite3.Connection, document_count: int) -> None:
+        """
+        Replaces the statistics tables. `document_count` is the number of indexed documents (N), which also
+        counts documents without any body word.
+        """
+        cursor = connection.cursor()
+        version = read_collection_statistics(cursor).get("version", 0) + 1
+        total_length = sum(self.document_lengths.values())
+
+        cursor.execute("DROP TABLE IF EXISTS term_statistics;")
+        cursor.execute("CREATE TABLE term_statistics(wordId TEXT PRIMARY KEY, documentFrequency INTEGER, "
+                       "collectionFrequency INTEGER, maxTermFrequency INTEGER);")
+        cursor.executemany("INSERT INTO term_statistics VALUES(?, ?, ?, ?);", self.term_rows)
+
+        cursor.execute("DROP TABLE IF EXISTS document_lengths;")
+        cursor.execute("CREATE TABLE document_lengths(urlId TEXT PRIMARY KEY, length INTEGER);")
+        cursor.executemany("INSERT INTO document_lengths VALUES(?, ?);", self.document_lengths.items())
+
+        cursor.execute("DROP TABLE IF EXISTS collection_statistics;")
+        cursor.execute("CREATE TABLE collection_statistics(name TEXT PRIMARY KEY, value REAL);")
+        cursor.executemany("INSERT INTO collection_statistics VALUES(?, ?);", [
+            ("documentCount", document_count),
+            ("totalLength", total_length),
+            ("averageLength", total_length / document_count if document_count else 0),
+            ("version", version),
+        ])
+        connection.commit()
+
+
+def read_collection_statistics(cursor: sqlite3.Cursor) -> dict:
+    try:
+        return dict(cursor.execute("SELECT name, value FROM collection_statistics;").fetchall())
+    except sqlite3.OperationalError:
+        return {}
+
+
+class IndexStatistics:
+    """
+    In-memory view of the statistics tables of one version of a database. Term statistics are read on first use,
+    document lengths all at once when a scoring function needs them.
+    """
+
+    def __init__(self, document_count: int, total_length: int):
+        self.document_count = document_count
+        self.total_length = total_length
+        self.average_length = total_length / document_count if document_count else 0
+        self.terms: dict[str, TermStatistics | None] = {}
+        self.lengths = None
+        # posting lists decoded for the queries of this version (PostingList.PostingCache), set by Retrieval
+        self.postings = None
+
+    def term_statistics(self, cursor: sqlite3.Cursor, word_ids) -> dict[str, TermStatistics]:
+        missing = [word_id for word_id in set(word_ids) if word_id not in self.terms]
+        for start in range(0, len(missing), IN_CHUNK_SIZE):
+            chunk = missing[start:start + IN_CHUNK_SIZE]
+            for word_id in chunk:
+                # terms that are not in the body index are remembered as well
+                self.terms[word_id] = None
+            rows = cursor.execute("SELECT wordId, documentFrequency, collectionFrequency, maxTermFrequency FROM term_statistics "
+                                  f"WHERE wordId IN ({','.join('?' * len(chunk))});", chunk).fetchall()
+            for (word_id, *statistics) in rows:
+                self.terms[word_id] = TermStatistics(*statistics)
+        return {word_id: self.terms[word_id] for word_id in word_ids if self.terms[word_id] is not None}
+
+    def document_lengths(self, cursor: sqlite3.Cursor) -> dict[str, int]:
+        if self.lengths is None:
+            self.lengths = dict(cursor.execute("SELECT urlId, length FROM document_lengths;").fetchall())
+        return self.lengths
+
+
+# {database file: (version, IndexStatistics)}, older versions of a database are not needed anymore
+_statistics_cache = DatabaseCache()
+_statistics_lock = threading.Lock()
+
+
+def load_statistics(connection: sqlite3.Connection) -> IndexStatistics | None:
+    """
+    Returns the cached statistics of the database, or None if the Indexer did not write any.
+    """
+    collection = read_collection_statistics(connection.cursor())
+    if not collection:
+        return None
+    path = database_path(connection)
+    with _statistics_lock:
+        cached = _statistics_cache.get(path)
+        if cached is None or cached[0] != collection["version"] or path is None:
+            cached = (collection["version"], IndexStatistics(int(collection["documentCount"]), int(collection["totalLength"])))
+            if path is not None:
+                _statistics_cache.put(path, cached)
+        return cached[1]
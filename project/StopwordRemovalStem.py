@@ -1,27 +1,58 @@
-from nltk.stem import PorterStemmer
+import os
+from functools import cached_property
+from Snapshot import load_snapshot, save_snapshot, file_stamp
+
+# next to this module, so it is found whatever the current working directory is
+STOPWORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stopwords.txt')
 
 # removing stopwords and perform stemming
 class StopwordRemovalStem:
 
-    def __init__(self):
+    def __init__(self, stopwords_path: str = STOPWORDS_PATH):
+        self.stopwords_path = stopwords_path
+        # {word: stem}, the same few thousand words make up most of every page
+        self.stems = {}
+
+    @cached_property
+    def stemmer(self):
+        # importing nltk takes longer than everything else at startup, so it is only done on first use
+        from nltk.stem import PorterStemmer
+
         # use Porter's algorithm for stemming
-        self.stemmer = PorterStemmer()
+        return PorterStemmer()
 
-        # prepare the stopworddictionary
-        self.stopword_list: list[str] = []
-        with open('stopwords.txt') as f:
-            self.stopword_list = f.read().split('\n')
+    @cached_property
+    def stopword_list(self) -> frozenset[str]:
+        # prepare the stopword dictionary (from its binary snapshot if stopwords.txt did not change)
+        stamp = file_stamp(self.stopwords_path)
+        stopwords = load_snapshot(self.stopwords_path + '.snapshot', stamp)
+        if stopwords is None:
+            with open(self.stopwords_path) as f:
+                stopwords = frozenset(f.read().split('\n'))
+            save_snapshot(self.stopwords_path + '.snapshot', stamp, stopwords)
+        return stopwords
 
     def stemming(self, words: list[str]) -> list[str]:
-        return [self.stemmer.stem(w) for w in words]
+        stems = self.stems
+        stemmed = []
+        for w in words:
+            stem = stems.get(w)
+            if stem is None:
+                stem = stems[w] = self.stemmer.stem(w)
+            stemmed.append(stem)
+        return stemmed
 
     def stopwordRemoval(self, words: list[str]) -> list[str]:
         return [w for w in words if w.lower() not in self.stopword_list]
-    
+
+    def keptIndexes(self, words: list[str]) -> list[int]:
+        # indexes of the words kept by stopwordRemoval: the word at index position p is words[keptIndexes[p]]
+        return [i for (i, w) in enumerate(words) if w.lower() not in self.stopword_list]
+
     # first do stopword removal, and then  do stemming
     def transform(self, words: list[str]) -> list[str]:
-        
+
         noStopWordList = self.stopwordRemoval(words)
         transformedWordList = self.stemming(noStopWordList)
-        
-        return transformedWordList
\ No newline at end of file
+
+        return transformedWordList
@@ -0,0 +1,107 @@
+import random
+import socket
+import time
+import itertools
+import multiprocessing
+
+""" Synthetic corpora and a synthetic web site, used by the benchmarks """
+
+
+class SyntheticCorpus:
+    """
+    Deterministic corpus of `num_docs` pages whose words follow a Zipfian distribution over a random vocabulary.
+    Every page is generated on demand from (seed, doc_id), so the corpus never has to be held in memory.
+    Links also follow a Zipfian distribution over the pages, so a few pages collect most of the in-links.
+    """
+
+    def __init__(self, num_docs: int = 1000, vocabulary_size: int = 5000, mean_doc_length: int = 200,
+                 title_length: int = 4, links_per_page: int = 8, zipf_exponent: float = 1.0, seed: int = 4321):
+        self.num_docs = num_docs
+        self.mean_doc_length = mean_doc_length
+        self.title_length = title_length
+        self.links_per_page = links_per_page
+        self.seed = seed
+
+        rng = random.Random(seed)
+        self.vocabulary = self.make_vocabulary(vocabulary_size, rng)
+        self.word_cum_weights = self.zipf_cum_weights(vocabulary_size, zipf_exponent)
+
+        # the popularity rank of the pages is shuffled, so popular pages are not simply the first ones
+        self.page_by_popularity = list(range(num_docs))
+        rng.shuffle(self.page_by_popularity)
+        self.page_cum_weights = self.zipf_cum_weights(num_docs, zipf_exponent)
+
+    @staticmethod
+    def make_vocabulary(size: int, rng: random.Random) -> list[str]:
+        # alphabetic words only, so that they survive the tokenizer unchanged
+        vocabulary = set()
+        while len(vocabulary) < size:
+            length = rng.randint(3, 10)
+            vocabulary.add("".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=length)))
+        return sorted(vocabulary)
+
+    @staticmethod
+    def zipf_cum_weights(size: int, exponent: float) -> list[float]:
+        return list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, size + 1)))
+
+    def words(self, rng: random.Random, count: int) -> list[str]:
+        return rng.choices(self.vocabulary, cum_weights=self.word_cum_weights, k=count)
+
+    def document(self, doc_id: int) -> tuple[list[str], list[str], list[int]]:
+        """
+        Returns (title words, body words, linked doc IDs) of the given page.
+        """
+        rng = random.Random(f"{self.seed}-{doc_id}")
+        title_words = self.words(rng, self.title_length)
+        body_words = self.words(rng, max(1, int(rng.expovariate(1 / self.mean_doc_length))))
+        links = [self.page_by_popularity[i] for i in
+                 rng.choices(range(self.num_docs), cum_weights=self.page_cum_weights, k=self.links_per_page)]
+        return title_words, body_words, links
+
+    def page_path(self, doc_id: int) -> str:
+        return f"/page{doc_id}.htm"
+
+    def page_html(self, doc_id: int) -> str:
+        title_words, body_words, links = self.document(doc_id)
+        anchors = " ".join(f'<a href="{self.page_path(link)}">{link}</a>' for link in links)
+        return (f"<html><head><title>{' '.join(title_words)}</title></head>"
+                f"<body><p>{' '.join(body_words)}</p><p>{anchors}</p></body></html>")
+
+
+def _serve_site(corpus_kwargs: dict, port: int) -> None:
+    from aiohttp import web
+
+    corpus = SyntheticCorpus(**corpus_kwargs)
+
+    async def handle(request):
+        path = request.path
+        if not (path.startswith("/page") and path.endswith(".htm")):
+            raise web.HTTPNotFound()
+        doc_id = int(path[len("/page"):-len(".htm")])
+        if not 0 <= doc_id < corpus.num_docs:
+            raise web.HTTPNotFound()
+        return web.Response(text=corpus.page_html(doc_id), content_type="text/html",
+                            headers={"Last-Modified": "Tue, 16 May 2023 05:03:16 GMT"})
+
+    app = web.Application()
+    app.router.add_get("/{path:.*}", handle)
+    web.run_app(app, host="127.0.0.1", port=port, print=None)
+
+
+def start_synthetic_site(port: int = 8765, **corpus_kwargs) -> multiprocessing.Process:
+    """
+    Serves a SyntheticCorpus at http://127.0.0.1:<port>/page0.htm from a separate process.
+    The caller is responsible for terminating the returned process.
+    """
+    process = multiprocessing.Process(target=_serve_site, args=(corpus_kwargs, port), daemon=True)
+    process.start()
+
+    # wait until the server accepts connections
+    for _ in range(100):
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"synthetic site did not start on port {port}")
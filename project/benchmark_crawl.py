@@ -0,0 +1,152 @@
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+from array import array
+from Indexer import Indexer
+from Spider import Spider
+from ParallelSpider import ParallelSpider, remove_database
+from PriorityFrontier import get_frontier_policy
+from LinkGraph import build_csr
+from LinkAnalysis import pagerank
+from SyntheticCorpus import SyntheticCorpus, start_synthetic_site
+
+""" Crawl throughput benchmark against a synthetic web site served locally, and harvest quality of the frontier policies """
+
+
+def count_crawled_pages(db_path: str) -> int:
+    connection = sqlite3.connect(db_path)
+    count = connection.execute("SELECT COUNT(*) FROM id_to_page_title;").fetchone()[0]
+    connection.close()
+    return count
+
+
+def benchmark_parallel_crawl(start_url: str, max_pages: int, process_counts: list[int], db_dir: str) -> list[dict]:
+    results = []
+    for num_processes in process_counts:
+        db_path = os.path.join(db_dir, f"crawl_{num_processes}.db")
+        remove_database(db_path)
+
+        start_time = time.perf_counter()
+        ParallelSpider(start_url, max_pages, db_path, num_processes).crawl()
+        elapsed = time.perf_counter() - start_time
+
+        pages = count_crawled_pages(db_path)
+        results.append({"processes": num_processes, "pages": pages, "seconds": elapsed, "pages_per_second": pages / elapsed})
+    return results
+
+
+def site_page_ranks(corpus: SyntheticCorpus) -> list[float]:
+    # PageRank of every page over the link graph of the whole site, the value the crawl should harvest
+    sources = array("I")
+    targets = array("I")
+    for doc_id in range(corpus.num_docs):
+        for link in set(corpus.document(doc_id)[2]):
+            sources.append(doc_id)
+            targets.append(link)
+    offsets, targets = build_csr(corpus.num_docs, sources, targets)
+    return pagerank(offsets, targets)
+
+
+def reachable_pages(corpus: SyntheticCorpus, start: int = 0) -> set[int]:
+    reached = {start}
+    stack = [start]
+    while stack:
+        for link in corpus.document(stack.pop())[2]:
+            if link not in reached:
+                reached.add(link)
+                stack.append(link)
+    return reached
+
+
+def crawl_order(db_path: str) -> list[int]:
+    # pages are stored in the order they were crawled
+    connection = sqlite3.connect(db_path)
+    rows = connection.execute("SELECT url FROM id_to_page_title JOIN id_to_url USING (urlId) "
+                              "ORDER BY id_to_page_title.rowid;").fetchall()
+    connection.close()
+    return [int(url.rsplit("/page", 1)[1][:-len(".htm")]) for (url,) in rows]
+
+
+def harvest_quality(order: list[int], page_ranks: list[float], reachable: set[int], checkpoints: list[int]) -> dict:
+    """
+    PageRank of the first n crawled pages divided by that of the n best reachable pages, for every checkpoint n:
+    1.0 means the budget was spent on the most valuable pages.
+    """
+    best = sorted((page_ranks[doc_id] for doc_id in reachable), reverse=True)
+    quality = {}
+    for n in checkpoints:
+        if n <= len(order):
+            quality[n] = sum(page_ranks[doc_id] for doc_id in order[:n]) / sum(best[:n])
+    return quality
+
+
+def benchmark_frontier_policies(start_url: str, max_pages: int, policies: list[str], db_dir: str,
+                                corpus: SyntheticCorpus, checkpoints: list[int]) -> list[dict]:
+    page_ranks = site_page_ranks(corpus)
+    reachable = reachable_pages(corpus)
+    results = []
+    for policy in policies:
+        db_path = os.path.join(db_dir, f"crawl_{policy}.db")
+        remove_database(db_path)
+        db_connection = sqlite3.connect(db_path, check_same_thread=False)
+        db_connection.execute("PRAGMA journal_mode=WAL;")
+        spider = Spider(start_url, max_pages, db_connection, Indexer(db_connection),
+                        metrics_path=os.path.join(db_dir, f"metrics_{policy}.jsonl"),
+                        frontier_policy=get_frontier_policy(policy) if policy != "bfs" else None)
+
+        start_time = time.perf_counter()
+        spider.crawl()
+        elapsed = time.perf_counter() - start_time
+        db_connection.close()
+
+        order = crawl_order(db_path)
+        results.append({"policy": policy, "pages": len(order), "seconds": elapsed,
+                        "harvest": harvest_quality(order, page_ranks, reachable, checkpoints)})
+    return results
+
+
+def print_harvest(results: list[dict], checkpoints: list[int]) -> None:
+    print(f"{'policy':>8} {'pages':>6} {'seconds':>8}" + "".join(f"{'@' + str(n):>8}" for n in checkpoints))
+    for result in results:
+        print(f"{result['policy']:>8} {result['pages']:>6} {result['seconds']:>8.2f}" +
+              "".join(f"{result['harvest'][n]:>8.3f}" if n in result["harvest"] else f"{'-':>8}" for n in checkpoints))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure crawl throughput against a synthetic site.")
+    parser.add_argument("--pages", type=int, default=2000, help="number of pages of the synthetic site")
+    parser.add_argument("--max-pages", type=int, default=None, help="page budget of each crawl (default: all pages)")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--policies", nargs="+", default=None, choices=["bfs", "depth", "inlinks", "opic"],
+                        help="instead of the throughput, compare the harvest quality of these frontier policies")
+    args = parser.parse_args()
+
+    site = start_synthetic_site(args.port, num_docs=args.pages)
+    try:
+        with tempfile.TemporaryDirectory() as db_dir:
+            if args.policies:
+                max_pages = args.max_pages or args.pages // 5
+                checkpoints = [max(1, max_pages * share // 100) for share in (10, 25, 50, 100)]
+                results = benchmark_frontier_policies(f"http://127.0.0.1:{args.port}/page0.htm", max_pages,
+                                                      args.policies, db_dir, SyntheticCorpus(num_docs=args.pages),
+                                                      checkpoints)
+            else:
+                results = benchmark_parallel_crawl(f"http://127.0.0.1:{args.port}/page0.htm",
+                                                   args.max_pages or args.pages, args.processes, db_dir)
+    finally:
+        site.terminate()
+
+    if args.policies:
+        print("harvest quality: PageRank of the first n crawled pages / PageRank of the n best reachable pages")
+        print_harvest(results, checkpoints)
+        sys.exit(0)
+
+    baseline = results[0]["pages_per_second"]
+    print(f"{'processes':>10} {'pages':>8} {'seconds':>9} {'pages/s':>9} {'speedup':>8}")
+    for result in results:
+        print(f"{result['processes']:>10} {result['pages']:>8} {result['seconds']:>9.2f} "
+              f"{result['pages_per_second']:>9.1f} {result['pages_per_second'] / baseline:>8.2f}")
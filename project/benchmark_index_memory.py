@@ -0,0 +1,51 @@
+import sqlite3
+import argparse
+import tracemalloc
+from Indexer import decode_postings
+from PostingList import PostingStore, decode_posting_list
+
+""" Memory of the loaded inverted indexes: nested posting dicts vs compact PostingLists, measured with tracemalloc """
+
+
+def load_dict_index(cursor: sqlite3.Cursor, table: str) -> dict:
+    return {word_id: decode_postings(value) for (word_id, value) in cursor.execute(f"SELECT * FROM {table};")}
+
+
+def load_compact_index(cursor: sqlite3.Cursor, table: str, store: PostingStore) -> dict:
+    return {word_id: decode_posting_list(value, store) for (word_id, value) in cursor.execute(f"SELECT * FROM {table};")}
+
+
+def measure(load) -> tuple[int, object]:
+    tracemalloc.start()
+    index = load()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return memory, index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the memory of the dict and compact posting representations.")
+    parser.add_argument("--db", default="main.db")
+    args = parser.parse_args()
+
+    cursor = sqlite3.connect(args.db).cursor()
+    postings = sum(len(value.split(" ")) for (value,) in cursor.execute("SELECT value FROM body_inverted_index;"))
+    postings += sum(len(value.split(" ")) for (value,) in cursor.execute("SELECT value FROM title_inverted_index;"))
+
+    def load_dict():
+        return [load_dict_index(cursor, "body_inverted_index"), load_dict_index(cursor, "title_inverted_index")]
+
+    def load_compact():
+        store = PostingStore()
+        for (url_id,) in cursor.execute("SELECT urlId FROM forward_index ORDER BY rowid;").fetchall():
+            store.denseId(url_id)
+        return [load_compact_index(cursor, "body_inverted_index", store), load_compact_index(cursor, "title_inverted_index", store)]
+
+    dict_memory, _ = measure(load_dict)
+    compact_memory, _ = measure(load_compact)
+
+    print(f"postings: {postings}")
+    print(f"{'representation':>15} {'MiB':>9} {'bytes/posting':>14}")
+    for (name, memory) in (("dict", dict_memory), ("compact", compact_memory)):
+        print(f"{name:>15} {memory / 1024 / 1024:>9.2f} {memory / max(postings, 1):>14.1f}")
+    print(f"reduction: {dict_memory / max(compact_memory, 1):.1f}x")
@@ -0,0 +1,224 @@
+import os
+import sys
+import math
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import tracemalloc
+from asyncio import Queue
+from Indexer import Indexer
+from Spider import Spider
+from Retrieval import Retrieval
+from SyntheticCorpus import SyntheticCorpus
+
+"""
+Query-time benchmark and regression check of Retrieval over a synthetic corpus.
+The corpus is indexed through the same Spider/Indexer pipeline as a crawl (without the network), a query log
+of single-term, multi-term and phrase queries is replayed, and the latency, throughput, memory and rankings are
+compared with a stored baseline:
+
+    python benchmark_retrieval.py --update-baseline   # record the baseline
+    python benchmark_retrieval.py                     # exits with status 1 on a regression or a ranking change
+"""
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_retrieval_baseline.json")
+SITE_URL = "http://synthetic.test"
+
+
+class CorpusSpider(Spider):
+    """
+    Spider that indexes the pages of a SyntheticCorpus directly instead of fetching them.
+    """
+
+    def index_corpus(self, corpus: SyntheticCorpus, batch_size: int = 50) -> None:
+        url_queue = Queue()
+        batch = []
+        for doc_id in range(corpus.num_docs):
+            url = SITE_URL + corpus.page_path(doc_id)
+            response = type('Response', (), {'text': corpus.page_html(doc_id), 'headers': {'Date': 'Thu, 01 Jan 2026 00:00:00 GMT'}, 'url': url})
+            self.process_page(url, response, url_queue, batch)
+            if len(batch) >= batch_size:
+                self.flush_batch(batch)
+        # the last (partial) block of the document store, like the persister at the end of a crawl
+        self.documents.flush()
+        if batch:
+            self.flush_batch(batch)
+
+
+def build_corpus_db(db_path: str, corpus: SyntheticCorpus) -> None:
+    db_connection = sqlite3.connect(db_path, check_same_thread=False)
+    # the benchmark database is disposable
+    db_connection.execute("PRAGMA journal_mode=WAL;")
+    db_connection.execute("PRAGMA synchronous=OFF;")
+    indexer = Indexer(db_connection)
+    spider = CorpusSpider(SITE_URL + corpus.page_path(0), corpus.num_docs, db_connection, indexer)
+    spider.index_corpus(corpus)
+    db_connection.commit()
+    db_connection.close()
+
+
+def generate_query_log(corpus: SyntheticCorpus, num_queries: int, seed: int = 4321) -> list[str]:
+    """
+    Returns a deterministic mix of 50% single-term, 30% multi-term and 20% phrase queries.
+    Terms follow the Zipfian word distribution of the corpus; phrases are taken from actual page bodies.
+    """
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(num_queries):
+        kind = rng.random()
+        if kind < 0.5:
+            queries.append(corpus.words(rng, 1)[0])
+        elif kind < 0.8:
+            queries.append(" ".join(corpus.words(rng, rng.randint(2, 4))))
+        else:
+            _, body_words, _ = corpus.document(rng.randrange(corpus.num_docs))
+            start = rng.randrange(max(1, len(body_words) - 1))
+            queries.append('"' + " ".join(body_words[start:start + 2]) + '"')
+    return queries
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    # nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def ranking_signature(results: list[dict]) -> list[list]:
+    # ties are ordered by URL, so the signature does not depend on dict/set iteration order
+    return sorted(([result["url"], round(result["score"], 6)] for result in results), key=lambda item: (-item[1], item[0]))
+
+
+def run_benchmark(db_path: str, queries: list[str], max_results: int = 50) -> dict:
+    retrieval = Retrieval(db_path)
+
+    # warm-up, so the first query does not pay for the imports and the page cache
+    retrieval.retrieve(queries[0], max_results)
+
+    latencies = []
+    rankings = {}
+    start_time = time.perf_counter()
+    for query in queries:
+        query_start = time.perf_counter()
+        results = retrieval.retrieve(query, max_results)
+        latencies.append(time.perf_counter() - query_start)
+        rankings[query] = ranking_signature(results)
+    elapsed = time.perf_counter() - start_time
+
+    # memory is traced on a separate pass, tracemalloc slows every allocation down
+    tracemalloc.start()
+    for query in queries[:20]:
+        retrieval.retrieve(query, max_results)
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "queries": len(queries),
+        "latency_ms": {name: percentile(latencies, q) * 1000 for (name, q) in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "qps": len(queries) / elapsed,
+        "memory_mb": {"traced_peak": traced_peak / 1024 / 1024, "max_rss": max_rss_mb()},
+        "rankings": rankings,
+    }
+
+
+def max_rss_mb() -> float | None:
+    # the resource module only exists on Unix, there is no max RSS on Windows
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def compare_rankings(baseline_rankings: dict, rankings: dict, tolerance: float = 1e-6) -> list[str]:
+    """
+    Returns the queries whose ranked URLs or scores differ from the baseline.
+    """
+    changed = []
+    for (query, baseline_ranking) in baseline_rankings.items():
+        ranking = rankings.get(query)
+        if ranking is None:
+            continue
+        if [url for (url, _) in ranking] != [url for (url, _) in baseline_ranking] or \
+                any(abs(score - baseline_score) > tolerance for ((_, score), (_, baseline_score)) in zip(ranking, baseline_ranking)):
+            changed.append(query)
+    return changed
+
+
+def check_regression(baseline: dict, result: dict, threshold: float) -> list[str]:
+    """
+    Returns a message for every metric that got worse than the baseline by more than `threshold` (e.g. 0.2 = 20%).
+    """
+    failures = []
+    for name in ("p50", "p95", "p99"):
+        if result["latency_ms"][name] > baseline["latency_ms"][name] * (1 + threshold):
+            failures.append(f"{name} latency {result['latency_ms'][name]:.2f} ms > baseline {baseline['latency_ms'][name]:.2f} ms")
+    if result["qps"] < baseline["qps"] / (1 + threshold):
+        failures.append(f"throughput {result['qps']:.1f} QPS < baseline {baseline['qps']:.1f} QPS")
+    if result["memory_mb"]["traced_peak"] > baseline["memory_mb"]["traced_peak"] * (1 + threshold):
+        failures.append(f"peak memory {result['memory_mb']['traced_peak']:.2f} MB > baseline {baseline['memory_mb']['traced_peak']:.2f} MB")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Retrieval over a synthetic corpus and compare with a baseline.")
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--vocabulary", type=int, default=5000)
+    parser.add_argument("--doc-length", type=int, default=200, help="mean number of body words per page")
+    parser.add_argument("--zipf", type=float, default=1.0, help="Zipf exponent of the word distribution")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=4321)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    corpus = SyntheticCorpus(num_docs=args.docs, vocabulary_size=args.vocabulary, mean_doc_length=args.doc_length,
+                             links_per_page=8, zipf_exponent=args.zipf, seed=args.seed)
+    queries = generate_query_log(corpus, args.queries, args.seed)
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        db_path = os.path.join(db_dir, "benchmark.db")
+        start_time = time.perf_counter()
+        build_corpus_db(db_path, corpus)
+        print(f"Indexed {args.docs} documents in {time.perf_counter() - start_time:.2f} seconds")
+        result = run_benchmark(db_path, queries)
+
+    result["config"] = {"docs": args.docs, "vocabulary": args.vocabulary, "doc_length": args.doc_length,
+                        "zipf": args.zipf, "queries": args.queries, "seed": args.seed}
+    print(f"latency p50 {result['latency_ms']['p50']:.2f} ms, p95 {result['latency_ms']['p95']:.2f} ms, "
+          f"p99 {result['latency_ms']['p99']:.2f} ms")
+    print(f"throughput {result['qps']:.1f} QPS")
+    max_rss = result["memory_mb"]["max_rss"]
+    print(f"memory: traced peak {result['memory_mb']['traced_peak']:.2f} MB, "
+          f"max RSS {'n/a' if max_rss is None else f'{max_rss:.1f} MB'}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(result, f, indent=1)
+        print(f"Baseline written to {args.baseline}")
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --update-baseline first")
+        sys.exit(0)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("config") != result["config"]:
+        print("The baseline was recorded with a different configuration, only rankings of shared queries are compared")
+
+    failures = check_regression(baseline, result, args.threshold) if baseline.get("config") == result["config"] else []
+    changed = compare_rankings(baseline["rankings"], result["rankings"])
+    if changed:
+        failures.append(f"rankings changed for {len(changed)} queries, e.g. {changed[:3]}")
+
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+""" Cold-start benchmark: every scenario runs in a fresh interpreter, the median wall time of several runs is reported """
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCENARIOS = {
+    "django worker (import views)":
+        "import os, django; os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings'); django.setup(); import main.views",
+    "Retrieval() + first query":
+        "from Retrieval import Retrieval; Retrieval({db!r}).retrieve('computer science')",
+    "Retrieval().get_all_keywords()":
+        "from Retrieval import Retrieval; Retrieval({db!r}).get_all_keywords()",
+    "Indexer() + addNewWord":
+        "import sqlite3; from Indexer import Indexer; Indexer(sqlite3.connect({db!r})).addNewWord(['startup'])",
+}
+
+
+def remove_snapshots(db_path: str) -> None:
+    for path in (db_path + ".vocab.snapshot", os.path.join(PROJECT_DIR, "stopwords.txt.snapshot")):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def time_scenario(code: str, runs: int, db_path: str, use_snapshots: bool) -> float:
+    timings = []
+    for _ in range(runs):
+        if not use_snapshots:
+            remove_snapshots(db_path)
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=PROJECT_DIR, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start_time)
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the cold-start time of the web workers and CLI tools.")
+    parser.add_argument("--db", default="main.db")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    db_path = os.path.abspath(args.db)
+
+    baseline = time_scenario("pass", args.runs, db_path, True)
+    print(f"interpreter startup: {baseline * 1000:.0f} ms")
+    print(f"{'scenario':<34} {'no snapshot':>12} {'snapshot':>10}")
+    for (name, code) in SCENARIOS.items():
+        code = code.format(db=db_path)
+        without_snapshots = time_scenario(code, args.runs, db_path, False)
+        # one run to write the snapshots, then measure with them
+        time_scenario(code, 1, db_path, True)
+        with_snapshots = time_scenario(code, args.runs, db_path, True)
+        print(f"{name:<34} {without_snapshots * 1000:>9.0f} ms {with_snapshots * 1000:>7.0f} ms")
@@ -0,0 +1,50 @@
+import uuid
+import argparse
+import tracemalloc
+from asyncio import Queue
+from SeenUrlSet import SeenUrlSet
+from SpillingQueue import SpillingQueue
+
+""" Memory per URL of the crawler's seen-URL sets and frontier: Python sets/queues vs compact ones, measured with tracemalloc """
+
+
+def synthetic_urls(num_urls: int) -> list[str]:
+    return [f"https://www.example.com/section{i % 97}/page-{i}.html" for i in range(num_urls)]
+
+
+def measure(build) -> int:
+    tracemalloc.start()
+    structure = build()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del structure
+    return memory
+
+
+def fill_queue(queue, urls: list[str]):
+    parent_url_id = str(int(uuid.uuid5(uuid.NAMESPACE_URL, urls[0])))
+    for url in urls:
+        # a copy, so the URL is owned by the queue like a freshly extracted link
+        queue.put_nowait(("".join(url), parent_url_id))
+    return queue
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the memory per URL of the seen-URL sets and of the frontier.")
+    parser.add_argument("--urls", type=int, default=200000)
+    parser.add_argument("--frontier-memory", type=int, default=10000)
+    args = parser.parse_args()
+
+    urls = synthetic_urls(args.urls)
+    results = [
+        ("set of URLs", measure(lambda: {"".join(url) for url in urls})),
+        ("SeenUrlSet", measure(lambda: SeenUrlSet(urls))),
+        ("SeenUrlSet + Bloom", measure(lambda: SeenUrlSet(urls, expected_urls=len(urls), bloom_bits_per_url=10))),
+        ("asyncio.Queue", measure(lambda: fill_queue(Queue(), urls))),
+        ("SpillingQueue", measure(lambda: fill_queue(SpillingQueue(args.frontier_memory), urls))),
+    ]
+
+    print(f"URLs: {len(urls)}")
+    print(f"{'structure':>20} {'MiB':>9} {'bytes/URL':>10}")
+    for (name, memory) in results:
+        print(f"{name:>20} {memory / 1024 / 1024:>9.2f} {memory / len(urls):>10.1f}")
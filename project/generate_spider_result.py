@@ -1,76 +1,177 @@
+import re
+import csv
+import json
+import time
 import sqlite3
+import argparse
+from typing import Iterator
+from Generations import current_database
 
-""" NOTES """
-""" 
-- go through the format again if it matches with the example 
 """
+Exports every page of the index (title, URL, last modification date, size, the first keywords with their
+frequencies and the first child links) in the handout text format, as JSON lines or as CSV.
 
-def generate_spider_result(db_path: str, output_file: str):
-    connection = sqlite3.connect(db_path)
+The export runs a handful of set-based queries instead of several queries per page and per keyword:
+the keyword and child IDs of all pages are collected from one scan of forward_index/id_to_children_url_id,
+resolved through temporary tables joined with the dictionaries and the body inverted index, and the pages are then
+streamed from one joined query and written as they come.
+"""
+
+# "urlId;frequency;" at the start of every posting entry
+POSTING_HEAD = re.compile(r"(?:^| )([^; ]+);(\d+);")
+
+
+def first_ids(cursor: sqlite3.Cursor, query: str, limit: int) -> tuple[dict[str, list[str]], set[str]]:
+    # {urlId: first `limit` IDs of its space-separated value}, and the set of all those IDs
+    first = {}
+    all_ids = set()
+    for (url_id, value) in cursor.execute(query):
+        ids = value.split()[:limit] if value else []
+        first[url_id] = ids
+        all_ids.update(ids)
+    return first, all_ids
+
+
+def fill_temp_table(cursor: sqlite3.Cursor, table: str, ids: set[str]) -> None:
+    cursor.execute(f"DROP TABLE IF EXISTS temp.{table};")
+    cursor.execute(f"CREATE TEMP TABLE {table}(id TEXT PRIMARY KEY);")
+    cursor.executemany(f"INSERT INTO temp.{table} VALUES (?);", ((id,) for id in ids))
+
+
+def keyword_frequencies(cursor: sqlite3.Cursor, page_keywords: dict[str, list[str]]) -> dict[tuple[str, str], int]:
+    """
+    Returns {(urlId, wordId): body frequency} for the keywords of `page_keywords`.
+    Every needed posting list is read and scanned once, however many pages ask for the word.
+    """
+    pages_of_word = {}
+    for (url_id, word_ids) in page_keywords.items():
+        for word_id in word_ids:
+            pages_of_word.setdefault(word_id, set()).add(url_id)
+
+    fill_temp_table(cursor, "export_words", set(pages_of_word))
+    frequencies = {}
+    for (word_id, value) in cursor.execute(
+            "SELECT b.wordId, b.value FROM temp.export_words w JOIN body_inverted_index b ON b.wordId = w.id;"):
+        pages = pages_of_word[word_id]
+        for (url_id, frequency) in POSTING_HEAD.findall(value):
+            if url_id in pages:
+                frequencies[(url_id, word_id)] = int(frequency)
+    return frequencies
+
+
+def resolve_ids(cursor: sqlite3.Cursor, ids: set[str], table: str, key: str, column: str) -> dict[str, str]:
+    # {id: value} of `table` for the given ids, with one join instead of one query per id
+    fill_temp_table(cursor, "export_ids", ids)
+    return dict(cursor.execute(f"SELECT t.{key}, t.{column} FROM temp.export_ids i JOIN {table} t ON t.{key} = i.id;"))
+
+
+def page_records(connection: sqlite3.Connection, max_keywords: int = 10, max_children: int = 10) -> Iterator[dict]:
+    """
+    Yields one record per URL of id_to_url (in insertion order):
+    {"title", "url", "last_modification_date", "page_size", "keywords": [(word, frequency)], "children": [url]}
+    """
     cursor = connection.cursor()
 
-    with open(output_file, "w") as file:
-        # first fetch all crawled URLs
-        cursor.execute("SELECT urlId, url FROM id_to_url")
-        urls = cursor.fetchall()
-
-        for url_id, url in urls:
-            # fetch page title, last modification date, and page size
-            cursor.execute("SELECT pageTitle FROM id_to_page_title WHERE urlId = ?", (url_id,))
-            page_title_row = cursor.fetchone()
-            page_title = page_title_row[0] if page_title_row else ""
-
-            cursor.execute("SELECT lastModificationDate FROM id_to_last_modification_date WHERE urlId = ?", (url_id,))
-            last_mod_date_row = cursor.fetchone()
-            last_mod_date = last_mod_date_row[0] if last_mod_date_row else ""
-
-            cursor.execute("SELECT pageSize FROM id_to_page_size WHERE urlId = ?", (url_id,))
-            page_size_row = cursor.fetchone()
-            page_size = page_size_row[0] if page_size_row else ""
-
-            # fetch keywords and their frequencies (up to 10, as specified in the handout)
-            cursor.execute("SELECT value FROM forward_index WHERE urlId = ?", (url_id,))
-            word_ids_row = cursor.fetchone()
-            word_ids = word_ids_row[0].split()[:10] if word_ids_row else []
-
-            keywords = []
-            for word_id in word_ids:
-                cursor.execute("SELECT word FROM id_to_word WHERE wordId = ?", (word_id,))
-                word_row = cursor.fetchone()
-                word = word_row[0] if word_row else ""
-
-                cursor.execute("SELECT value FROM body_inverted_index WHERE wordId = ?", (word_id,))
-                body_data_row = cursor.fetchone()
-                body_data = body_data_row[0] if body_data_row else ""
-                for entry in body_data.split():
-                    entry_url_id, freq, _ = entry.split(";")
-                    if entry_url_id == url_id:
-                        keywords.append(f"{word} {freq}")
-                        break
-
-            # fetch child links (up to 10 again)
-            cursor.execute("SELECT childrenUrlId FROM id_to_children_url_id WHERE urlId = ?", (url_id,))
-            children_row = cursor.fetchone()
-            child_links = []
-            if children_row:
-                child_ids = children_row[0].split()[:10]
-                for child_id in child_ids:
-                    cursor.execute("SELECT url FROM id_to_url WHERE urlId = ?", (child_id,))
-                    child_url_row = cursor.fetchone()
-                    child_links.append(child_url_row[0] if child_url_row else "")
-
-            # write them all to file
-            file.write(f"{page_title}\n")
-            file.write(f"{url}\n")
-            file.write(f"{last_mod_date}, {page_size}\n")
-            file.write("; ".join(keywords) + "\n")
-            file.write("\n".join(child_links) + "\n")
-            file.write("-" * 30 + "\n")
-
-    connection.close()
+    # keywords: the first word IDs of the forward index, with their frequency from the body inverted index
+    # (words that only occur in the title have no body frequency and are left out)
+    page_keywords, word_ids = first_ids(cursor, "SELECT urlId, value FROM forward_index;", max_keywords)
+    frequencies = keyword_frequencies(cursor, page_keywords)
+    words = resolve_ids(cursor, word_ids, "id_to_word", "wordId", "word")
+
+    # child links: the first child IDs of every page, resolved to URLs in one go
+    page_children, child_ids = first_ids(cursor, "SELECT urlId, childrenUrlId FROM id_to_children_url_id;", max_children)
+    child_urls = resolve_ids(cursor, child_ids, "id_to_url", "urlId", "url")
+    del word_ids, child_ids
+
+    rows = cursor.execute("""
+        SELECT u.urlId, u.url, t.pageTitle, d.lastModificationDate, s.pageSize
+        FROM id_to_url u
+        LEFT JOIN id_to_page_title t ON t.urlId = u.urlId
+        LEFT JOIN id_to_last_modification_date d ON d.urlId = u.urlId
+        LEFT JOIN id_to_page_size s ON s.urlId = u.urlId
+        ORDER BY u.rowid;
+    """)
+    for (url_id, url, title, last_modification_date, page_size) in rows:
+        keywords = []
+        for word_id in page_keywords.get(url_id, ()):
+            frequency = frequencies.get((url_id, word_id))
+            if frequency is not None:
+                keywords.append((words.get(word_id, ""), frequency))
+
+        yield {
+            "title": title or "",
+            "url": url,
+            "last_modification_date": last_modification_date or "",
+            "page_size": page_size or "",
+            "keywords": keywords,
+            "children": [child_urls.get(child_id, "") for child_id in page_children.get(url_id, ())],
+        }
+
+
+def write_text(records: Iterator[dict], file) -> int:
+    # the format of the handout
+    count = 0
+    for record in records:
+        file.write(f"{record['title']}\n")
+        file.write(f"{record['url']}\n")
+        file.write(f"{record['last_modification_date']}, {record['page_size']}\n")
+        file.write("; ".join(f"{word} {frequency}" for (word, frequency) in record["keywords"]) + "\n")
+        file.write("\n".join(record["children"]) + "\n")
+        file.write("-" * 30 + "\n")
+        count += 1
+    return count
+
+
+def write_jsonl(records: Iterator[dict], file) -> int:
+    count = 0
+    for record in records:
+        record["keywords"] = [{"word": word, "frequency": frequency} for (word, frequency) in record["keywords"]]
+        file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+
+def write_csv(records: Iterator[dict], file) -> int:
+    # keywords as "word frequency; ..." and children separated by spaces, one row per page
+    writer = csv.writer(file)
+    writer.writerow(["title", "url", "last_modification_date", "page_size", "keywords", "children"])
+    count = 0
+    for record in records:
+        writer.writerow([record["title"], record["url"], record["last_modification_date"], record["page_size"],
+                         "; ".join(f"{word} {frequency}" for (word, frequency) in record["keywords"]),
+                         " ".join(record["children"])])
+        count += 1
+    return count
+
+
+WRITERS = {"text": write_text, "jsonl": write_jsonl, "csv": write_csv}
+
+
+def generate_spider_result(db_path: str, output_file: str, output_format: str = "text",
+                           max_keywords: int = 10, max_children: int = 10) -> int:
+    """
+    Writes the export of `db_path` to `output_file` and returns the number of pages written.
+    """
+    # the published generation of the database, see Generations.py
+    connection = sqlite3.connect(current_database(db_path))
+    try:
+        # newline="" lets the csv module write its own line endings
+        with open(output_file, "w", encoding="utf-8", newline="" if output_format == "csv" else None) as file:
+            return WRITERS[output_format](page_records(connection, max_keywords, max_children), file)
+    finally:
+        connection.close()
+
 
 if __name__ == "__main__":
-    db_path = "main.db"
-    output_file = "spider_result.txt"
-    generate_spider_result(db_path, output_file)
-    print(f"Spider result written to {output_file}")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Export the crawled pages of the index.")
+    parser.add_argument("--db", default="main.db")
+    parser.add_argument("--output", default=None, help="defaults to spider_result.txt/.jsonl/.csv")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="text")
+    parser.add_argument("--max-keywords", type=int, default=10)
+    parser.add_argument("--max-children", type=int, default=10)
+    args = parser.parse_args()
+
+    output_file = args.output or "spider_result." + {"text": "txt"}.get(args.format, args.format)
+    start_time = time.perf_counter()
+    pages = generate_spider_result(args.db, output_file, args.format, args.max_keywords, args.max_children)
+    print(f"Spider result of {pages} pages written to {output_file} in {time.perf_counter() - start_time:.2f} seconds")
@@ -1,3 +1,915 @@
-from django.test import TestCase
+import io
+import os
+import copy
+import math
+import random
+import time
+import asyncio
+import sqlite3
+import tempfile
+from array import array
+from functools import partial
+from django.test import SimpleTestCase
+from Scoring import CollectionStatistics, BM25Scoring, TfIdfScoring, get_scoring
+from PostingList import PostingStore, PostingList
+from QueryParser import Term, Phrase, And, Or, Not, QuerySyntaxError, parse_query, has_operators
+from BooleanQuery import BooleanEvaluator
+from Retrieval import Retrieval
+from DocumentStore import DocumentStore
+from Persister import Persister
+from SeenUrlSet import RECENT_SIZE, SeenUrlSet
+import LinkGraph
+from LinkAnalysis import analyze_links, hits, pagerank
+import Generations
+from PriorityFrontier import PriorityFrontier, get_frontier_policy
+from SpillingQueue import SPILL_CHUNK_SIZE, SpillingQueue
+from KGramIndex import KGramIndex, bounded_levenshtein, default_max_distance
+from Snapshot import DatabaseCache
+from SimilarPages import BANDS, NUM_HASHES, SimilarityIndex, SimilarPages, band_buckets, signature
+from reindex import reindex
+from BatchRetrieval import read_queries, run_batch, write_trec_run
+from SyntheticCorpus import SyntheticCorpus
+from ExternalSortIndexer import ExternalSortIndexer
+from SegmentedIndex import SegmentedIndexer, load_segmented_index
+from ShardedIndex import ShardedIndexer, load_shard_paths, merge_term_statistics, shard_term_statistics
+from benchmark_retrieval import (SITE_URL, CorpusSpider, build_corpus_db, generate_query_log, run_benchmark,
+                                 compare_rankings, check_regression, percentile, ranking_signature)
 
 # Create your tests here.
+
+
+class RetrievalBenchmarkTests(SimpleTestCase):
+    """
+    Small version of benchmark_retrieval.py: a synthetic corpus indexed through Spider/Indexer and a replayed query log.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.db_dir = tempfile.TemporaryDirectory()
+        cls.db_path = os.path.join(cls.db_dir.name, "benchmark.db")
+        cls.corpus = SyntheticCorpus(num_docs=40, vocabulary_size=300, mean_doc_length=40, seed=7)
+        build_corpus_db(cls.db_path, cls.corpus)
+        cls.queries = generate_query_log(cls.corpus, 20, seed=7)
+        cls.result = run_benchmark(cls.db_path, cls.queries)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db_dir.cleanup()
+        super().tearDownClass()
+
+    def test_query_log_is_deterministic_and_mixed(self):
+        self.assertEqual(self.queries, generate_query_log(self.corpus, 20, seed=7))
+        self.assertTrue(any(query.startswith('"') for query in self.queries))
+        self.assertTrue(any(" " in query and not query.startswith('"') for query in self.queries))
+        self.assertTrue(any(" " not in query for query in self.queries))
+
+    def test_report_contains_latency_throughput_and_memory(self):
+        latency = self.result["latency_ms"]
+        self.assertTrue(0 < latency["p50"] <= latency["p95"] <= latency["p99"])
+        self.assertGreater(self.result["qps"], 0)
+        self.assertGreater(self.result["memory_mb"]["traced_peak"], 0)
+        self.assertEqual(set(self.result["rankings"]), set(self.queries))
+
+    def test_rankings_are_reproducible(self):
+        self.assertTrue(any(self.result["rankings"].values()))
+        rerun = run_benchmark(self.db_path, self.queries)
+        self.assertEqual(compare_rankings(self.result["rankings"], rerun["rankings"]), [])
+
+    def test_changed_ranking_is_detected(self):
+        query = next(query for (query, ranking) in self.result["rankings"].items() if len(ranking) > 1)
+        changed = copy.deepcopy(self.result["rankings"])
+        changed[query][0][1] += 0.5
+        self.assertEqual(compare_rankings(self.result["rankings"], changed), [query])
+
+        changed = copy.deepcopy(self.result["rankings"])
+        changed[query].reverse()
+        self.assertEqual(compare_rankings(self.result["rankings"], changed), [query])
+
+    def test_regression_past_threshold_fails(self):
+        self.assertEqual(check_regression(self.result, self.result, 0.2), [])
+
+        slower = copy.deepcopy(self.result)
+        slower["latency_ms"]["p95"] *= 1.5
+        slower["qps"] /= 1.5
+        failures = check_regression(self.result, slower, 0.2)
+        self.assertEqual(len(failures), 2)
+
+        slightly_slower = copy.deepcopy(self.result)
+        slightly_slower["latency_ms"]["p95"] *= 1.1
+        self.assertEqual(check_regression(self.result, slightly_slower, 0.2), [])
+
+    def test_queries_decode_only_their_posting_lists(self):
+        # a copy, so the lists decoded by the other tests of this process are not in its cache
+        copy_path = os.path.join(self.db_dir.name, "lazy.db")
+        source = sqlite3.connect(self.db_path)
+        target = sqlite3.connect(copy_path)
+        source.backup(target)
+        (indexed_words,) = target.execute("SELECT COUNT(*) FROM body_inverted_index;").fetchone()
+        target.close()
+        source.close()
+
+        for (number, query) in enumerate(self.queries[:10]):
+            for max_results in (1, 50):
+                retrieval = Retrieval(copy_path)
+                results = retrieval.retrieve(query, max_results)
+                if number == 0 and max_results == 1:
+                    # the lists of the query words and of the words of the one result
+                    self.assertLess(len(retrieval.statistics.postings.body), indexed_words)
+                # the whole index, with the statistics derived from the postings
+                full = Retrieval(copy_path)
+                full.statistics = None
+                expected = full.retrieve(query, max_results)
+                self.assertEqual([(result["doc_id"], result["keywords_frequencies"]) for result in results],
+                                 [(result["doc_id"], result["keywords_frequencies"]) for result in expected], query)
+                for (result, expected_result) in zip(results, expected):
+                    self.assertAlmostEqual(result["score"], expected_result["score"])
+        self.assertIs(Retrieval(copy_path).statistics.postings, retrieval.statistics.postings)
+
+    def test_plan_costs_come_from_the_statistics(self):
+        connection = sqlite3.connect(self.db_path)
+        document_frequencies = dict(connection.execute("SELECT wordId, documentFrequency FROM term_statistics;").fetchall())
+        connection.close()
+        retrieval = Retrieval(self.db_path)
+        phrases = 0
+        for query in [query for query in self.queries if query.startswith('"')][:5]:
+            retrieval.retrieve(query)
+            phrases += sum(step.operation == "phrase" for step in retrieval.plan.steps)
+            title_index = retrieval.statistics.postings.title
+            title_count = lambda word_id: len(title_index.get(word_id, ()))
+            for step in retrieval.plan.steps:
+                word_ids = step.detail if step.operation == "phrase" else [step.detail]
+                self.assertEqual(step.estimated_cost, min(document_frequencies.get(word_id, 0) for word_id in word_ids) +
+                                 min(title_count(word_id) for word_id in word_ids))
+        self.assertGreater(phrases, 0)
+
+    def test_reindex_from_the_document_store_gives_the_same_rankings(self):
+        source = sqlite3.connect(self.db_path)
+        self.assertTrue(DocumentStore(source).block_ids())
+        copy_path = os.path.join(self.db_dir.name, "reindexed.db")
+        target = sqlite3.connect(copy_path)
+        source.backup(target)
+        target.close()
+        source.close()
+
+        self.assertEqual(reindex(copy_path), self.corpus.num_docs)
+        rerun = run_benchmark(copy_path, self.queries)
+        self.assertEqual(compare_rankings(self.result["rankings"], rerun["rankings"]), [])
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+
+class ScoringTests(SimpleTestCase):
+    collection = CollectionStatistics(document_count=1000, average_length=100)
+
+    def test_bm25_matches_the_okapi_formula(self):
+        k1, b = 1.2, 0.75
+        weight = BM25Scoring(k1, b).term_weight(50, 7, self.collection)
+        for (tf, length) in ((1, 100), (3, 40), (10, 400)):
+            idf = math.log(1 + (1000 - 50 + 0.5) / (50 + 0.5))
+            expected = idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / 100))
+            self.assertAlmostEqual(weight(tf, length), expected)
+
+    def test_bm25_saturates_and_normalizes_length(self):
+        weight = BM25Scoring().term_weight(50, 7, self.collection)
+        self.assertLess(weight(1, 100), weight(2, 100))
+        # the gain of one more occurrence shrinks, and the weight stays below idf * (k1 + 1)
+        self.assertLess(weight(20, 100) - weight(19, 100), weight(2, 100) - weight(1, 100))
+        self.assertLess(weight(1000, 100), math.log(1 + 950.5 / 50.5) * 2.2)
+        self.assertGreater(weight(3, 50), weight(3, 200))
+        # a term in every document still has a non-negative weight
+        self.assertGreaterEqual(BM25Scoring().term_weight(1000, 7, self.collection)(3, 100), 0)
+
+    def test_tfidf_weight_and_unknown_scoring(self):
+        weight = TfIdfScoring().term_weight(10, 4, self.collection)
+        self.assertAlmostEqual(weight(2, 100), 2 / 4 * math.log2(100))
+        self.assertEqual(TfIdfScoring().term_weight(0, 4, self.collection)(2, 100), 0)
+        self.assertIsInstance(get_scoring("bm25"), BM25Scoring)
+        with self.assertRaises(ValueError):
+            get_scoring("pagerank")
+
+
+class BooleanQueryTests(SimpleTestCase):
+    """
+    The boolean evaluator against plain set operations over a random index.
+    """
+    words = ["w0", "w1", "w2", "w3", "w4", "w5"]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = random.Random(11)
+        cls.store = PostingStore()
+        cls.body = {}
+        cls.title = {}
+        # {(index, url_id): list of words by position}
+        cls.texts = {}
+        for doc in range(60):
+            url_id = str(doc)
+            cls.store.denseId(url_id)
+            for (name, index, length) in (("body", cls.body, 12), ("title", cls.title, 3)):
+                text = [rng.choice(cls.words) for _ in range(rng.randint(0, length))]
+                cls.texts[(name, url_id)] = text
+                for word in set(text):
+                    index.setdefault(word, PostingList(cls.store)).append(
+                        url_id, [position for (position, other) in enumerate(text) if other == word])
+        # phrase_in_postings only reads the indexes it is given
+        cls.evaluator = BooleanEvaluator(cls.body, cls.title, cls.store, partial(Retrieval.phrase_in_postings, None))
+
+    def matches(self, tree) -> set:
+        url_ids = set(self.store.url_ids)
+        if isinstance(tree, (Term, Phrase)):
+            words = [tree.text] if isinstance(tree, Term) else list(tree.text)
+            names = ("title",) if tree.field == "title" else ("body", "title")
+            return set().union(*(self.phrase_matches(name, words) for name in names))
+        if isinstance(tree, Not):
+            return url_ids - self.matches(tree.item)
+        sets = [self.matches(item) for item in tree.items]
+        return set.intersection(*sets) if isinstance(tree, And) else set.union(*sets)
+
+    def phrase_matches(self, name, words) -> set:
+        return {url_id for url_id in self.store.url_ids
+                if any(self.texts[(name, url_id)][start:start + len(words)] == words
+                       for start in range(len(self.texts[(name, url_id)])))}
+
+    def random_tree(self, rng, depth=0):
+        choice = rng.random()
+        if depth >= 3 or choice < 0.3:
+            field = "title" if rng.random() < 0.2 else None
+            if rng.random() < 0.3:
+                return Phrase(tuple(rng.choice(self.words) for _ in range(2)), field)
+            return Term(rng.choice(self.words), field)
+        if choice < 0.4:
+            return Not(self.random_tree(rng, depth + 1))
+        items = tuple(self.random_tree(rng, depth + 1) for _ in range(rng.randint(2, 3)))
+        return And(items) if choice < 0.75 else Or(items)
+
+    def test_random_trees_match_set_semantics(self):
+        rng = random.Random(5)
+        url_ids = self.store.url_ids
+        for _ in range(300):
+            tree = self.random_tree(rng)
+            result = self.evaluator.evaluate(tree)
+            self.assertEqual(list(result), sorted(result))
+            self.assertEqual({url_ids[dense_id] for dense_id in result}, self.matches(tree), tree)
+
+    def test_phrase_candidates_restrict_the_matches(self):
+        phrase = ["w0", "w1"]
+        everything = Retrieval.phrase_in_postings(None, phrase, self.body)
+        self.assertEqual(everything, self.phrase_matches("body", phrase))
+        self.assertTrue(everything)
+        candidates = set(self.store.url_ids[::2])
+        self.assertEqual(Retrieval.phrase_in_postings(None, phrase, self.body, candidates), everything & candidates)
+        self.assertEqual(Retrieval.phrase_in_postings(None, ["w0", "missing"], self.body), set())
+
+    def test_parser_precedence(self):
+        self.assertEqual(parse_query("a OR b AND c"), Or((Term("a", None), And((Term("b", None), Term("c", None))))))
+        self.assertEqual(parse_query("a NOT b c"), Or((And((Term("a", None), Not(Term("b", None)))), Term("c", None))))
+        self.assertEqual(parse_query('title:(x OR "y z") AND NOT w'),
+                         And((Or((Term("x", "title"), Phrase("y z", "title"))), Not(Term("w", None)))))
+        self.assertTrue(has_operators("a AND b"))
+        self.assertFalse(has_operators("a and b"))
+        for query in ("a AND", "(a OR b", "a)", "NOT"):
+            with self.assertRaises(QuerySyntaxError):
+                parse_query(query)
+
+
+class SimilarPagesTests(SimpleTestCase):
+    def test_buckets_are_stable_digests(self):
+        # stored in lsh_buckets, so they must not change between Python versions or processes
+        buckets = band_buckets(array("Q", range(NUM_HASHES)))
+        self.assertEqual(len(buckets), BANDS)
+        self.assertEqual(buckets[:2], [2141542520064864664, -75611421827131023])
+        self.assertTrue(all(-2 ** 63 <= bucket < 2 ** 63 for bucket in buckets))
+
+    def test_minhash_estimates_jaccard_similarity(self):
+        first = [str(word_id) for word_id in range(0, 300)]
+        second = [str(word_id) for word_id in range(100, 400)]
+        # Jaccard similarity 200 / 400
+        agreement = sum(a == b for (a, b) in zip(signature(first, {}), signature(second, {}))) / NUM_HASHES
+        self.assertAlmostEqual(agreement, 0.5, delta=0.2)
+        self.assertEqual(signature(first, {}), signature(list(reversed(first)) + first[:10], {}))
+
+    def test_candidates_share_a_band(self):
+        connection = sqlite3.connect(":memory:")
+        pages = {"near": [str(word_id) for word_id in range(100)],
+                 "duplicate": [str(word_id) for word_id in range(98)] + ["1000", "1001"],
+                 "other": [str(word_id) for word_id in range(5000, 5100)]}
+        index = SimilarityIndex(connection)
+        index.update(pages.items())
+        similar = SimilarPages([connection])
+        minhashes = similar.find_signature("near")
+        self.assertEqual(minhashes, signature(pages["near"], {}))
+        self.assertEqual(similar.candidates(minhashes, "near"), ["duplicate"])
+
+        index.remove("duplicate")
+        self.assertEqual(similar.candidates(minhashes, "near"), [])
+
+
+def levenshtein(a: str, b: str) -> int:
+    previous = list(range(len(b) + 1))
+    for (i, char_a) in enumerate(a, 1):
+        current = [i]
+        for (j, char_b) in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+class ExternalSortIndexerTests(SimpleTestCase):
+    INDEX_TABLES = ("body_inverted_index", "title_inverted_index", "forward_index", "word_to_id", "id_to_word",
+                    "term_statistics", "document_lengths", "minhash_signatures", "lsh_buckets")
+
+    def table_rows(self, db_path: str) -> dict:
+        connection = sqlite3.connect(db_path)
+        rows = {table: sorted(connection.execute(f"SELECT * FROM {table};").fetchall()) for table in self.INDEX_TABLES}
+        # the Indexer writes its statistics after every batch, so only the version counter differs
+        rows["collection_statistics"] = sorted(connection.execute(
+            "SELECT * FROM collection_statistics WHERE name != 'version';").fetchall())
+        connection.close()
+        return rows
+
+    def test_many_runs_write_the_same_index_as_the_indexer(self):
+        corpus = SyntheticCorpus(num_docs=30, vocabulary_size=300, mean_doc_length=40, seed=13)
+        with tempfile.TemporaryDirectory() as directory:
+            plain_path = os.path.join(directory, "plain.db")
+            build_corpus_db(plain_path, corpus)
+
+            # word IDs are random, so both indexes use the vocabulary of the first one
+            external_path = os.path.join(directory, "external.db")
+            connection = sqlite3.connect(external_path, check_same_thread=False)
+            connection.execute("ATTACH DATABASE ? AS plain;", (plain_path,))
+            for table in ("word_to_id", "id_to_word"):
+                connection.execute(f"CREATE TABLE {table} AS SELECT * FROM plain.{table};")
+            connection.commit()
+            connection.execute("DETACH DATABASE plain;")
+            # a few hundred bytes: a run is spilled after the body and again after the title of every page
+            indexer = ExternalSortIndexer(connection, memory_budget_mb=0.0001, temp_dir=directory)
+            CorpusSpider(SITE_URL + corpus.page_path(0), corpus.num_docs, connection, indexer).index_corpus(corpus, batch_size=7)
+            self.assertGreaterEqual(indexer.run_count, 2 * corpus.num_docs)
+            # pages whose forward index rows are spread over several runs, combined by mergedForwardRows
+            run_counts = {}
+            for run_id in range(indexer.run_count):
+                for (_, url_id, _) in indexer.readForwardRun(indexer.runPath(run_id, "forward")):
+                    run_counts[url_id] = run_counts.get(url_id, 0) + 1
+            self.assertEqual(len(run_counts), corpus.num_docs)
+            self.assertGreater(sum(count > 1 for count in run_counts.values()), corpus.num_docs // 2)
+            indexer.finalize()
+            connection.close()
+            self.assertFalse([name for name in os.listdir(directory) if name.startswith("index-runs-")])
+
+            expected = self.table_rows(plain_path)
+            rows = self.table_rows(external_path)
+            for table in expected:
+                self.assertTrue(expected[table], table)
+                self.assertEqual(rows[table], expected[table], table)
+
+
+class ShardedIndexTests(SimpleTestCase):
+    """
+    The same corpus indexed into one database and into 3 shards: global statistics and rankings must not change.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.db_dir = tempfile.TemporaryDirectory()
+        cls.corpus = SyntheticCorpus(num_docs=40, vocabulary_size=300, mean_doc_length=40, seed=11)
+        cls.plain_path = os.path.join(cls.db_dir.name, "plain.db")
+        build_corpus_db(cls.plain_path, cls.corpus)
+
+        cls.sharded_path = os.path.join(cls.db_dir.name, "sharded.db")
+        connection = sqlite3.connect(cls.sharded_path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL;")
+        indexer = ShardedIndexer(connection, cls.sharded_path, 3)
+        CorpusSpider(SITE_URL + cls.corpus.page_path(0), cls.corpus.num_docs, connection, indexer).index_corpus(cls.corpus)
+        connection.commit()
+        connection.close()
+        cls.queries = generate_query_log(cls.corpus, 30, seed=11)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db_dir.cleanup()
+        super().tearDownClass()
+
+    def test_merged_statistics_equal_the_unsharded_ones(self):
+        plain = sqlite3.connect(self.plain_path)
+        expected = {word: (document_frequency, max_term_frequency) for (word, document_frequency, max_term_frequency) in
+                    plain.execute("SELECT word, documentFrequency, maxTermFrequency FROM term_statistics "
+                                  "JOIN id_to_word USING (wordId);").fetchall()}
+        (document_count, average_length) = [value for (name, value) in plain.execute(
+            "SELECT name, value FROM collection_statistics WHERE name IN ('documentCount', 'averageLength') ORDER BY name DESC;")]
+        plain.close()
+
+        sharded = sqlite3.connect(self.sharded_path)
+        words = dict(sharded.execute("SELECT wordId, word FROM id_to_word;").fetchall())
+        shard_paths = load_shard_paths(sharded.cursor(), self.sharded_path)
+        sharded.close()
+        self.assertEqual(len(shard_paths), 3)
+        term_statistics, collection = merge_term_statistics([shard_term_statistics(path, list(words)) for path in shard_paths])
+        self.assertEqual({words[word_id]: statistics for (word_id, statistics) in term_statistics.items()}, expected)
+        self.assertEqual(collection.document_count, document_count)
+        self.assertAlmostEqual(collection.average_length, average_length)
+
+    def test_shards_rank_like_the_unsharded_index(self):
+        for scoring in ("tfidf", "bm25"):
+            for max_results in (50, 5):
+                for query in self.queries:
+                    expected = ranking_signature(Retrieval(self.plain_path, scoring=scoring).retrieve(query, max_results))
+                    ranking = ranking_signature(Retrieval(self.sharded_path, scoring=scoring).retrieve(query, max_results))
+                    self.assertEqual([score for (_, score) in ranking], [score for (_, score) in expected], query)
+                    if len(expected) == max_results:
+                        # the pages tied with the last one may be cut off differently
+                        ranking = [item for item in ranking if item[1] != expected[-1][1]]
+                        expected = [item for item in expected if item[1] != expected[-1][1]]
+                    self.assertEqual(ranking, expected, query)
+
+
+class BatchRetrievalTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.db_dir = tempfile.TemporaryDirectory()
+        cls.db_path = os.path.join(cls.db_dir.name, "corpus.db")
+        cls.corpus = SyntheticCorpus(num_docs=40, vocabulary_size=300, mean_doc_length=40, seed=17)
+        build_corpus_db(cls.db_path, cls.corpus)
+
+        rng = random.Random(17)
+        queries = generate_query_log(cls.corpus, 30, seed=17)
+        for _ in range(6):
+            (a, b) = cls.corpus.words(rng, 2)
+            queries += [f"{a} AND {b}", f"{a} OR {b}", f"{a} NOT {b}"]
+        cls.queries_path = os.path.join(cls.db_dir.name, "queries.txt")
+        with open(cls.queries_path, "w", encoding="utf-8") as f:
+            f.writelines(f"q{number}\t{query}\n" for (number, query) in enumerate(queries))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db_dir.cleanup()
+        super().tearDownClass()
+
+    def trec_run(self, queries, max_results: int, workers: int, scoring: str) -> dict:
+        output = io.StringIO()
+        write_trec_run(run_batch(self.db_path, queries, max_results, workers, chunk_size=7, scoring=scoring), output)
+        run = {qid: [] for (qid, _) in queries}
+        for line in output.getvalue().splitlines():
+            (qid, _, url, rank, score, _) = line.split(" ")
+            self.assertEqual(int(rank), len(run[qid]) + 1)
+            run[qid].append((url, round(float(score), 6)))
+        return run
+
+    def test_run_scores_equal_retrieve(self):
+        queries = read_queries(self.queries_path)
+        self.assertEqual(len(queries), 48)
+        for scoring in ("tfidf", "bm25"):
+            for (max_results, workers) in ((1000, 1), (1000, 2), (5, 2)):
+                run = self.trec_run(queries, max_results, workers, scoring)
+                for (qid, query) in queries:
+                    expected = ranking_signature(Retrieval(self.db_path, scoring=scoring).retrieve(query, max_results))
+                    scores = [score for (_, score) in run[qid]]
+                    self.assertEqual(scores, sorted(scores, reverse=True), query)
+                    ranking = sorted(run[qid], key=lambda item: (-item[1], item[0]))
+                    self.assertEqual([score for (_, score) in ranking], [score for (_, score) in expected], query)
+                    if len(expected) == max_results:
+                        # the pages tied with the last one may be cut off differently
+                        ranking = [item for item in ranking if item[1] != expected[-1][1]]
+                        expected = [item for item in expected if item[1] != expected[-1][1]]
+                    self.assertEqual(ranking, [tuple(item) for item in expected], query)
+                self.assertGreater(sum(len(ranking) > 1 for ranking in run.values()), len(queries) // 2)
+
+
+class SegmentedIndexTests(SimpleTestCase):
+    """
+    A corpus indexed as segments, with one page indexed again in a later segment.
+    """
+
+    def setUp(self):
+        self.db_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.db_dir.name, "segmented.db")
+        self.corpus = SyntheticCorpus(num_docs=12, vocabulary_size=200, mean_doc_length=30, seed=5)
+        self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        # no merges until the test asks for them
+        self.indexer = SegmentedIndexer(self.connection, self.db_path, merge_factor=len(self.corpus.vocabulary))
+        self.spider = CorpusSpider(SITE_URL + self.corpus.page_path(0), self.corpus.num_docs, self.connection, self.indexer)
+        self.spider.index_corpus(self.corpus, batch_size=4)
+
+    def tearDown(self):
+        self.indexer.merger.stop()
+        self.connection.close()
+        self.db_dir.cleanup()
+
+    def reindex_page(self, doc_id: int, html: str) -> str:
+        url = SITE_URL + self.corpus.page_path(doc_id)
+        response = type('Response', (), {'text': html, 'headers': {'Date': 'Fri, 02 Jan 2026 00:00:00 GMT'}, 'url': url})
+        batch = []
+        self.spider.process_page(url, response, asyncio.Queue(), batch)
+        self.spider.flush_batch(batch)
+        return self.spider.new_url_id(url)
+
+    def merge(self, merge_factor: int) -> None:
+        self.indexer.merger.merge_factor = merge_factor
+        self.indexer.merger.requestMerge()
+        self.indexer.merger.waitUntilIdle()
+
+    def live_words(self, url_id: str) -> set[str]:
+        words = {word_id: word for (word, word_id) in self.indexer.word_to_id.items()}
+        return {words[word_id] for (word_id, postings) in load_segmented_index(self.connection, "body").items()
+                if url_id in postings}
+
+    def ranking(self, query: str) -> list[tuple]:
+        return sorted((result["url"], round(result["score"], 6)) for result in Retrieval(self.db_path).retrieve(query))
+
+    def test_reindexed_page_is_hidden_before_and_after_merges(self):
+        # one level-0 segment per flushed batch
+        self.assertEqual(self.connection.execute("SELECT level, docCount FROM segments ORDER BY segmentId;").fetchall(),
+                         [(0, 4), (0, 4), (0, 4)])
+
+        url = SITE_URL + self.corpus.page_path(3)
+        old_queries = sorted(set(self.corpus.document(3)[1]))[:5]
+        for query in old_queries:
+            self.assertIn(url, dict(self.ranking(query)), query)
+        url_id = self.reindex_page(3, "<html><head><title>replacement</title></head>"
+                                      "<body><p>replacementpage content</p></body></html>")
+        (tombstone,) = self.connection.execute("SELECT segmentId FROM deleted_documents WHERE urlId = ?;", (url_id,)).fetchone()
+        self.assertEqual(tombstone, self.connection.execute("SELECT MAX(segmentId) FROM segments;").fetchone()[0])
+
+        queries = old_queries + ["replacementpage"]
+        rankings = {query: self.ranking(query) for query in queries}
+        for query in queries:
+            self.assertEqual(url in dict(rankings[query]), query == "replacementpage", query)
+        new_words = set(self.spider.stop_stem.transform(["replacementpage", "content"]))
+        self.assertEqual(self.live_words(url_id), new_words)
+
+        # the 3 oldest segments become one of level 1, without the old version of the page; no live segment is older
+        # than the tombstone anymore, so it is purged as well
+        self.merge(3)
+        self.assertEqual(self.connection.execute("SELECT level, docCount FROM segments ORDER BY segmentId;").fetchall(),
+                         [(0, 1), (1, 11)])
+        self.assertEqual(self.connection.execute("SELECT COUNT(*) FROM deleted_documents;").fetchone()[0], 0)
+        self.assertEqual(self.live_words(url_id), new_words)
+        for query in queries:
+            self.assertEqual(self.ranking(query), rankings[query], query)
+
+        # indexed a third time: the tombstone hides the version of the level-0 segment until both are merged away
+        self.reindex_page(3, "<html><head><title>replacement</title></head><body><p>thirdversion</p></body></html>")
+        self.assertEqual(self.live_words(url_id), set(self.spider.stop_stem.transform(["thirdversion"])))
+        self.assertEqual(self.ranking("replacementpage"), [])
+        self.merge(2)
+        self.assertEqual(self.connection.execute("SELECT level, docCount FROM segments;").fetchall(), [(2, 12)])
+        self.assertEqual(self.connection.execute("SELECT COUNT(*) FROM deleted_documents;").fetchone()[0], 0)
+        self.assertEqual(self.connection.execute("SELECT COUNT(*) FROM segment_forward_index WHERE urlId = ?;",
+                                                 (url_id,)).fetchone()[0], 1)
+        self.assertEqual(self.live_words(url_id), set(self.spider.stop_stem.transform(["thirdversion"])))
+        self.assertEqual(self.ranking("replacementpage"), [])
+        self.assertEqual([url for (url, _) in self.ranking("thirdversion")], [url])
+        for query in old_queries:
+            self.assertEqual(self.ranking(query), rankings[query], query)
+
+
+class KGramIndexTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = random.Random(3)
+        cls.words = sorted({"".join(rng.choices("abcdefgh", k=rng.randint(2, 11))) for _ in range(3000)})
+        cls.index = KGramIndex()
+        cls.index.extend(cls.words)
+
+    def test_closest_matches_brute_force(self):
+        rng = random.Random(9)
+        terms = []
+        for word in rng.sample(self.words, 150):
+            position = rng.randrange(len(word))
+            terms.append(word[:position] + rng.choice("abcdefghz") + word[position + 1:])
+            terms.append(word[:position] + word[position + 1:] + rng.choice("abch"))
+        for term in terms:
+            expected = (0, [])
+            for distance in range(1, default_max_distance(term) + 1):
+                words = sorted(word for word in self.words if levenshtein(term, word) == distance)
+                if words:
+                    expected = (distance, words)
+                    break
+            self.assertEqual(self.index.closest(term), expected, term)
+
+    def test_bounded_levenshtein(self):
+        rng = random.Random(4)
+        for _ in range(500):
+            (a, b) = rng.sample(self.words, 2)
+            distance = levenshtein(a, b)
+            for limit in range(4):
+                self.assertEqual(bounded_levenshtein(a, b, limit), min(distance, limit + 1))
+
+    def test_did_you_mean_suggests_words_not_stems(self):
+        corpus = SyntheticCorpus(num_docs=40, vocabulary_size=300, mean_doc_length=40, seed=7)
+        body_words = {word for doc_id in range(corpus.num_docs) for word in corpus.document(doc_id)[1]}
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = os.path.join(directory, "corpus.db")
+            build_corpus_db(db_path, corpus)
+            retrieval = Retrieval(db_path)
+            suggestions = 0
+            for word in sorted(body_words)[:60]:
+                if len(word) < 5:
+                    continue
+                misspelt = word[:2] + ("x" if word[2] != "x" else "y") + word[3:]
+                suggestion = retrieval.did_you_mean(f"{misspelt} AND {word}")
+                if suggestion is None:
+                    continue
+                suggestions += 1
+                # the correction is a word of the pages, not its stem
+                self.assertIn(suggestion.split(" AND ")[0], body_words)
+            self.assertGreater(suggestions, 0)
+
+
+class DatabaseCacheTests(SimpleTestCase):
+    def test_keeps_the_last_generations(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, f"main.gen{generation}.db") for generation in range(1, 4)]
+            for path in paths:
+                open(path, "w").close()
+            cache = DatabaseCache(size=2)
+            for path in paths:
+                cache.put(path, path)
+            self.assertEqual(list(cache.entries), paths[1:])
+            self.assertEqual(cache.get(paths[1]), paths[1])
+
+            os.remove(paths[2])
+            cache.put(paths[0], paths[0])
+            self.assertEqual(list(cache.entries), [paths[1], paths[0]])
+
+
+class SlowSpider:
+    """
+    Stands in for the Spider behind a Persister: stores the records slowly, in memory.
+    """
+
+    def __init__(self):
+        self.stored = []
+        self.committed = []
+        self.metrics = self
+        self.documents = self
+        self.db = self
+
+    def store_page(self, record, batch):
+        time.sleep(0.002)
+        batch.append(record)
+
+    def flush_batch(self, batch):
+        self.stored.extend(batch)
+        batch.clear()
+
+    def flush(self):
+        pass
+
+    def commit(self):
+        self.committed = list(self.stored)
+
+    def persist_wait(self, seconds):
+        pass
+
+
+class PersisterTests(SimpleTestCase):
+    def test_pages_of_cancelled_puts_are_written(self):
+        spider = SlowSpider()
+
+        async def crawl():
+            persister = Persister(spider, max_pending=2, batch_size=3, flush_interval=0.05)
+            persister.start()
+
+            async def worker(pages):
+                for page in pages:
+                    await persister.put(page)
+
+            workers = [asyncio.create_task(worker(range(number, 1000, 8))) for number in range(8)]
+            await asyncio.sleep(0.05)
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # the cancelled puts did not wait for room, their pages are left to close()
+            cancelled_pages = list(persister.overflow)
+            self.assertGreater(len(cancelled_pages), 0)
+            await persister.close()
+            self.assertEqual(persister.overflow, [])
+            return cancelled_pages
+
+        cancelled_pages = asyncio.run(crawl())
+        self.assertLessEqual(set(cancelled_pages), set(spider.committed))
+        # every page handed to put() is committed, each page of a worker once and in order
+        self.assertEqual(spider.committed, spider.stored)
+        for number in range(8):
+            pages = [page for page in spider.committed if page % 8 == number]
+            self.assertEqual(pages, list(range(number, number + 8 * len(pages), 8)))
+        self.assertEqual(len(set(spider.committed)), len(spider.committed))
+
+
+class FrontierStorageTests(SimpleTestCase):
+    def test_seen_url_set_matches_a_set_across_merges(self):
+        rng = random.Random(5)
+        urls = [f"http://example.com/{rng.randrange(30000)}.htm" for _ in range(20000)]
+        for bloom_bits_per_url in (0, 10):
+            seen = SeenUrlSet(expected_urls=len(urls), bloom_bits_per_url=bloom_bits_per_url)
+            expected = set()
+            for url in urls:
+                self.assertEqual(seen.add(url), url not in expected, url)
+                expected.add(url)
+            # several runs were sorted and merged
+            self.assertGreater(len(seen.runs[0]), 2 * RECENT_SIZE)
+            self.assertEqual(sum(len(run) for run in seen.runs) + len(seen.recent), len(expected))
+            self.assertEqual(len(seen), len(expected))
+            for number in range(0, 40000, 7):
+                url = f"http://example.com/{number}.htm"
+                self.assertEqual(url in seen, url in expected, url)
+
+    def test_spilling_queue_keeps_fifo_order_across_a_spill(self):
+        async def run():
+            frontier = SpillingQueue(max_in_memory=50)
+            order = []
+            spilled = 0
+            (next_item, total) = (0, 3 * SPILL_CHUNK_SIZE + 123)
+            rng = random.Random(2)
+            while next_item < total or not frontier.empty():
+                if next_item < total and (frontier.empty() or rng.random() < 0.6):
+                    await frontier.put((f"http://example.com/{next_item}.htm", str(next_item) if next_item % 3 else None))
+                    next_item += 1
+                else:
+                    order.append(await frontier.get())
+                spilled = max(spilled, frontier.spilled())
+                self.assertEqual(frontier.qsize(), next_item - len(order))
+            return (order, spilled)
+
+        (order, spilled) = asyncio.run(run())
+        self.assertGreater(spilled, 0)
+        self.assertEqual(order, [(f"http://example.com/{item}.htm", str(item) if item % 3 else None) for item in range(len(order))])
+
+    def test_frontier_policies_forget_crawled_pages(self):
+        corpus = SyntheticCorpus(num_docs=2000, seed=3)
+        url = "http://example.com/page{}.htm".format
+
+        async def run(policy):
+            frontier = PriorityFrontier(get_frontier_policy(policy))
+            (visited, enqueued) = (SeenUrlSet(), SeenUrlSet([url(0)]))
+            await frontier.put((url(0), None))
+            largest_state = 0
+            while not frontier.empty():
+                (current_url, _) = await frontier.get()
+                visited.add(current_url)
+                links = [url(link) for link in corpus.document(int(current_url[len(url("")) - 4:-4]))[2]]
+                frontier.observe_links(current_url, links, visited)
+                for link in links:
+                    if link not in visited and enqueued.add(link):
+                        frontier.put_nowait((link, "parent"))
+                state = vars(frontier.policy)
+                (size,) = [len(value) for value in state.values()]
+                # only queued URLs have statistics (every fetch succeeds here)
+                self.assertLessEqual(size, frontier.qsize())
+                largest_state = max(largest_state, size)
+            return (len(visited), largest_state)
+
+        for policy in ("depth", "inlinks", "opic"):
+            (crawled, largest_state) = asyncio.run(run(policy))
+            self.assertGreater(crawled, 1000)
+            self.assertGreater(largest_state, 0)
+
+
+class LinkGraphTests(SimpleTestCase):
+    def build(self, path: str, children: dict[str, str]) -> sqlite3.Connection:
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE id_to_url(urlId TEXT, url TEXT);")
+        connection.execute("CREATE TABLE id_to_page_title(urlId TEXT, title TEXT);")
+        connection.execute("CREATE TABLE id_to_children_url_id(urlId TEXT, childrenUrlId TEXT);")
+        connection.execute("CREATE TABLE id_to_parents_url_id(urlId TEXT, parentsUrlId TEXT);")
+        parents = {}
+        for (url_id, child_ids) in children.items():
+            connection.execute("INSERT INTO id_to_url VALUES(?, ?);", (url_id, f"http://example.com/{url_id}.htm"))
+            connection.execute("INSERT INTO id_to_page_title VALUES(?, ?);", (url_id, url_id))
+            connection.execute("INSERT INTO id_to_children_url_id VALUES(?, ?);", (url_id, child_ids))
+            for child_id in child_ids.split():
+                parents.setdefault(child_id, []).append(url_id)
+        connection.executemany("INSERT INTO id_to_parents_url_id VALUES(?, ?);",
+                               ((url_id, " ".join(parent_ids)) for (url_id, parent_ids) in parents.items()))
+        connection.commit()
+        LinkGraph.build_link_graph(connection)
+        return connection
+
+    def test_graphs_of_the_last_generations_are_cached(self):
+        children = {"a": "b c", "b": "c a", "c": "d"}
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, f"main.gen{generation}.db") for generation in range(1, 4)]
+            for path in paths:
+                connection = self.build(path, children)
+                graph = LinkGraph.open_link_graph(connection)
+                connection.close()
+                doc_ids = {url_id: doc_id for (doc_id, url_id) in enumerate("abcd")}
+                for (url_id, child_ids) in children.items():
+                    self.assertEqual(list(graph.child_ids(doc_ids[url_id])), [doc_ids[child_id] for child_id in child_ids.split()])
+                self.assertEqual(list(graph.parent_ids(doc_ids["c"])), [doc_ids["a"], doc_ids["b"]])
+            self.assertEqual(list(LinkGraph._graphs.entries), paths[1:])
+            del graph
+            LinkGraph._graphs.entries.clear()
+
+
+class LinkAnalysisTests(SimpleTestCase):
+    def csr(self, num_nodes: int, links: list[tuple[int, int]]) -> tuple[array, array]:
+        return LinkGraph.build_csr(num_nodes, array("I", [source for (source, _) in links]),
+                                   array("I", [target for (_, target) in links]))
+
+    def test_pagerank_of_small_graphs(self):
+        # a -> b, a -> c, b -> c, c -> a, with d = 0.85:
+        #   a = 0.05 + 0.85 c,  b = 0.05 + 0.85 a / 2,  c = 0.05 + 0.85 (a / 2 + b)
+        #   => a = 0.128625 / 0.3316875, b = 0.05 + 0.425 a, c = 0.0925 + 0.78625 a
+        a = 0.128625 / 0.3316875
+        ranks = pagerank(*self.csr(3, [(0, 1), (0, 2), (1, 2), (2, 0)]))
+        for (rank, expected) in zip(ranks, (a, 0.05 + 0.425 * a, 0.0925 + 0.78625 * a)):
+            self.assertAlmostEqual(rank, expected, places=6)
+        self.assertAlmostEqual(sum(ranks), 1)
+
+        # a -> b, b has no links and spreads its score over both pages:
+        #   a = (0.15 + 0.85 b) / 2,  b = a + 0.85 a  =>  a = 0.15 / 0.4275
+        ranks = pagerank(*self.csr(2, [(0, 1)]))
+        self.assertAlmostEqual(ranks[0], 0.15 / 0.4275, places=6)
+        self.assertAlmostEqual(ranks[1], 1.85 * 0.15 / 0.4275, places=6)
+
+    def test_hits_of_a_small_graph(self):
+        # a -> c, a -> d, b -> c: the authorities (c, d) are the principal eigenvector of [[2, 1], [1, 1]],
+        # i.e. proportional to (1, phi - 1), and the hubs (a, b) are c + d and c
+        phi = (1 + math.sqrt(5)) / 2
+        hubs, authorities = hits(*self.csr(4, [(0, 2), (0, 3), (1, 2)]))
+        for (score, expected) in zip(authorities, (0, 0, 1 / phi, 1 - 1 / phi)):
+            self.assertAlmostEqual(score, expected, places=6)
+        for (score, expected) in zip(hubs, (1 / phi, 1 - 1 / phi, 0, 0)):
+            self.assertAlmostEqual(score, expected, places=6)
+
+    def test_link_scores_are_blended_into_the_ranking(self):
+        corpus = SyntheticCorpus(num_docs=40, vocabulary_size=300, mean_doc_length=40, seed=19)
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = os.path.join(directory, "corpus.db")
+            build_corpus_db(db_path, corpus)
+            analyze_links(db_path, with_hits=True)
+            connection = sqlite3.connect(db_path)
+            link_scores = {name: dict(connection.execute(f"SELECT urlId, {name} FROM id_to_link_scores;").fetchall())
+                           for name in ("pageRank", "authorityScore")}
+            connection.close()
+            self.assertEqual(len(link_scores["pageRank"]), corpus.num_docs)
+            self.assertAlmostEqual(sum(link_scores["pageRank"].values()), 1)
+
+            for query in generate_query_log(corpus, 10, seed=19):
+                content_scores = {result["doc_id"]: result["score"]
+                                  for result in Retrieval(db_path, link_score_weight=0).retrieve(query, 100)}
+                # by default the PageRank, scaled so that the best page gets 2.0
+                for (retrieval, scores, weight) in ((Retrieval(db_path), link_scores["pageRank"], 2.0),
+                                                    (Retrieval(db_path, "authorityScore", 3.0), link_scores["authorityScore"], 3.0)):
+                    results = {result["doc_id"]: result["score"] for result in retrieval.retrieve(query, 100)}
+                    self.assertEqual(results.keys(), content_scores.keys(), query)
+                    max_score = max(scores.values())
+                    for (doc_id, score) in results.items():
+                        self.assertAlmostEqual(score, content_scores[doc_id] + weight * scores[doc_id] / max_score, places=9)
+
+
+class GenerationsTests(SimpleTestCase):
+    def stage(self, db_path: str, title: str) -> str:
+        staging_path = Generations.create_staging_database(db_path)
+        connection = sqlite3.connect(staging_path)
+        connection.execute("CREATE TABLE IF NOT EXISTS crawl(title TEXT);")
+        connection.execute("DELETE FROM crawl;")
+        connection.execute("INSERT INTO crawl VALUES(?);", (title,))
+        connection.commit()
+        connection.close()
+        return staging_path
+
+    def current_title(self, db_path: str) -> str:
+        connection = sqlite3.connect(Generations.current_database(db_path))
+        (title,) = connection.execute("SELECT title FROM crawl;").fetchone()
+        connection.close()
+        return title
+
+    def test_publish_keeps_published_and_running_generations(self):
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = os.path.join(directory, "main.db")
+            first = self.stage(db_path, "first")
+            Generations.publish_database(db_path, first)
+            self.assertEqual(self.current_title(db_path), "first")
+
+            # two concurrent crawls: the newer one publishes first, the older one is still writing
+            older = self.stage(db_path, "older")
+            newer = self.stage(db_path, "newer")
+            failed = self.stage(db_path, "failed")
+            Generations.release_generation(failed)
+            Generations.publish_database(db_path, newer)
+            self.assertEqual(self.current_title(db_path), "newer")
+            self.assertTrue(os.path.exists(older))
+            self.assertFalse(os.path.exists(failed))
+            self.assertEqual(Generations.published_generations(db_path), ["main.gen1.db", "main.gen3.db"])
+
+            # the older crawl is not published over the newer one, and is cleaned up after
+            with self.assertRaises(RuntimeError):
+                Generations.publish_database(db_path, older)
+            self.assertEqual(self.current_title(db_path), "newer")
+            last = self.stage(db_path, "last")
+            Generations.publish_database(db_path, last)
+            self.assertEqual(self.current_title(db_path), "last")
+            self.assertEqual([os.path.basename(path) for (_, path) in Generations.list_generations(db_path)],
+                             ["main.gen3.db", os.path.basename(last)])
+            self.assertEqual(sorted(name for name in os.listdir(directory) if name.endswith(".lock")), ["main.db.lock"])
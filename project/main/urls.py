@@ -4,4 +4,6 @@ from . import views
 urlpatterns = [
     path("", views.index, name="index"),
     path("clear-history/", views.clear_history, name="clear_history"),
+    path("similar/<str:url_id>/", views.similar_pages, name="similar_pages"),
+    path("metrics/", views.metrics, name="metrics"),
 ]
\ No newline at end of file
@@ -5,14 +5,21 @@ import uuid
 from django.contrib.auth import get_user_model
 from django.views.decorators.csrf import csrf_protect
 import json
-from Retrieval import Retrieval
 from django.urls import reverse
 from django.shortcuts import redirect
 from django.core.cache import cache
+from django.conf import settings
+from Metrics import REGISTRY
 # from django.http import HttpResponse
 
 # Create your views here.
 
+def get_retrieval():
+    """Retrieval is imported on first use, so starting a worker does not pay for the search engine imports."""
+    from Retrieval import Retrieval
+    return Retrieval("main.db", slow_query_seconds=settings.SEARCH_SLOW_QUERY_SECONDS, scoring=settings.SEARCH_SCORING,
+                     fuzzy=settings.SEARCH_FUZZY)
+
 def get_stemmed_keywords():
     """Get all stemmed keywords from the database with caching."""
     # Try to get keywords from cache first
@@ -21,7 +28,7 @@ def get_stemmed_keywords():
         return cached_keywords
     
     # If not in cache, fetch from database and cache the result
-    retrieval = Retrieval("main.db")
+    retrieval = get_retrieval()
     keywords = [word for word in retrieval.get_all_keywords() if word != '']
     cache.set('stemmed_keywords', keywords, timeout=3600)  # Cache for 1 hour
     return keywords
@@ -90,8 +97,9 @@ def index(request):
         # Handle stored query request
         if query_history.request:
             query_strings = query_history.request_query
-            retrieval = Retrieval("main.db")
+            retrieval = get_retrieval()
             query_results = retrieval.retrieve(query_strings)
+            did_you_mean = retrieval.did_you_mean(query_strings)
 
             save_query_to_history(query_history, query_strings)
             queries = get_user_query_history(cookie_id)
@@ -102,6 +110,7 @@ def index(request):
 
             return render(request, "index.html", {
                 "query_results": query_results,
+                "did_you_mean": did_you_mean,
                 "queries": queries,
                 "query_submitted": query_submitted,
                 "stem_keywords": stem_keywords
@@ -109,14 +118,16 @@ def index(request):
         
         # Handle new query request
         query_strings = request.POST.get('query', '')
-        retrieval = Retrieval("main.db")
+        retrieval = get_retrieval()
         query_results = retrieval.retrieve(query_strings)
+        did_you_mean = retrieval.did_you_mean(query_strings)
 
         save_query_to_history(query_history, query_strings)
         queries = get_user_query_history(cookie_id)
 
         return render(request, "index.html", {
             "query_results": query_results,
+            "did_you_mean": did_you_mean,
             "queries": queries,
             "query_submitted": query_submitted,
             "stem_keywords": stem_keywords
@@ -135,4 +146,21 @@ def clear_history(request):
                 return HttpResponse("Query history not found.", status=404)
         else:
             return HttpResponse("Cookie not found.", status=400)
-    return HttpResponse("Method not allowed.", status=405)
\ No newline at end of file
+    return HttpResponse("Method not allowed.", status=405)
+
+def similar_pages(request, url_id):
+    """Results page of the pages most similar to one search result (see SimilarPages.py)."""
+    retrieval = get_retrieval()
+    query_results = retrieval.similar_pages(url_id)
+    cookie_id = request.COOKIES.get('user_cookie_id')
+
+    return render(request, "index.html", {
+        "query_results": query_results,
+        "queries": get_user_query_history(cookie_id) if cookie_id else [],
+        "query_submitted": True,
+        "stem_keywords": get_stemmed_keywords()
+    })
+
+def metrics(request):
+    """Query latency counters and per-stage histograms in the Prometheus text format."""
+    return HttpResponse(REGISTRY.render_text(), content_type="text/plain; version=0.0.4")
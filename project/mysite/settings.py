@@ -128,3 +128,44 @@ STATICFILES_DIRS = [
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Search engine query logging
+# queries slower than this (in seconds) are logged with their stage breakdown, None disables the slow-query log
+
+SEARCH_SLOW_QUERY_SECONDS = 0.5
+
+# weighting of the body words: "tfidf" or "bm25" (see Scoring.py)
+
+SEARCH_SCORING = "tfidf"
+
+# misspelt query words are searched as their closest indexed words (otherwise they are only suggested, see KGramIndex.py)
+
+SEARCH_FUZZY = False
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+        'slow_queries': {
+            'class': 'logging.FileHandler',
+            'filename': BASE_DIR / 'slow_queries.log',
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'Retrieval': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+        'Retrieval.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            # only in slow_queries.log, not also on the console of the Retrieval logger
+            'propagate': False,
+        },
+    },
+}
@@ -0,0 +1,152 @@
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from Indexer import Indexer
+from ExternalSortIndexer import ExternalSortIndexer
+from ShardedIndex import unregister_shards
+from SegmentedIndex import drop_segments
+from ContentExtractor import ContentExtractor
+from StopwordRemovalStem import StopwordRemovalStem
+from DocumentStore import DocumentStore, TokenStore
+from Spider import parse_content
+from LinkGraph import build_link_graph
+from ConnectionManager import get_connection_manager
+from Generations import create_staging_database, publish_database, release_generation
+
+"""
+Rebuilds the index from the pages kept in the document store (see DocumentStore.py), without any network access,
+e.g. after a change of ContentExtractor, StopwordRemovalStem or the index format:
+
+    python reindex.py --db main.db --workers 4
+
+The blocks of the store are parsed and stemmed in parallel by the worker processes; the main process builds the
+index from their results in crawl order, like the Spider would. The link structure of the crawl is kept as it is.
+"""
+
+# rebuilt from scratch, the statistics tables are rewritten by the Indexer
+INDEX_TABLES = ("forward_index", "body_inverted_index", "title_inverted_index", "word_to_id", "id_to_word",
+                "minhash_signatures", "lsh_buckets")
+
+
+def extract_page(extractor: ContentExtractor, stop_stem: StopwordRemovalStem, url_id: str, record: dict) -> tuple:
+    """
+    Parses a stored page like the crawl does. Returns (url_id, last_modified, page_title, page_size, body_words,
+    title_words, words, kept_indexes), the last two for the token store.
+    """
+    (last_modified, page_title, page_size, words, body_words, title_words) = parse_content(
+        extractor, stop_stem, record["headers"], record["text"])
+    return (url_id, last_modified, page_title, page_size, body_words, title_words, words, stop_stem.keptIndexes(words))
+
+
+class BlockExtractor:
+    # parses the pages of one block at a time, with its own read-only connection
+    def __init__(self, db_path: str):
+        self.documents = DocumentStore(get_connection_manager(db_path).reader())
+        self.extractor = ContentExtractor()
+        self.stop_stem = StopwordRemovalStem()
+
+    def extract(self, block_id: int) -> list[tuple]:
+        return [extract_page(self.extractor, self.stop_stem, url_id, record)
+                for (url_id, record) in self.documents.block_documents(block_id)]
+
+
+# one BlockExtractor per worker process
+_worker = None
+
+
+def _init_worker(db_path: str) -> None:
+    global _worker
+    _worker = BlockExtractor(db_path)
+
+
+def _extract_block(block_id: int) -> list[tuple]:
+    return _worker.extract(block_id)
+
+
+def extracted_blocks(db_path: str, block_ids: list[int], workers: int = 1):
+    """
+    Yields the extracted pages of every block, in the order of `block_ids`.
+    """
+    if workers <= 1:
+        extractor = BlockExtractor(db_path)
+        for block_id in block_ids:
+            yield extractor.extract(block_id)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db_path,)) as pool:
+        yield from pool.map(_extract_block, block_ids)
+
+
+def reindex(db_path: str, workers: int = 1, memory_budget: float | None = None) -> int:
+    """
+    Replaces the index of `db_path` by one built from its document store and returns the number of pages indexed.
+    """
+    connection_manager = get_connection_manager(db_path)
+    db_connection = connection_manager.writer()
+    block_ids = DocumentStore(db_connection).block_ids()
+    if not block_ids:
+        print(f"{db_path} has no stored documents, crawl it again to fill the document store")
+        return 0
+
+    # the new index is a single, unsharded index
+    unregister_shards(db_connection)
+    drop_segments(db_connection)
+    with db_connection:
+        for table in INDEX_TABLES:
+            db_connection.execute(f"DROP TABLE IF EXISTS {table};")
+    indexer = ExternalSortIndexer(db_connection, memory_budget) if memory_budget is not None else Indexer(db_connection)
+    tokens = TokenStore(db_connection)
+    tokens.clear()
+
+    pages = 0
+    for block in extracted_blocks(db_path, block_ids, workers):
+        for (url_id, last_modified, page_title, page_size, body_words, title_words, words, kept_indexes) in block:
+            indexer.addNewWord(body_words)
+            indexer.buildBodyInvertedIndex(body_words, url_id)
+            indexer.buildForwardIndex(body_words, url_id)
+            if page_title:
+                indexer.addNewWord(title_words)
+                indexer.buildTitleInvertedIndex(title_words, url_id)
+                indexer.buildForwardIndex(title_words, url_id)
+            tokens.add(url_id, words, kept_indexes, body_words)
+
+        with db_connection:
+            db_connection.executemany("INSERT OR REPLACE INTO id_to_last_modification_date (urlId, lastModificationDate) VALUES (?, ?)",
+                                      [(page[0], page[1]) for page in block])
+            db_connection.executemany("INSERT OR REPLACE INTO id_to_page_title (urlId, pageTitle) VALUES (?, ?)",
+                                      [(page[0], page[2]) for page in block])
+            db_connection.executemany("INSERT OR REPLACE INTO id_to_page_size (urlId, pageSize) VALUES (?, ?)",
+                                      [(page[0], page[3]) for page in block])
+        pages += len(block)
+        print(f"Reindexed: {pages} pages...")
+
+    indexer.updateSQLiteDB()
+    if memory_budget is not None:
+        indexer.finalize()
+    db_connection.commit()
+    # the link graph file is not copied with the generation, and its crawled pages follow id_to_page_title
+    build_link_graph(db_connection)
+    connection_manager.checkpoint()
+    connection_manager.close()
+    return pages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the index from the stored pages, without crawling.")
+    parser.add_argument("--db", default="main.db")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes parsing the stored pages")
+    parser.add_argument("--memory-budget", type=float, default=None,
+                        help="build the index with sorted runs spilled to disk above this many MB, merged at the end")
+    args = parser.parse_args()
+
+    # like a crawl, the new index is built in a new generation of the database and then published
+    start_time = time.perf_counter()
+    staging_path = create_staging_database(args.db)
+    pages = reindex(staging_path, args.workers, args.memory_budget)
+    if not pages:
+        # the unpublished generation is removed by the next publish
+        release_generation(staging_path)
+        raise SystemExit(1)
+    publish_database(args.db, staging_path)
+    print(f"Reindexed {pages} pages in {time.perf_counter() - start_time:.2f} seconds, published {staging_path}")